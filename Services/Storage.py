@@ -1,6 +1,7 @@
 """ Module for defining persistent storage objects """
 import collections
-from Queue import Queue
+import threading
+from Queue import Empty, Queue
 
 #-----------------------------#
 # Storage Container Factories #
@@ -20,6 +21,9 @@ class BaseStorageContainerFactory(object):
     def makeSet(self):
         raise NotImplementedError()
 
+    def makeLock(self):
+        raise NotImplementedError()
+
     def initialize(self):
         pass
     
@@ -29,6 +33,14 @@ class BaseStorageContainerFactory(object):
 
 class LocalStorageContainerFactory(object):
     """ Factory that makes local python objects """
+
+    def __init__(self, threadSafe=True):
+        """
+        @param threadSafe: Make locked queues and locks, which can be shared between threads.
+                           Otherwise, make deque-based queues and no-op locks for a single thread.
+        @type threadSafe: bool
+        """
+        self._threadSafe = threadSafe
     
     def makeDict(self):
         return {}
@@ -37,11 +49,18 @@ class LocalStorageContainerFactory(object):
         return {}
 
     def makeQueue(self):
-        return Queue()
+        if self._threadSafe:
+            return Queue()
+        return DequeQueue()
 
     def makeSet(self):
         return set()
 
+    def makeLock(self):
+        if self._threadSafe:
+            return threading.Lock()
+        return NullLock()
+
 
 class GoogleAppEngineContainerFactory(object):
     """ Factory that makes local python objects """
@@ -68,6 +87,46 @@ class BaseStorageContainer(object):
     """ A basic storage container class """
     pass
 
+# Local Containers
+class DequeQueue(BaseStorageContainer):
+    """
+    FIFO queue on a deque, without the locks of Queue.Queue.
+    It has the non-blocking part of the Queue.Queue interface.
+    """
+    def __init__(self):
+        self._items = collections.deque()
+
+    def put(self, item):
+        self._items.append(item)
+
+    put_nowait = put
+
+    def get_nowait(self):
+        try:
+            return self._items.popleft()
+        except IndexError:
+            raise Empty
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+class NullLock(BaseStorageContainer):
+    """ Lock that does nothing, for containers used by a single thread """
+    def acquire(self, blocking=True):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, trace):
+        return False
+
 # Google App Engine Containers
 # @TODO: Define these
 class GoogleAppEnginePersistence(BaseStorageContainer):
@@ -1,21 +1,34 @@
+import cPickle
+import heapq
+import logging
+import threading
+import time
+import traceback
 import uuid
-from Queue import Empty
+from Queue import Empty, Queue
 from abc import ABCMeta, abstractmethod
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 from SKO_Architecture.Messaging import Message
 from SKO_Architecture.Services.Storage import LocalStorageContainerFactory
 
+logger = logging.getLogger(__name__)
+
 
 class TaskSpecification(object):
     """
     A specified task that has a method to initiate when ready,
     some list of provided arguments, and some requirements.
     """
+    CANCELLED_STATUS = -2
     ERROR_STATUS = -1
     WAITING_STATUS = 0
     EVALUATING_STATUS = 1
     DISPATCHED_STATUS = 2
     
-    def __init__(self, method, args=None, reqs=None, taskId=None):
+    DEFAULT_PRIORITY = 0
+    
+    def __init__(self, method, args=None, reqs=None, taskId=None, priority=None, deadline=None):
         """
         Description of a task that needs to be completed.
         @param method: Method that the task calls
@@ -26,14 +39,21 @@ class TaskSpecification(object):
         @type reqs: dict of {str : requirement}
         @param taskId: Unique id for the task
         @type taskId: uuid
+        @param priority: Priority of the task, higher runs first (None for DEFAULT_PRIORITY)
+        @type priority: int
+        @param deadline: Time (as time.time()) after which the task is cancelled, if not dispatched yet
+        @type deadline: float
         """
         if not args: args = {}
         if not reqs: reqs = {}
         if taskId is None: taskId = uuid.uuid4()
+        if priority is None: priority = self.DEFAULT_PRIORITY
         self._id = taskId
         self._method = method
         self._arguments = args
         self._requirements = reqs
+        self._priority = priority
+        self._deadline = deadline
         self._status = self.WAITING_STATUS
 
     def getId(self):
@@ -48,10 +68,38 @@ class TaskSpecification(object):
         """ Get the status of the task """
         return self._status
 
+    def getPriority(self):
+        """ Get the priority of the task (higher runs first) """
+        return self._priority
+
+    def getDeadline(self):
+        """ Get the deadline of the task, or None """
+        return self._deadline
+
+    def isExpired(self, now=None):
+        """ True if the deadline of the task has passed """
+        if self._deadline is None:
+            return False
+        if now is None: now = time.time()
+        return now > self._deadline
+
+    def cancel(self):
+        """ Cancel the task, so that it is never evaluated """
+        self._status = self.CANCELLED_STATUS
+
     def resetStatus(self):
         """ Reset the status to waiting """
         self._status = self.WAITING_STATUS
 
+    def setStatus(self, status):
+        """
+        Set the status of a task that was evaluated elsewhere
+        (e.g. a copy of it, in another process)
+        @param status: One of the *_STATUS values
+        @type status: int
+        """
+        self._status = status
+
     def __call__(self, requiredItems=None):
         """
         Evaluate the task
@@ -75,6 +123,324 @@ class TaskSpecification(object):
         return self._status
     
 
+def _evaluateTask(task, requirements):
+    """
+    Evaluate a task in an executor's worker. Errors are returned rather than
+    raised, so that every evaluation reports back to the dispatcher.
+    Module-level, so that process pools can pickle it.
+    @return: The task id, its final status, and the error and its traceback (if any)
+    @rtype: (uuid, int, Exception, str)
+    """
+    try:
+        status = task(requirements)
+    except Exception as error:
+        return (task.getId(), task.getStatus(), error, traceback.format_exc())
+    return (task.getId(), status, None, None)
+
+
+def _evaluatePickledTask(taskId, payload):
+    """
+    Evaluate a task pickled in the dispatcher's process (see PoolTaskExecutor),
+    reporting an error if it cannot be unpickled in the worker
+    @return: As _evaluateTask
+    @rtype: (uuid, int, Exception, str)
+    """
+    try:
+        task, requirements = cPickle.loads(payload)
+    except Exception as error:
+        return (taskId, TaskSpecification.ERROR_STATUS, error, traceback.format_exc())
+    return _evaluateTask(task, requirements)
+
+
+class BaseTaskExecutor(object):
+    """
+    Backend that evaluates the ready tasks of a TaskDispatcher.
+    Completed tasks are collected by the dispatcher with getCompleted.
+    """
+    _completionListener = None
+
+    def setCompletionListener(self, listener):
+        """
+        Set a callable to call (from any thread) whenever a task completes
+        @type listener: callable
+        """
+        self._completionListener = listener
+
+    def submit(self, task, requirements):
+        """
+        Start evaluating a task
+        @param task: The task to evaluate
+        @type task: TaskSpecification
+        @param requirements: Mapping of requirement specifications to their values
+        @type requirements: {Message : Value}
+        """
+        raise NotImplementedError()
+
+    def hasCapacity(self):
+        """ True if another task can be submitted now """
+        return True
+
+    def getInFlightCount(self):
+        """ Number of submitted tasks not collected yet """
+        return 0
+
+    def hasCompleted(self):
+        """ True if there are completed tasks to collect """
+        return False
+
+    def getCompleted(self):
+        """
+        Collect the tasks completed since the last call
+        @return: The tasks, their final status, and their error and its traceback (if any)
+        @rtype: list of (TaskSpecification, int, Exception, str)
+        """
+        return []
+
+    def waitForCompletion(self, timeout=None):
+        """
+        Block until a task completes, or the timeout (in seconds) passes
+        @return: True if a completed task is ready to collect
+        @rtype: bool
+        """
+        return False
+
+    def shutdown(self, wait=True):
+        """ Stop the executor, waiting for the submitted tasks if wait is True """
+        pass
+
+
+class InlineTaskExecutor(BaseTaskExecutor):
+    """
+    Executor that evaluates each task on the dispatcher's thread when it is
+    submitted.  Errors are raised to the dispatcher's caller.
+    """
+
+    def submit(self, task, requirements):
+        task(requirements)
+
+
+class PoolTaskExecutor(BaseTaskExecutor):
+    """
+    Executor that hands tasks to a pool of worker threads (or processes),
+    so that a slow task does not stall the dispatcher.  At most maxInFlight
+    tasks are submitted at once; beyond that, hasCapacity is False and the
+    ready tasks stay queued in the dispatcher (back-pressure).
+    With processes, the tasks (and their methods) must be picklable: a task
+    that cannot be sent to a worker, or whose result cannot be sent back,
+    completes with ERROR_STATUS.  The task objects in the dispatcher are
+    EVALUATING_STATUS until they complete.
+    """
+    IN_FLIGHT_PER_WORKER = 2
+
+    def __init__(self, workers=None, useProcesses=False, maxInFlight=None):
+        """
+        @param workers: Number of worker threads/processes (None for the CPU count)
+        @type workers: int
+        @param useProcesses: Use a process pool instead of a thread pool
+        @type useProcesses: bool
+        @param maxInFlight: Maximum of submitted tasks not collected yet
+        @type maxInFlight: int
+        """
+        if workers is None: workers = cpu_count()
+        if maxInFlight is None: maxInFlight = workers*self.IN_FLIGHT_PER_WORKER
+        if useProcesses:
+            self._pool = Pool(workers)
+        else:
+            self._pool = ThreadPool(workers)
+        self._useProcesses = useProcesses
+        self._maxInFlight = maxInFlight
+        self._inFlight = {}
+        # {task id : AsyncResult}, to find the evaluations that failed in the
+        # pool itself (the callback is only called on success)
+        self._results = {}
+        # Filled by the pool's result thread, drained by the dispatcher
+        self._completedQueue = Queue()
+        self._completed = []
+
+    def submit(self, task, requirements):
+        taskId = task.getId()
+        self._inFlight[taskId] = task
+        try:
+            if self._useProcesses:
+                # Pickle here rather than in the pool's thread, to catch the errors
+                payload = cPickle.dumps((task, requirements), cPickle.HIGHEST_PROTOCOL)
+                result = self._pool.apply_async(_evaluatePickledTask, (taskId, payload),
+                                                callback=self._onCompleted)
+                task.setStatus(TaskSpecification.EVALUATING_STATUS)
+            else:
+                result = self._pool.apply_async(_evaluateTask, (task, requirements),
+                                                callback=self._onCompleted)
+        except Exception as error:
+            self._onCompleted((taskId, TaskSpecification.ERROR_STATUS, error, traceback.format_exc()))
+            return
+        self._results[taskId] = result
+
+    def _onCompleted(self, result):
+        # Runs on the pool's result thread
+        self._completedQueue.put(result)
+        if self._completionListener is not None:
+            self._completionListener()
+
+    def hasCapacity(self):
+        return len(self._inFlight) < self._maxInFlight
+
+    def getInFlightCount(self):
+        return len(self._inFlight)
+
+    def _collectFailures(self):
+        for taskId, result in self._results.items():
+            if result.ready() and not result.successful():
+                del self._results[taskId]
+                try:
+                    result.get(0)
+                except Exception as error:
+                    self._completed.append((taskId, TaskSpecification.ERROR_STATUS, error,
+                                            traceback.format_exc()))
+
+    def hasCompleted(self):
+        if len(self._completed) > 0 or not self._completedQueue.empty():
+            return True
+        self._collectFailures()
+        return len(self._completed) > 0
+
+    def getCompleted(self):
+        results = self._completed
+        self._completed = []
+        while True:
+            try:
+                results.append(self._completedQueue.get_nowait())
+            except Empty:
+                break
+        completed = []
+        for taskId, status, error, trace in results:
+            task = self._inFlight.pop(taskId)
+            self._results.pop(taskId, None)
+            completed.append((task, status, error, trace))
+        return completed
+
+    def waitForCompletion(self, timeout=None):
+        if self.hasCompleted():
+            return True
+        try:
+            self._completed.append(self._completedQueue.get(True, timeout))
+        except Empty:
+            return self.hasCompleted()
+        return True
+
+    def shutdown(self, wait=True):
+        self._pool.close()
+        if wait:
+            self._pool.join()
+        else:
+            self._pool.terminate()
+
+
+class BaseRequirementSender(object):
+    """
+    Sends the requests for requirement values to the services that provide
+    them.  The values come back through TaskDispatcher.receiveRequirement.
+    """
+
+    def send(self, target, requirements):
+        """
+        Send one request for a batch of requirements
+        @param target: The service to ask (see TaskDispatcher.getRequirementTarget)
+        @type target: object
+        @param requirements: The requirements to ask for
+        @type requirements: list of requirement
+        """
+        raise NotImplementedError()
+
+
+class ReadyTaskQueue(object):
+    """
+    Queue of ready tasks, on a heap ordered by priority (higher first).
+    To prevent starvation, a task ages: its key is its enqueue time minus
+    its priority times the aging interval, so a task that has waited
+    agingInterval seconds longer counts as one priority level higher.
+    Tasks of the same key come out in FIFO order.
+    It keeps per-priority queue depths and wait times.
+    """
+
+    def __init__(self, agingInterval, lock=None):
+        """
+        @param agingInterval: Seconds of waiting worth one priority level
+        @type agingInterval: float
+        @param lock: Lock of the heap (None for a threading.Lock)
+        @type lock: lock
+        """
+        if lock is None: lock = threading.Lock()
+        self._agingInterval = agingInterval
+        self._heap = []
+        self._counter = 0
+        self._lock = lock
+        # {priority : queued tasks}
+        self._depths = {}
+        # {priority : [dequeued tasks, total wait, max wait, cancelled tasks]}
+        self._waits = {}
+
+    def put(self, item, priority=0):
+        """
+        @param item: (taskId, requirement values) of a ready task
+        @type item: tuple
+        @param priority: Priority of the task
+        @type priority: int
+        """
+        now = time.time()
+        with self._lock:
+            key = now - priority*self._agingInterval
+            heapq.heappush(self._heap, (key, self._counter, priority, now, item))
+            self._counter += 1
+            self._depths[priority] = self._depths.get(priority, 0) + 1
+
+    def get_nowait(self):
+        """ Pop the next ready task: (taskId, requirement values, priority) """
+        with self._lock:
+            if not self._heap:
+                raise Empty
+            key, counter, priority, enqueueTime, item = heapq.heappop(self._heap)
+            self._depths[priority] -= 1
+            wait = time.time() - enqueueTime
+            stats = self._waits.get(priority)
+            if stats is None:
+                stats = self._waits[priority] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += wait
+            stats[2] = max(stats[2], wait)
+        return item[0], item[1], priority
+
+    def addCancelled(self, priority):
+        """ Count a task of this priority that was cancelled instead of dispatched """
+        with self._lock:
+            stats = self._waits.get(priority)
+            if stats is None:
+                stats = self._waits[priority] = [0, 0.0, 0.0, 0]
+            stats[3] += 1
+
+    def qsize(self):
+        return len(self._heap)
+
+    def empty(self):
+        return not self._heap
+
+    def getMetrics(self):
+        """
+        Per-priority metrics
+        @return: {priority : {'depth', 'dequeued', 'cancelled', 'meanWait', 'maxWait'}}
+        @rtype: dict
+        """
+        with self._lock:
+            metrics = {}
+            for priority in set(self._depths) | set(self._waits):
+                dequeued, totalWait, maxWait, cancelled = self._waits.get(priority, [0, 0.0, 0.0, 0])
+                metrics[priority] = {'depth': self._depths.get(priority, 0),
+                                     'dequeued': dequeued,
+                                     'cancelled': cancelled,
+                                     'meanWait': totalWait/dequeued if dequeued else 0.0,
+                                     'maxWait': maxWait}
+            return metrics
+
+
 class TaskDispatcher(object):
     """
     A general task dispatcher that relies on task queues and
@@ -83,13 +449,59 @@ class TaskDispatcher(object):
     SEND_REQUIREMENT_ACTION = "Sent Requirement"
     DISPATCHED_TASK_ACTION = "Dispatched Task"
     PROCESSED_REQ_ACTION = "Processed Requirement"
+    COMPLETED_TASK_ACTION = "Completed Task"
+    WAITED_TASK_ACTION = "Waited for Task"
+    SENT_REQUESTS_ACTION = "Sent Requests"
+    CANCELLED_TASKS_ACTION = "Cancelled Expired Tasks"
+    WAIT_INTERVAL = 0.05
+    DRAIN_BUDGET = 100
+    AGING_INTERVAL = 1.0
+    LINGER_TIME = 0.01
+    MAX_BATCH_SIZE = 100
+    REQUEST_TIMEOUT = 5.0
+    MAX_RETRIES = 3
 
-    def __init__(self, tasks=None, dataFactory=None):
+    def __init__(self, tasks=None, dataFactory=None, executor=None, sender=None):
+        """
+        @param tasks: Tasks to add
+        @type tasks: list of TaskSpecification
+        @param dataFactory: Factory of the queues and maps
+        @type dataFactory: LocalStorageContainerFactory
+        @param executor: Backend that evaluates the ready tasks (None for inline)
+        @type executor: BaseTaskExecutor
+        @param sender: Sends the requests for requirements (None to not send them)
+        @type sender: BaseRequirementSender
+        """
         if tasks is None: tasks = []
         if dataFactory is None: dataFactory = LocalStorageContainerFactory()
+        if executor is None: executor = InlineTaskExecutor()
         self._dataFactory = dataFactory
+        self._executor = executor
+        self._sender = sender
+        # Requests not answered yet: {requirement : times sent}.  A requirement
+        # is requested once, however many tasks wait for it.
+        self._inFlightRequests = {}
+        # Heap of (timeout time, counter, requirement, times sent)
+        self._requestTimeouts = []
+        self._requestCounter = 0
+        # Requests lingering before they are sent in batches per target:
+        # {target : [requirement]}, {target : time of the first one}, and the
+        # set of the queued requirements (so that each is queued once)
+        self._outbox = {}
+        self._outboxTimes = {}
+        self._queuedRequests = set()
+        # Heap of (deadline, counter, taskId) of the tasks waiting for requirements
+        self._waitingDeadlines = []
+        self._deadlineCounter = 0
+        # Set when work arrives while the dispatcher sleeps waiting for it:
+        # _waiting marks the sleep, _workArrived any work since the last one
+        self._wakeup = threading.Event()
+        self._waiting = False
+        self._workArrived = False
+        self._stopped = False
+        self._executor.setCompletionListener(self._signalWork)
         self._taskIdMap = self._makeMap()
-        self._readyTasks = self._makeQueue()
+        self._readyTasks = self._makeReadyQueue()
         self._newRequirements = self._makeQueue()
         self._receivedRequirements = self._makeQueue()
         self._requirementMap = self._makeRequirementMap()
@@ -103,6 +515,9 @@ class TaskDispatcher(object):
     def _makeQueue(self):
         return self._dataFactory.makeQueue()
 
+    def _makeReadyQueue(self):
+        return ReadyTaskQueue(self.AGING_INTERVAL, self._dataFactory.makeLock())
+
     def _makeRequirementMap(self):
         return RequirementMap(self._dataFactory)
 
@@ -122,27 +537,89 @@ class TaskDispatcher(object):
         taskId = task.getId()
         if taskId not in self._taskIdMap:
             self._taskIdMap[taskId] = task
-            taskReqs = task.getRequirements()
+            taskReqs = set([self.makeCanonicalRequirement(req) for req in task.getRequirements()])
             filledReqs = self._requirementMap.fillRequirements(taskReqs)
             # If everything filled, put in the ready tasks list
             if len(filledReqs) == len(taskReqs):
-                self._readyTasks.put((taskId, filledReqs))
+                self._putReadyTask(task, filledReqs)
             # Otherwise, add to waiting tasks and register requirements
             else:
                 newRequirements = self._requirementMap.addTask(task.getId(), taskReqs)
                 for req in newRequirements:
                     self._newRequirements.put(req)
+                if task.getDeadline() is not None:
+                    heapq.heappush(self._waitingDeadlines, (task.getDeadline(), self._deadlineCounter, taskId))
+                    self._deadlineCounter += 1
+            self._signalWork()
         elif errorOnDuplicate:
             raise KeyError("Duplicate task added: %s"%(taskId,))
 
+    def _putReadyTask(self, task, requirements):
+        # Give the values back under the task's own requirements
+        values = dict([(req, requirements[self.makeCanonicalRequirement(req)])
+                       for req in task.getRequirements()])
+        self._readyTasks.put((task.getId(), values), task.getPriority())
+
     def _dispatchNextTask(self):
         try:
-            taskId, requirements = self._readyTasks.get_nowait()
+            taskId, requirements, priority = self._readyTasks.get_nowait()
         except Empty:
-            return
+            return False
         task = self._taskIdMap[taskId]
         del self._taskIdMap[taskId]
-        task(requirements)
+        if task.isExpired():
+            self._cancelTask(task)
+            self._readyTasks.addCancelled(priority)
+        else:
+            self._executor.submit(task, requirements)
+        return True
+
+    def _cancelTask(self, task):
+        task.cancel()
+        logger.info("Task %s cancelled: its deadline has passed", task.getId())
+
+    def cancelExpiredTasks(self):
+        """
+        Cancel the tasks still waiting for requirements whose deadline has passed.
+        (Ready tasks are cancelled when they come out of the ready queue.)
+        The dispatcher loop calls this on every action.
+        @return: Number of cancelled tasks
+        @rtype: int
+        """
+        now = time.time()
+        count = 0
+        while self._waitingDeadlines and self._waitingDeadlines[0][0] < now:
+            deadline, counter, taskId = heapq.heappop(self._waitingDeadlines)
+            if not self._requirementMap.hasTask(taskId):
+                # Ready, failed or cancelled already
+                continue
+            task = self._taskIdMap[taskId]
+            self._requirementMap.removeTask(taskId)
+            del self._taskIdMap[taskId]
+            self._cancelTask(task)
+            self._readyTasks.addCancelled(task.getPriority())
+            count += 1
+        return count
+
+    def _getDeadlineWait(self):
+        """ Seconds until the next waiting task expires, or None """
+        if not self._waitingDeadlines:
+            return None
+        return max(0.0, self._waitingDeadlines[0][0] - time.time())
+
+    def getReadyQueueMetrics(self):
+        """ Per-priority depth and wait times of the ready queue (see ReadyTaskQueue.getMetrics) """
+        return self._readyTasks.getMetrics()
+
+    def _processCompletedTasks(self):
+        for task, status, error, trace in self._executor.getCompleted():
+            task.setStatus(status)
+            if error is not None:
+                self._onTaskError(task, error, trace)
+
+    def _onTaskError(self, task, error, trace):
+        """ Handle a task that raised an error in the executor """
+        logger.error("Task %s failed: %s\n%s", task.getId(), error, trace)
         
     # Requirement Accessors
     def isValidRequirementMessage(self, message):
@@ -151,13 +628,128 @@ class TaskDispatcher(object):
     def makeCanonicalMessage(self, message):
         """ Remove irrelevant information to make message canonical """
         return message
+
+    def makeCanonicalRequirement(self, requirement):
+        """
+        Remove irrelevant information to make a requirement canonical, so that
+        equal requirements of different tasks are requested (and filled) once
+        """
+        return requirement
+
+    def getRequirementTarget(self, requirement):
+        """ The service to request a requirement from (requests are batched per target) """
+        return None
     
     def _sendNextRequirement(self):
         try:
             requirement = self._newRequirements.get_nowait()
         except Empty:
+            return False
+        # Queue a request for the required value, unless it is requested already
+        if self._sender is not None and requirement not in self._inFlightRequests:
+            self._queueRequest(requirement, 0)
+        return True
+
+    def _queueRequest(self, requirement, sent):
+        self._inFlightRequests[requirement] = sent
+        if requirement in self._queuedRequests:
             return
-        # Send a message requesting the required value here
+        self._queuedRequests.add(requirement)
+        target = self.getRequirementTarget(requirement)
+        if target not in self._outbox:
+            self._outbox[target] = []
+            self._outboxTimes[target] = time.time()
+        self._outbox[target].append(requirement)
+
+    def _sendRequests(self, target):
+        queued = self._outbox.pop(target)
+        del self._outboxTimes[target]
+        self._queuedRequests.difference_update(queued)
+        # Skip the requirements answered while they lingered (or waited for a retry)
+        requirements = [req for req in queued if req in self._inFlightRequests]
+        timeout = time.time() + self.REQUEST_TIMEOUT
+        for req in requirements:
+            sent = self._inFlightRequests[req] + 1
+            self._inFlightRequests[req] = sent
+            heapq.heappush(self._requestTimeouts, (timeout, self._requestCounter, req, sent))
+            self._requestCounter += 1
+        for start in xrange(0, len(requirements), self.MAX_BATCH_SIZE):
+            try:
+                self._sender.send(target, requirements[start:start + self.MAX_BATCH_SIZE])
+            except Exception:
+                # Handled like a lost request: retried on timeout
+                logger.exception("Sending requests to %s failed", target)
+
+    def _flushOutbox(self, now, force=False):
+        """ Send the batches that are full or have lingered long enough """
+        targets = [target for target, requirements in self._outbox.iteritems()
+                   if force or len(requirements) >= self.MAX_BATCH_SIZE or
+                   now - self._outboxTimes[target] >= self.LINGER_TIME]
+        for target in targets:
+            self._sendRequests(target)
+        return len(targets)
+
+    def _checkRequestTimeouts(self, now):
+        """ Retry the requests that timed out, or fail their tasks after MAX_RETRIES """
+        count = 0
+        while self._requestTimeouts and self._requestTimeouts[0][0] <= now:
+            timeout, counter, req, sent = heapq.heappop(self._requestTimeouts)
+            if self._inFlightRequests.get(req) != sent:
+                # Answered, or sent again since
+                continue
+            count += 1
+            if len(self._requirementMap.getTasksWithRequirement(req)) == 0:
+                # No task waits for it anymore
+                del self._inFlightRequests[req]
+            elif sent <= self.MAX_RETRIES:
+                self._queueRequest(req, sent)
+            else:
+                del self._inFlightRequests[req]
+                self._failRequirement(req)
+        return count
+
+    def _failRequirement(self, req):
+        taskIds = list(self._requirementMap.getTasksWithRequirement(req))
+        tasks = []
+        for taskId in taskIds:
+            self._requirementMap.removeTask(taskId)
+            task = self._taskIdMap[taskId]
+            del self._taskIdMap[taskId]
+            task.setStatus(TaskSpecification.ERROR_STATUS)
+            tasks.append(task)
+        self._onRequirementFailed(req, tasks)
+
+    def _onRequirementFailed(self, req, tasks):
+        """ Handle the tasks that failed because a requirement was never received """
+        logger.error("Requirement %s not received after %s retries; %s task(s) failed",
+                     req, self.MAX_RETRIES, len(tasks))
+
+    def _serviceRequests(self):
+        """ Send due batches of requests and handle timeouts; return the number handled """
+        if self._sender is None:
+            return 0
+        now = time.time()
+        return self._checkRequestTimeouts(now) + self._flushOutbox(now)
+
+    def _getRequestWait(self):
+        """ Seconds until requests have to be sent or checked for timeout, or None """
+        times = [sentTime + self.LINGER_TIME for sentTime in self._outboxTimes.itervalues()]
+        if self._requestTimeouts:
+            times.append(self._requestTimeouts[0][0])
+        if not times:
+            return None
+        return max(0.0, min(times) - time.time())
+
+    def _getTimerWait(self):
+        """ Seconds until requests or waiting tasks have to be checked, or None """
+        waits = [wait for wait in (self._getRequestWait(), self._getDeadlineWait()) if wait is not None]
+        if not waits:
+            return None
+        return min(waits)
+
+    def getInFlightRequestCount(self):
+        """ Number of requirements requested and not received yet """
+        return len(self._inFlightRequests)
         
     def receiveRequirement(self, message):
         """
@@ -167,14 +759,16 @@ class TaskDispatcher(object):
         message = self.makeCanonicalMessage(message)
         if self.isValidRequirementMessage(message):
             self._receivedRequirements.put(message)
+            self._signalWork()
             
     def _processNextReceivedRequirement(self):
         try:
             message = self._receivedRequirements.get_nowait()
         except Empty:
-            return
+            return False
         value = message.getResult()
-        req = message.getRequest()
+        req = self.makeCanonicalRequirement(message.getRequest())
+        self._inFlightRequests.pop(req, None)
         waitingTaskIds = self._requirementMap.getTasksWithRequirement(req)
         if len(waitingTaskIds) > 0:
             self._requirementMap.setRequirementValue(req, value)
@@ -183,26 +777,152 @@ class TaskDispatcher(object):
             for taskId in tasksReady:
                 requirements = self._requirementMap.getTaskRequirementValues(taskId)
                 self._requirementMap.removeTask(taskId)
-                self._readyTasks.put((taskId, requirements))
+                self._putReadyTask(self._taskIdMap[taskId], requirements)
+        return True
 
     # Execution Flow
     def doAction(self):
-        if self._newRequirements.qsize() > 0:
+        if self._executor.hasCompleted():
+            self._processCompletedTasks()
+            return self.COMPLETED_TASK_ACTION
+        elif self.cancelExpiredTasks() > 0:
+            return self.CANCELLED_TASKS_ACTION
+        elif self._serviceRequests() > 0:
+            return self.SENT_REQUESTS_ACTION
+        elif self._newRequirements.qsize() > 0:
             self._sendNextRequirement()
             return self.SEND_REQUIREMENT_ACTION
-        elif self._readyTasks.qsize() > 0:
+        elif self._readyTasks.qsize() > 0 and self._executor.hasCapacity():
             self._dispatchNextTask()
             return self.DISPATCHED_TASK_ACTION
         elif self._receivedRequirements.qsize() > 0:
             self._processNextReceivedRequirement()
             return self.PROCESSED_REQ_ACTION
+        elif self._outbox:
+            # Nothing else to do: send the lingering requests when due
+            if self._sendLingeringRequests():
+                return self.SENT_REQUESTS_ACTION
+            return self.WAITED_TASK_ACTION
+        elif self._executor.getInFlightCount() > 0:
+            # Nothing else to do until a task completes or new work arrives
+            self._waitForWork(self.WAIT_INTERVAL)
+            return self.WAITED_TASK_ACTION
         else:
             return None
 
-    def run(self, runWhenIdle=False):
-        hasAction = True
-        while hasAction or runWhenIdle:
-            hasAction = self.doAction()
+    def _sendLingeringRequests(self):
+        """
+        Wait for the linger time, then send the batches.  New work ends the wait
+        early (it may add to the batches), and they are sent on a later call.
+        @return: True if the batches were sent
+        @rtype: bool
+        """
+        if self._waitForWork(self._getRequestWait()) and not self._stopped:
+            return False
+        self._flushOutbox(time.time(), True)
+        return True
+
+    def doActions(self, budget=None):
+        """
+        Drain mode: do up to budget actions of each kind in one cycle
+        (send requirements, dispatch ready tasks, process received requirements),
+        rather than one action per call.  The budget keeps one busy queue
+        from starving the others.
+        @param budget: Maximum actions per queue in this cycle (None for DRAIN_BUDGET)
+        @type budget: int
+        @return: Number of actions done, 0 if there was nothing to do
+        @rtype: int
+        """
+        if budget is None: budget = self.DRAIN_BUDGET
+        count = 0
+        if self._executor.hasCompleted():
+            self._processCompletedTasks()
+            count += 1
+        count += self.cancelExpiredTasks()
+        count += self._drain(self._sendNextRequirement, budget)
+        count += self._serviceRequests()
+        dispatched = 0
+        while (dispatched < budget and self._executor.hasCapacity() and
+               self._dispatchNextTask()):
+            dispatched += 1
+        count += dispatched
+        count += self._drain(self._processNextReceivedRequirement, budget)
+        if count == 0 and self._outbox:
+            self._sendLingeringRequests()
+            count += 1
+        elif count == 0 and self._executor.getInFlightCount() > 0:
+            # Nothing else to do until a task completes or new work arrives
+            self._waitForWork(self.WAIT_INTERVAL)
+        return count
+
+    def _drain(self, action, budget):
+        count = 0
+        while count < budget and action():
+            count += 1
+        return count
+
+    def _isIdle(self, drain, budget):
+        if drain:
+            return self.doActions(budget) == 0 and self._executor.getInFlightCount() == 0
+        return self.doAction() is None
+
+    def _signalWork(self):
+        """
+        Note that work arrived, waking up the dispatcher if it is waiting.
+        The event is only set then, so adding work to a busy (or unthreaded)
+        dispatcher costs no lock.
+        """
+        self._workArrived = True
+        if self._waiting:
+            self._wakeup.set()
+
+    def _waitForWork(self, timeout=None):
+        """ Sleep until work arrives or the timeout passes; True if woken up """
+        self._waiting = True
+        # Work signalled before _waiting was set did not set the event
+        woken = self._workArrived or self._wakeup.wait(timeout)
+        self._waiting = False
+        # Safe to clear: the queues are checked again after waking up
+        self._workArrived = False
+        self._wakeup.clear()
+        return woken
+
+    def run(self, runWhenIdle=False, idleTimeout=None, drain=False, budget=None):
+        """
+        Do actions until there are none left, or until stop is called
+        @param runWhenIdle: Keep running when idle, sleeping until work arrives
+        @type runWhenIdle: bool
+        @param idleTimeout: Return after being idle this many seconds (None to wait for stop)
+        @type idleTimeout: float
+        @param drain: Use doActions (drain mode) rather than doAction
+        @type drain: bool
+        @param budget: Per-queue budget of each drain cycle (see doActions)
+        @type budget: int
+        """
+        try:
+            while not self._stopped:
+                if self._isIdle(drain, budget):
+                    if not runWhenIdle:
+                        break
+                    timerWait = self._getTimerWait()
+                    if timerWait is not None and (idleTimeout is None or timerWait < idleTimeout):
+                        # Wake up in time to check the requests and deadlines
+                        self._waitForWork(timerWait)
+                    elif not self._waitForWork(idleTimeout) and idleTimeout is not None:
+                        break
+        finally:
+            self._stopped = False
+
+    def stop(self):
+        """ Make run return, from another thread (or from a task) """
+        self._stopped = True
+        self._signalWork()
+
+    def shutdown(self, wait=True):
+        """ Stop the executor, collecting the tasks still running if wait is True """
+        self._executor.shutdown(wait)
+        if wait:
+            self._processCompletedTasks()
 
 
 class RequirementMap(object):
@@ -253,6 +973,9 @@ class RequirementMap(object):
             else:
                 self._tasksByReq[req].remove(taskId)
 
+    def hasTask(self, taskId):
+        return taskId in self._taskReqs
+
     def getRequirementsForTask(self, taskId):
         return self._taskReqs[taskId]
 
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import unittest
+import SKO_Architecture.Services.Tests.TaskManager_UnitTests as TaskManager_UnitTests
+
+def TestSuite():
+    """
+    Returns a TestSuite object that covers the Services module
+    """
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    modules = [TaskManager_UnitTests]
+    for m in modules:
+        suite.addTests(loader.loadTestsFromModule(m))
+    return suite
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(not unittest.TextTestRunner().run(TestSuite()))
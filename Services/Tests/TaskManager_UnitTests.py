@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest.case
+from SKO_Architecture.Services.Storage import LocalStorageContainerFactory
+from SKO_Architecture.Services.TaskManager import (TaskSpecification, TaskDispatcher, PoolTaskExecutor,
+                                                   ReadyTaskQueue, BaseRequirementSender)
+
+class UnpicklableError(Exception):
+    """ An error that cannot be sent back from a worker process """
+    def __init__(self):
+        super(UnpicklableError, self).__init__("unpicklable")
+        self.callback = lambda: None
+
+def doNothing(**kwds):
+    pass
+
+def fail(**kwds):
+    raise ValueError("Task failed")
+
+def failUnpicklable(**kwds):
+    raise UnpicklableError()
+
+class Reply(object):
+    """ A message carrying the value of a requirement """
+    def __init__(self, request, result):
+        self._request = request
+        self._result = result
+
+    def getRequest(self):
+        return self._request
+
+    def getResult(self):
+        return self._result
+
+class RecordingDispatcher(TaskDispatcher):
+    """ A dispatcher that records the failed tasks instead of logging them """
+    def __init__(self, *args, **kwds):
+        self.errors = []
+        super(RecordingDispatcher, self).__init__(*args, **kwds)
+
+    def _onTaskError(self, task, error, trace):
+        self.errors.append((task, error))
+
+
+class PoolTaskExecutorTest(unittest.case.TestCase):
+    """ Unit test for TaskDispatcher with PoolTaskExecutor """
+
+    def runTasks(self, tasks, useProcesses=False):
+        executor = PoolTaskExecutor(2, useProcesses)
+        dispatcher = RecordingDispatcher(tasks, executor=executor)
+        try:
+            dispatcher.run(drain=True)
+        finally:
+            dispatcher.shutdown()
+        return dispatcher
+
+    def testThreadsRunAllTasks(self):
+        """ Test that every task is evaluated by the threads, at most maxInFlight at once """
+        lock = threading.Lock()
+        running = [0, 0]
+        def work(**kwds):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+        executor = PoolTaskExecutor(4, maxInFlight=3)
+        tasks = [TaskSpecification(work) for i in xrange(20)]
+        dispatcher = TaskDispatcher(tasks, executor=executor)
+        dispatcher.run(drain=True)
+        dispatcher.shutdown()
+        self.assertEqual([task.getStatus() for task in tasks], [TaskSpecification.DISPATCHED_STATUS]*20)
+        self.assertTrue(1 < running[1] <= 3)
+
+    def testFailingTask(self):
+        """ Test that a task raising an error ends with ERROR_STATUS, with threads and processes """
+        for useProcesses in (False, True):
+            task = TaskSpecification(fail)
+            dispatcher = self.runTasks([task, TaskSpecification(doNothing)], useProcesses)
+            self.assertEqual(task.getStatus(), TaskSpecification.ERROR_STATUS)
+            self.assertEqual([(t, type(e)) for t, e in dispatcher.errors], [(task, ValueError)])
+
+    def testUnpicklableTask(self):
+        """ Test that a task that cannot be sent to a process ends with ERROR_STATUS """
+        task = TaskSpecification(lambda: None)
+        dispatcher = self.runTasks([task], True)
+        self.assertEqual(task.getStatus(), TaskSpecification.ERROR_STATUS)
+        self.assertEqual(len(dispatcher.errors), 1)
+
+    def testUnpicklableResult(self):
+        """ Test that a task whose error cannot be sent back from a process ends with ERROR_STATUS """
+        task = TaskSpecification(failUnpicklable)
+        dispatcher = self.runTasks([task], True)
+        self.assertEqual(task.getStatus(), TaskSpecification.ERROR_STATUS)
+        self.assertEqual(len(dispatcher.errors), 1)
+
+
+class RunLoopTest(unittest.case.TestCase):
+    """ Unit test for TaskDispatcher.run waiting for work """
+
+    def testIdleTimeout(self):
+        """ Test that an idle dispatcher returns after the idle timeout """
+        dispatcher = TaskDispatcher()
+        start = time.time()
+        dispatcher.run(runWhenIdle=True, idleTimeout=0.2)
+        self.assertTrue(0.2 <= time.time() - start < 2)
+
+    def testWakeUp(self):
+        """ Test that a waiting dispatcher wakes up for tasks and requirements from another thread """
+        for executor in (None, PoolTaskExecutor(2)):
+            ran = threading.Event()
+            dispatcher = TaskDispatcher(executor=executor)
+            thread = threading.Thread(target=dispatcher.run, kwargs={'runWhenIdle': True})
+            thread.start()
+            time.sleep(0.1)
+
+            dispatcher.addTask(TaskSpecification(lambda: ran.set()))
+            self.assertTrue(ran.wait(2))
+            ran.clear()
+            dispatcher.addTask(TaskSpecification(lambda value: ran.set(), reqs={'value': 'R'}))
+            time.sleep(0.1)
+            self.assertFalse(ran.is_set())
+            dispatcher.receiveRequirement(Reply('R', 1))
+            self.assertTrue(ran.wait(2))
+
+            dispatcher.stop()
+            thread.join(2)
+            self.assertFalse(thread.is_alive())
+            dispatcher.shutdown()
+
+    def testStopBeforeRun(self):
+        """ Test that stop makes the next run return at once, and only that one """
+        dispatcher = TaskDispatcher()
+        dispatcher.stop()
+        dispatcher.run(runWhenIdle=True)
+        start = time.time()
+        dispatcher.run(runWhenIdle=True, idleTimeout=0.1)
+        self.assertTrue(time.time() - start >= 0.1)
+
+    def testNoEventWhileBusy(self):
+        """ Test that work added to a dispatcher that does not wait does not set the event """
+        dispatcher = TaskDispatcher(dataFactory=LocalStorageContainerFactory(threadSafe=False))
+        dispatcher.addTask(TaskSpecification(doNothing, reqs={'value': 'R'}))
+        dispatcher.receiveRequirement(Reply('R', 1))
+        self.assertFalse(dispatcher._wakeup.is_set())
+        dispatcher.run()
+
+
+class DrainTest(unittest.case.TestCase):
+    """ Unit test for the drain mode of TaskDispatcher """
+
+    def makeDispatcher(self):
+        return TaskDispatcher(dataFactory=LocalStorageContainerFactory(threadSafe=False))
+
+    def testBudget(self):
+        """ Test that a drain cycle dispatches at most the budget of tasks """
+        dispatcher = self.makeDispatcher()
+        tasks = [TaskSpecification(doNothing) for i in xrange(12)]
+        for task in tasks:
+            dispatcher.addTask(task)
+        self.assertEqual([dispatcher.doActions(5) for i in xrange(4)], [5, 5, 2, 0])
+        self.assertEqual([task.getStatus() for task in tasks], [TaskSpecification.DISPATCHED_STATUS]*12)
+
+    def testDrainRunsEveryTask(self):
+        """ Test that the drain mode, not thread-safe, evaluates the tasks with their requirements """
+        dispatcher = self.makeDispatcher()
+        values = []
+        for i in xrange(300):
+            reqs = {'value': 'R%d' % (i % 7)} if i % 2 else None
+            dispatcher.addTask(TaskSpecification(lambda i, value=None: values.append((i, value)), {'i': i}, reqs))
+        for i in xrange(7):
+            dispatcher.receiveRequirement(Reply('R%d' % i, i))
+        dispatcher.run(drain=True, budget=16)
+        self.assertEqual(sorted(values), [(i, i % 7 if i % 2 else None) for i in xrange(300)])
+
+
+class SchedulingTest(unittest.case.TestCase):
+    """ Unit test for the priorities and deadlines of TaskDispatcher """
+
+    def testPriorityOrder(self):
+        """ Test that the ready tasks run by priority, then in FIFO order """
+        order = []
+        priorities = [0, 5, 1, 5, 3, 0]
+        dispatcher = TaskDispatcher()
+        for i, priority in enumerate(priorities):
+            dispatcher.addTask(TaskSpecification(lambda i: order.append(i), {'i': i}, priority=priority))
+        dispatcher.run()
+        self.assertEqual(order, [1, 3, 4, 2, 0, 5])
+
+    def testAging(self):
+        """ Test that a task waiting longer than its priority gap times the aging interval runs first """
+        queue = ReadyTaskQueue(0.1)
+        queue.put(('old', {}), 0)
+        time.sleep(0.3)
+        queue.put(('new', {}), 2)
+        queue.put(('newer', {}), 5)
+        self.assertEqual([queue.get_nowait()[0] for i in xrange(3)], ['newer', 'old', 'new'])
+        metrics = queue.getMetrics()
+        self.assertEqual(sorted(metrics), [0, 2, 5])
+        self.assertTrue(metrics[0]['maxWait'] >= 0.3)
+
+    def testExpiredWaitingTask(self):
+        """ Test that a task waiting for a requirement is cancelled at its deadline """
+        dispatcher = TaskDispatcher()
+        task = TaskSpecification(fail, reqs={'value': 'R'}, priority=3, deadline=time.time() + 0.1)
+        dispatcher.addTask(task)
+        start = time.time()
+        dispatcher.run(runWhenIdle=True, idleTimeout=1.0)
+        self.assertEqual(task.getStatus(), TaskSpecification.CANCELLED_STATUS)
+        self.assertTrue(time.time() - start < 1.5)
+        dispatcher.receiveRequirement(Reply('R', 1))
+        dispatcher.run()
+        self.assertEqual(task.getStatus(), TaskSpecification.CANCELLED_STATUS)
+        self.assertEqual(dispatcher.getReadyQueueMetrics()[3]['cancelled'], 1)
+
+    def testExpiredReadyTask(self):
+        """ Test that a ready task is cancelled instead of dispatched after its deadline """
+        dispatcher = TaskDispatcher()
+        expired = TaskSpecification(fail, deadline=time.time() - 1)
+        task = TaskSpecification(doNothing, deadline=time.time() + 60)
+        dispatcher.addTask(expired)
+        dispatcher.addTask(task)
+        dispatcher.run()
+        self.assertEqual(expired.getStatus(), TaskSpecification.CANCELLED_STATUS)
+        self.assertEqual(task.getStatus(), TaskSpecification.DISPATCHED_STATUS)
+        metrics = dispatcher.getReadyQueueMetrics()[TaskSpecification.DEFAULT_PRIORITY]
+        self.assertEqual((metrics['dequeued'], metrics['cancelled'], metrics['depth']), (2, 1, 0))
+
+
+class RecordingSender(BaseRequirementSender):
+    """ A sender that records the requests instead of sending them """
+    def __init__(self):
+        self.sent = []
+
+    def send(self, target, requirements):
+        self.sent.append((target, list(requirements)))
+
+class RequestingDispatcher(TaskDispatcher):
+    """
+    A dispatcher that asks the service named before ':' in a requirement,
+    and records the requirements never received instead of logging them
+    """
+    LINGER_TIME = 0.1
+    REQUEST_TIMEOUT = 0.02
+
+    def __init__(self, *args, **kwds):
+        self.failures = []
+        super(RequestingDispatcher, self).__init__(*args, **kwds)
+
+    def getRequirementTarget(self, requirement):
+        return requirement.split(':')[0]
+
+    def _onRequirementFailed(self, req, tasks):
+        self.failures.append((req, tasks))
+
+
+class RequestTest(unittest.case.TestCase):
+    """ Unit test for the requests for requirements of TaskDispatcher """
+
+    def setUp(self):
+        self.sender = RecordingSender()
+        self.dispatcher = RequestingDispatcher(sender=self.sender)
+
+    def testAnsweredWhileLingering(self):
+        """ Test that a requirement answered while its request lingers is not sent """
+        tasks = [TaskSpecification(doNothing, reqs={'a': 'db:x'}), TaskSpecification(doNothing, reqs={'b': 'db:x'})]
+        for task in tasks:
+            self.dispatcher.addTask(task)
+        self.dispatcher.doActions()
+        self.dispatcher.receiveRequirement(Reply('db:x', 1))
+        self.dispatcher.run(drain=True)
+        self.assertEqual(self.sender.sent, [])
+        self.assertEqual(self.dispatcher.getInFlightRequestCount(), 0)
+        self.assertEqual([task.getStatus() for task in tasks], [TaskSpecification.DISPATCHED_STATUS]*2)
+
+    def testLateAnswer(self):
+        """ Test that an answer received after a timeout cancels the queued retry """
+        self.dispatcher.addTask(TaskSpecification(doNothing, reqs={'a': 'db:y'}))
+        self.dispatcher.doActions()
+        self.dispatcher._flushOutbox(time.time(), True)
+        time.sleep(2*self.dispatcher.REQUEST_TIMEOUT)
+        self.dispatcher._checkRequestTimeouts(time.time())
+        self.dispatcher.receiveRequirement(Reply('db:y', 2))
+        self.dispatcher.run(drain=True)
+        self.assertEqual(self.sender.sent, [('db', ['db:y'])])
+        self.assertEqual(self.dispatcher.getInFlightRequestCount(), 0)
+
+    def testNeverAnswered(self):
+        """ Test that a request is retried MAX_RETRIES times, then its tasks fail """
+        task = TaskSpecification(doNothing, reqs={'a': 'db:z'})
+        self.dispatcher.addTask(task)
+        self.dispatcher.run(runWhenIdle=True, idleTimeout=1.0)
+        self.assertEqual(self.sender.sent, [('db', ['db:z'])]*(self.dispatcher.MAX_RETRIES + 1))
+        self.assertEqual(task.getStatus(), TaskSpecification.ERROR_STATUS)
+        self.assertEqual(self.dispatcher.failures, [('db:z', [task])])
+
+    def testBatches(self):
+        """ Test that requirements are requested once per target, in batches of MAX_BATCH_SIZE """
+        self.dispatcher.MAX_BATCH_SIZE = 3
+        for i in xrange(7):
+            for name in ('a', 'b'):
+                self.dispatcher.addTask(TaskSpecification(doNothing, reqs={name: 'db:%d' % i}))
+        self.dispatcher.addTask(TaskSpecification(doNothing, reqs={'a': 'web:0'}))
+        self.dispatcher.doActions()
+        self.dispatcher._flushOutbox(time.time(), True)
+        sent = self.sender.sent
+        self.assertEqual(sorted((target, len(requirements)) for target, requirements in sent),
+                         [('db', 1), ('db', 3), ('db', 3), ('web', 1)])
+        self.assertEqual(sorted(req for target, requirements in sent for req in requirements),
+                         sorted(['db:%d' % i for i in xrange(7)] + ['web:0']))
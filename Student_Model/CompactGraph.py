@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+
+class MappedArray(object):
+    """
+    This is the class that reads a typed array directly from a (memory-mapped)
+    buffer without copying it, so that processes mapping the same file share
+    one read-only copy through the page cache.
+    """
+
+    #Init
+    def __init__(self, buffer, offset, typecode, length):
+        self._buffer = buffer
+        self._offset = offset
+        self._struct = struct.Struct(typecode)
+        self._itemsize = self._struct.size
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if (index < 0):
+            index += self._length
+        if (index < 0 or index >= self._length):
+            raise IndexError("MappedArray index out of range")
+        return self._struct.unpack_from(self._buffer, self._offset + index*self._itemsize)[0]
+
+    def __iter__(self):
+        for index in xrange(self._length):
+            yield self[index]
+
+    def tofile(self, f):
+        f.write(self._buffer[self._offset:self._offset + self._length*self._itemsize])
+
+class CompactRows(object):
+    """
+    This is the class that stores rows of concept indexes (and optionally
+    their weights) in CSR (compressed sparse row) arrays: row i holds the
+    entries from pointers[i] to pointers[i + 1], sorted by index.
+    """
+    POINTER_TYPE = 'l'
+    INDEX_TYPE = 'i'
+    WEIGHT_TYPE = 'd'
+
+    #Init
+    def __init__(self, pointers = None, indexes = None, weights = None):
+        if (pointers == None):
+            pointers = array(self.POINTER_TYPE, [0])
+        if (indexes == None):
+            indexes = array(self.INDEX_TYPE)
+
+        self._pointers = pointers
+        self._indexes = indexes
+
+        #None for the rows without weights (e.g. the transitive parents)
+        self._weights = weights
+
+    @classmethod
+    def fromRows(cls, rows = None, weighted = True):
+        #Each row is a sorted list of (index, weight) pairs, or of indexes if not weighted
+        if (rows == None):
+            raise ValueError("Input rows are not available!")
+
+        pointers = array(cls.POINTER_TYPE, [0])
+        indexes = array(cls.INDEX_TYPE)
+        weights = None
+        if (weighted):
+            weights = array(cls.WEIGHT_TYPE)
+
+        for row in rows:
+            if (weighted):
+                for index, weight in row:
+                    indexes.append(index)
+                    weights.append(weight)
+            else:
+                indexes.extend(row)
+            pointers.append(len(indexes))
+
+        return cls(pointers, indexes, weights)
+
+    def getArrays(self):
+        return self._pointers, self._indexes, self._weights
+
+    def getRowCount(self):
+        return len(self._pointers) - 1
+
+    def getRange(self, row):
+        return self._pointers[row], self._pointers[row + 1]
+
+    def getIndexes(self, row):
+        start, end = self.getRange(row)
+        indexes = self._indexes
+        return [indexes[k] for k in xrange(start, end)]
+
+    def getItems(self, row):
+        start, end = self.getRange(row)
+        indexes = self._indexes
+        weights = self._weights
+        return [(indexes[k], weights[k]) for k in xrange(start, end)]
+
+    def find(self, row, index):
+        #Position of the index in the row, or -1 if it is not there
+        start, end = self.getRange(row)
+        k = bisect_left(self._indexes, index, start, end)
+        if (k < end and self._indexes[k] == index):
+            return k
+        return -1
+
+    def getWeight(self, k):
+        return self._weights[k]
+
+
+class CompactDependency(object):
+    """
+    This is the class that stores a frozen knowledge graph in compact arrays.
+    Concept IDs are interned to integers, and the dependencies are kept as
+    CSR rows in both directions, together with the transitive parents of
+    every concept. If the graph is acyclic, concepts are numbered in
+    topological order.
+    """
+
+    #Init
+    def __init__(self, conceptIDs = None, forward = None, reverse = None, ancestors = None, acyclic = False):
+        #Concept table: [index] = Concept ID, and the reverse mapping
+        self._conceptIDs = conceptIDs
+        self._conceptIndex = dict((conceptID, index) for index, conceptID in enumerate(conceptIDs))
+
+        #Forward rows: [Source index] = (Target index, weight)
+        self._forward = forward
+
+        #Reverse rows: [Target index] = (Source index, weight)
+        self._reverse = reverse
+
+        #Transitive parents: [Concept index] = Parent indexes
+        self._ancestors = ancestors
+
+        self._acyclic = acyclic
+
+    @classmethod
+    def fromDependency(cls, conceptIDs = None, dependency = None, parents = None, acyclic = False):
+        #conceptIDs: all concepts, in the order to number them
+        #dependency: [Source Concept ID][Target Concept ID] = weight
+        #parents: callable which returns the transitive parents of a concept
+        if (conceptIDs == None or dependency == None or parents == None):
+            raise ValueError("Input concepts, dependency or parents are not available!")
+
+        conceptIndex = dict((conceptID, index) for index, conceptID in enumerate(conceptIDs))
+
+        forwardRows = []
+        reverseRows = [[] for conceptID in conceptIDs]
+        for index, conceptID in enumerate(conceptIDs):
+            row = sorted((conceptIndex[key], weight) for key, weight in dependency.get(conceptID, {}).iteritems())
+            forwardRows.append(row)
+            #Sources are visited in increasing order, so the reverse rows stay sorted
+            for key, weight in row:
+                reverseRows[key].append((index, weight))
+
+        ancestorRows = (sorted(conceptIndex[key] for key in parents(conceptID)) for conceptID in conceptIDs)
+
+        return cls(list(conceptIDs),
+                   CompactRows.fromRows(forwardRows),
+                   CompactRows.fromRows(reverseRows),
+                   CompactRows.fromRows(ancestorRows, False),
+                   acyclic)
+
+    def toDependency(self):
+        #Materialize the nested dicts: [Source Concept ID][Target Concept ID] = weight
+        rt = {}
+        for index in xrange(len(self._conceptIDs)):
+            targets = self.getTargets(index)
+            if (targets):
+                rt[self._conceptIDs[index]] = targets
+        return rt
+
+    def getConceptIDs(self):
+        return self._conceptIDs
+
+    def getIndex(self, conceptID):
+        return self._conceptIndex.get(conceptID)
+
+    def getConceptID(self, index):
+        return self._conceptIDs[index]
+
+    def isAcyclic(self):
+        return self._acyclic
+
+    def getForwardRows(self):
+        return self._forward
+
+    def getReverseRows(self):
+        return self._reverse
+
+    def getAncestorRows(self):
+        return self._ancestors
+
+    def getWeight(self, sourceID, targetID):
+        source = self._conceptIndex.get(sourceID)
+        target = self._conceptIndex.get(targetID)
+        if (source == None or target == None):
+            return None
+
+        k = self._forward.find(source, target)
+        if (k < 0):
+            return None
+        return self._forward.getWeight(k)
+
+    def getTargets(self, index):
+        #[Target Concept ID] = weight, or None if the concept has no targets
+        if (index == None):
+            return None
+        conceptIDs = self._conceptIDs
+        items = self._forward.getItems(index)
+        if (not items):
+            return None
+        return dict((conceptIDs[key], weight) for key, weight in items)
+
+    def getSources(self, index):
+        #[Source Concept ID] = weight
+        if (index == None):
+            return {}
+        conceptIDs = self._conceptIDs
+        return dict((conceptIDs[key], weight) for key, weight in self._reverse.getItems(index))
+
+    def getParents(self, conceptID):
+        index = self._conceptIndex.get(conceptID)
+        if (index == None):
+            return []
+        conceptIDs = self._conceptIDs
+        return [conceptIDs[key] for key in self._ancestors.getIndexes(index)]
+
+    def isParent(self, parentID, currentID):
+        parent = self._conceptIndex.get(parentID)
+        current = self._conceptIndex.get(currentID)
+        if (parent == None or current == None):
+            return False
+        return self._ancestors.find(current, parent) >= 0
+
+    def isReachable(self, startID, endID):
+        #Check whether endID can be reached from startID by following the
+        #dependencies, including the ones with a zero weight
+        start = self._conceptIndex.get(startID)
+        end = self._conceptIndex.get(endID)
+        if (start == None or end == None):
+            return False
+
+        #With a topological numbering, nothing past the end concept can lead to it
+        limit = len(self._conceptIDs)
+        if (self._acyclic):
+            limit = end
+
+        visited = set([start])
+        childSet = [start]
+        while (childSet):
+            current = childSet.pop()
+            if (current == end):
+                return True
+            for key in self._forward.getIndexes(current):
+                if (key not in visited and key <= limit):
+                    visited.add(key)
+                    childSet.append(key)
+        return False
+
+    def getTopologicalOrder(self):
+        if (not self._acyclic):
+            return None
+        return list(self._conceptIDs)
+
+    #Snapshot -- a binary file which is opened with mmap
+    #Layout: header, concept ID table (JSON), then the CSR arrays in native
+    #byte order, each one starting on an 8-byte boundary
+    SNAPSHOT_MAGIC = 'KGSNAP01'
+    SNAPSHOT_HEADER = struct.Struct('<8sBBBBI' + 'Q'*10)
+    SNAPSHOT_ALIGN = 8
+
+    def _getSnapshotArrays(self):
+        forward = self._forward.getArrays()
+        reverse = self._reverse.getArrays()
+        ancestors = self._ancestors.getArrays()
+        return [(forward[0], CompactRows.POINTER_TYPE), (forward[1], CompactRows.INDEX_TYPE), (forward[2], CompactRows.WEIGHT_TYPE),
+                (reverse[0], CompactRows.POINTER_TYPE), (reverse[1], CompactRows.INDEX_TYPE), (reverse[2], CompactRows.WEIGHT_TYPE),
+                (ancestors[0], CompactRows.POINTER_TYPE), (ancestors[1], CompactRows.INDEX_TYPE)]
+
+    @classmethod
+    def _padding(cls, size):
+        return -size % cls.SNAPSHOT_ALIGN
+
+    def save(self, path = None):
+        if (path == None):
+            raise ValueError("Input snapshot path is not available!")
+
+        idTable = json.dumps(self._conceptIDs)
+        arrays = self._getSnapshotArrays()
+        header = self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC,
+                                           int(sys.byteorder == 'little'),
+                                           struct.calcsize(CompactRows.POINTER_TYPE),
+                                           struct.calcsize(CompactRows.INDEX_TYPE),
+                                           int(self._acyclic),
+                                           0,
+                                           len(self._conceptIDs),
+                                           len(idTable),
+                                           *[len(values) for values, typecode in arrays])
+
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(idTable)
+            f.write('\0'*self._padding(len(header) + len(idTable)))
+            for values, typecode in arrays:
+                values.tofile(f)
+                f.write('\0'*self._padding(len(values)*struct.calcsize(typecode)))
+
+    @classmethod
+    def open(cls, path = None):
+        #The arrays are read in place from the mapped file; only the concept
+        #ID table is parsed, to look concepts up by their IDs
+        if (path == None):
+            raise ValueError("Input snapshot path is not available!")
+
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        fields = cls.SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        magic, little, pointerSize, indexSize, acyclic = fields[:5]
+        conceptCount, idTableLength = fields[6:8]
+        lengths = fields[8:]
+        if (magic != cls.SNAPSHOT_MAGIC):
+            raise ValueError("Input file is not a knowledge graph snapshot!")
+        if (bool(little) != (sys.byteorder == 'little') or
+            pointerSize != struct.calcsize(CompactRows.POINTER_TYPE) or
+            indexSize != struct.calcsize(CompactRows.INDEX_TYPE)):
+            raise ValueError("The knowledge graph snapshot was saved on an incompatible platform!")
+
+        offset = cls.SNAPSHOT_HEADER.size
+        conceptIDs = [cls._decodeConceptID(conceptID) for conceptID in json.loads(buffer[offset:offset + idTableLength])]
+        if (len(conceptIDs) != conceptCount):
+            raise ValueError("The knowledge graph snapshot is corrupted!")
+        offset += idTableLength
+        offset += cls._padding(offset)
+
+        typecodes = [CompactRows.POINTER_TYPE, CompactRows.INDEX_TYPE, CompactRows.WEIGHT_TYPE,
+                     CompactRows.POINTER_TYPE, CompactRows.INDEX_TYPE, CompactRows.WEIGHT_TYPE,
+                     CompactRows.POINTER_TYPE, CompactRows.INDEX_TYPE]
+        arrays = []
+        for typecode, length in zip(typecodes, lengths):
+            arrays.append(MappedArray(buffer, offset, typecode, length))
+            offset += length*struct.calcsize(typecode)
+            offset += cls._padding(offset)
+
+        return cls(conceptIDs,
+                   CompactRows(*arrays[0:3]),
+                   CompactRows(*arrays[3:6]),
+                   CompactRows(arrays[6], arrays[7]),
+                   bool(acyclic))
+
+    @staticmethod
+    def _decodeConceptID(conceptID):
+        #JSON gives back unicode strings; keep plain strings for ASCII IDs
+        if (isinstance(conceptID, unicode)):
+            try:
+                return conceptID.encode('ascii')
+            except UnicodeEncodeError:
+                pass
+        return conceptID
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from array import array
+from collections import Mapping, MutableMapping
+from itertools import izip
+
+from KnowledgeLevel import BaseKnowledgeLevel, DecayKnowledgeLevel
+
+NAN = float('nan')
+
+
+class ConceptIndex(object):
+    """
+    This is the class that interns concept IDs as small integers, so that
+    the students' knowledge can be kept in arrays indexed by concept instead
+    of dicts. One index is shared by all the students' tables.
+    """
+
+    #Init
+    def __init__(self, conceptIDs = None):
+        #[conceptID] = index and [index] = conceptID
+        self._indexes = {}
+        self._conceptIDs = []
+
+        self._lock = threading.Lock()
+
+        if (conceptIDs != None):
+            for conceptID in conceptIDs:
+                self.getIndex(conceptID, True)
+
+    def __len__(self):
+        return len(self._conceptIDs)
+
+    def __contains__(self, conceptID):
+        return conceptID in self._indexes
+
+    def getIndex(self, conceptID = None, create = False):
+        #Return None for an unknown concept, unless it is to be created
+        index = self._indexes.get(conceptID)
+        if (index == None and create):
+            if (conceptID == None):
+                raise ValueError("Input concept id is not available!")
+
+            with self._lock:
+                index = self._indexes.get(conceptID)
+                if (index == None):
+                    index = len(self._conceptIDs)
+                    self._conceptIDs.append(conceptID)
+                    self._indexes[conceptID] = index
+        return index
+
+    def getConceptID(self, index):
+        return self._conceptIDs[index]
+
+    def getConceptIDs(self):
+        return list(self._conceptIDs)
+
+
+class CompactKnowledge(object):
+    """
+    This is the class that holds a student's knowledge levels in an
+    array('d') indexed through a shared ConceptIndex, instead of a dict:
+    8 bytes per concept rather than a dict entry plus a float object.
+    A concept never observed is NaN in the array. It works like the
+    [conceptID] = knowledge level dict it replaces, so KL and KM can use
+    it as it is. The array grows up to the highest concept index stored.
+    """
+    LEVEL_TYPE = 'd'
+
+    #No instance dict: it would cost more than the levels of most students
+    __slots__ = ('_conceptIndex', '_levels', '_count')
+
+    #Init
+    def __init__(self, conceptIndex = None, knowledge = None):
+        if (not isinstance(conceptIndex, ConceptIndex)):
+            raise TypeError("Input is not an acceptable type of concept index!")
+
+        self._conceptIndex = conceptIndex
+
+        #[concept index] = knowledge level (NaN --> never observed)
+        self._levels = array(self.LEVEL_TYPE)
+        self._count = 0
+
+        if (knowledge != None):
+            self.update(knowledge)
+
+    def getConceptIndex(self):
+        return self._conceptIndex
+
+    def getArray(self):
+        return self._levels
+
+    def get(self, conceptID, default = None):
+        index = self._conceptIndex.getIndex(conceptID)
+        if (index == None or index >= len(self._levels)):
+            return default
+
+        level = self._levels[index]
+        if (level != level):
+            return default
+        return level
+
+    def __getitem__(self, conceptID):
+        level = self.get(conceptID)
+        if (level == None):
+            raise KeyError(conceptID)
+        return level
+
+    def __setitem__(self, conceptID, level):
+        #A level of None is kept as never observed
+        if (level == None):
+            level = NAN
+
+        index = self._conceptIndex.getIndex(conceptID, True)
+        levels = self._levels
+        if (index >= len(levels)):
+            levels.extend(array(self.LEVEL_TYPE, [NAN])*(index + 1 - len(levels)))
+
+        past = levels[index]
+        if (past != past):
+            if (level == level):
+                self._count += 1
+        elif (level != level):
+            self._count -= 1
+        levels[index] = level
+
+    def __delitem__(self, conceptID):
+        if (self.get(conceptID) == None):
+            raise KeyError(conceptID)
+
+        self._levels[self._conceptIndex.getIndex(conceptID)] = NAN
+        self._count -= 1
+
+    def __contains__(self, conceptID):
+        return self.get(conceptID) != None
+
+    def pop(self, conceptID, *default):
+        level = self.get(conceptID)
+        if (level == None):
+            if (default):
+                return default[0]
+            raise KeyError(conceptID)
+
+        del self[conceptID]
+        return level
+
+    def update(self, knowledge = None):
+        if (knowledge == None):
+            return
+
+        if (hasattr(knowledge, 'iteritems')):
+            knowledge = knowledge.iteritems()
+        for conceptID, level in knowledge:
+            self[conceptID] = level
+
+    def clear(self):
+        self._levels = array(self.LEVEL_TYPE)
+        self._count = 0
+
+    def __iter__(self):
+        getConceptID = self._conceptIndex.getConceptID
+        for index, level in enumerate(self._levels):
+            if (level == level):
+                yield getConceptID(index)
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        for level in self._levels:
+            if (level == level):
+                yield level
+
+    def iteritems(self):
+        getConceptID = self._conceptIndex.getConceptID
+        for index, level in enumerate(self._levels):
+            if (level == level):
+                yield (getConceptID(index), level)
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __len__(self):
+        return self._count
+
+    def __eq__(self, other):
+        if (not isinstance(other, Mapping)):
+            return NotImplemented
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if (equal is NotImplemented):
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def copy(self):
+        knowledge = CompactKnowledge(self._conceptIndex)
+        knowledge._levels = array(self.LEVEL_TYPE, self._levels)
+        knowledge._count = self._count
+        return knowledge
+
+    def __repr__(self):
+        return 'CompactKnowledge(%r)' % dict(self.iteritems())
+
+MutableMapping.register(CompactKnowledge)
+
+
+class CohortKnowledge(object):
+    """
+    This is the class that holds the knowledge levels of a whole cohort
+    (e.g. a class) in one (students x concepts) matrix of float32, stored
+    row by row in an array('f'), with the ALEKS score and ALEKS lambda of
+    every student in arrays beside it. A concept never observed is NaN.
+    It computes the blended levels, the decayed updates and aggregates per
+    concept over all the students at once, with the same formulas as the
+    KL (see 'BaseKnowledgeLevel.blendALEKS' and
+    'DecayKnowledgeLevel.linearEstimation').
+    """
+    LEVEL_TYPE = 'f'
+
+    #Init
+    def __init__(self, conceptIndex = None, KL = None):
+        if (conceptIndex == None):
+            conceptIndex = ConceptIndex()
+        if (not isinstance(conceptIndex, ConceptIndex)):
+            raise TypeError("Input is not an acceptable type of concept index!")
+
+        #The KL whose decay lambda and 'linearEstimation' are used for the updates
+        if (KL == None):
+            KL = DecayKnowledgeLevel()
+        if (not isinstance(KL, DecayKnowledgeLevel)):
+            raise TypeError("Input is not an acceptable type of KL(knowledge level) object!")
+
+        self._conceptIndex = conceptIndex
+        self._KL = KL
+
+        #[studentID] = row and [row] = studentID
+        self._studentIndexes = {}
+        self._studentIDs = []
+
+        #Matrix: [row*width + concept index] = knowledge level (NaN --> never observed)
+        self._width = max(len(conceptIndex), 1)
+        self._levels = array(self.LEVEL_TYPE)
+
+        #[row] = ALEKS score, ALEKS lambda
+        self._aleks = array(self.LEVEL_TYPE)
+        self._aleksLambdas = array(self.LEVEL_TYPE)
+
+    def getConceptIndex(self):
+        return self._conceptIndex
+
+    def getKL(self):
+        return self._KL
+
+    def getStudentIDs(self):
+        return list(self._studentIDs)
+
+    def getStudentCount(self):
+        return len(self._studentIDs)
+
+    def _getRow(self, studentID):
+        row = self._studentIndexes.get(studentID)
+        if (row == None):
+            raise ValueError("The student is not in the cohort!")
+        return row
+
+    def _getColumn(self, conceptID, create = False):
+        #None for a concept which no student of the cohort has
+        column = self._conceptIndex.getIndex(conceptID, create)
+        if (column != None and column >= self._width):
+            if (not create):
+                return None
+            self._widen(max(column + 1, self._width*2))
+        return column
+
+    def _widen(self, width):
+        #Copy the matrix into wider rows, the new concepts never observed
+        levels = array(self.LEVEL_TYPE, [NAN])*(width*len(self._studentIDs))
+        for row in xrange(len(self._studentIDs)):
+            levels[row*width:row*width + self._width] = self._levels[row*self._width:(row + 1)*self._width]
+        self._levels = levels
+        self._width = width
+
+    def addStudent(self, studentID = None, knowledge = None, aleks = None, aleksLambda = None):
+        #Add a student with his/her [conceptID] = knowledge level table, or update him/her
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        row = self._studentIndexes.get(studentID)
+        if (row == None):
+            row = self._studentIndexes[studentID] = len(self._studentIDs)
+            self._studentIDs.append(studentID)
+            self._levels.extend(array(self.LEVEL_TYPE, [NAN])*self._width)
+            self._aleks.append(BaseKnowledgeLevel.ALEKS_LEVEL)
+            self._aleksLambdas.append(BaseKnowledgeLevel.ALEKS_LAMBDA)
+
+        if (aleks != None):
+            self._aleks[row] = aleks
+        if (aleksLambda != None):
+            self._aleksLambdas[row] = aleksLambda
+
+        if (knowledge != None):
+            for conceptID, level in knowledge.iteritems():
+                if (level == None):
+                    level = NAN
+                column = self._getColumn(conceptID, True)
+                self._levels[row*self._width + column] = level
+
+    def loadKnowledge(self, table = None):
+        #Add the students of a [studentID][conceptID] = knowledge level table
+        if (table == None):
+            raise ValueError("Input knowledge table is not available!")
+
+        for studentID, knowledge in table.iteritems():
+            self.addStudent(studentID, knowledge)
+
+    def getKnowledge(self, studentID = None):
+        #The student's [conceptID] = knowledge level table
+        row = self._getRow(studentID)
+        getConceptID = self._conceptIndex.getConceptID
+        start = row*self._width
+        return dict((getConceptID(column), level)
+                    for column, level in enumerate(self._levels[start:start + self._width])
+                    if level == level)
+
+    def getALEKS(self, studentID = None):
+        return self._aleks[self._getRow(studentID)]
+
+    def setALEKS(self, studentID = None, aleks = None):
+        if (aleks == None):
+            raise ValueError("Input ALEKS score is not available!")
+
+        self._aleks[self._getRow(studentID)] = aleks
+
+    def getALEKSLambda(self, studentID = None):
+        return self._aleksLambdas[self._getRow(studentID)]
+
+    def setALEKSLambda(self, studentID = None, aleksLambda = None):
+        if (aleksLambda == None):
+            raise ValueError("Input ALEKS LAMBDA score is not available!")
+
+        self._aleksLambdas[self._getRow(studentID)] = aleksLambda
+
+    def getKnowledgeLevel(self, studentID = None, conceptID = None):
+        #Blended with the student's ALEKS score, as 'BaseKnowledgeLevel.getKnowledgeLevel'
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        row = self._getRow(studentID)
+        column = self._getColumn(conceptID)
+        kl = 0
+        if (column != None):
+            level = self._levels[row*self._width + column]
+            if (level == level):
+                kl = level
+
+        return BaseKnowledgeLevel.blendALEKS(kl, self._aleks[row], self._aleksLambdas[row])
+
+    def getKnowledgeLevels(self, conceptID = None):
+        #Blended knowledge levels of all the students in a concept, in order of 'getStudentIDs'
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        column = self._getColumn(conceptID)
+        if (column == None):
+            levels = array(self.LEVEL_TYPE, [0])*len(self._studentIDs)
+        else:
+            levels = self._levels[column::self._width]
+
+        blendALEKS = BaseKnowledgeLevel.blendALEKS
+        return array(self.LEVEL_TYPE, [blendALEKS(0 if level != level else level, aleks, aleksLambda)
+                                       for level, aleks, aleksLambda in izip(levels, self._aleks, self._aleksLambdas)])
+
+    def updateKnowledge(self, studentID = None, conceptID = None, obsEst = None):
+        self.updateKnowledgeMany([(studentID, conceptID, obsEst)])
+
+    def updateKnowledgeMany(self, updates = None):
+        #Apply (studentID, conceptID, obsEst) updates in order, as 'DecayKnowledgeLevel' does
+        if (updates == None):
+            raise ValueError("Input updates are not available!")
+
+        updates = list(updates)
+        for studentID, conceptID, obsEst in updates:
+            self._getRow(studentID)
+            if (conceptID == None):
+                raise ValueError("Input conceptID is not available!")
+
+            if (obsEst == None):
+                raise ValueError("Input estimated knowledge is not available!")
+
+        linearEstimation = self._KL.linearEstimation
+        for studentID, conceptID, obsEst in updates:
+            column = self._getColumn(conceptID, True)
+            cell = self._studentIndexes[studentID]*self._width + column
+            pastEst = self._levels[cell]
+            if (pastEst != pastEst):
+                self._levels[cell] = obsEst
+            else:
+                self._levels[cell] = linearEstimation(pastEst, obsEst)
+
+    def getMean(self, conceptID = None):
+        #Class mean of the blended knowledge levels in a concept
+        if (not self._studentIDs):
+            return None
+
+        levels = self.getKnowledgeLevels(conceptID)
+        return sum(levels) / len(levels)
+
+    def getMeans(self):
+        #[conceptID] = class mean, for every concept of the concept index
+        return dict((conceptID, self.getMean(conceptID)) for conceptID in self._conceptIndex.getConceptIDs())
+
+    def getPercentiles(self, conceptID = None, percentiles = (25, 50, 75)):
+        #Percentiles (0~100) of the blended knowledge levels in a concept,
+        #interpolated linearly between the closest students
+        if (not self._studentIDs):
+            return None
+
+        levels = sorted(self.getKnowledgeLevels(conceptID))
+        last = len(levels) - 1
+        result = []
+        for percentile in percentiles:
+            if (percentile < 0 or percentile > 100):
+                raise ValueError("Percentile is invalid! (0~100)")
+
+            rank = percentile / 100.0 * last
+            lower = int(rank)
+            upper = min(lower + 1, last)
+            result.append(levels[lower] + (levels[upper] - levels[lower]) * (rank - lower))
+        return result
+
+
+#Test cases
+if __name__ == '__main__':
+    print "--Start Test--"
+
+    conceptIndex = ConceptIndex(['Math-1', 'Math-2', 'Math-3', 'Math-4'])
+
+    knowledge = CompactKnowledge(conceptIndex, {'Math-1': 0.95, 'Math-3': 0.39})
+    knowledge['Math-5'] = 0.5
+
+    print knowledge
+    print knowledge.get('Math-2')
+    print len(knowledge), knowledge.getArray()
+
+    cohort = CohortKnowledge(conceptIndex)
+    cohort.addStudent('00125', {'Math-1': 0.95, 'Math-2': 0.75, 'Math-3': 0.39, 'Math-4': 0.0})
+    cohort.addStudent('00126', {'Math-1': 0.6, 'Math-2': 0.62, 'Math-3': 0.58, 'Math-4': 0.62}, 0.9)
+    cohort.updateKnowledge('00126', 'Math-4', 0.8)
+
+    print cohort.getKnowledgeLevel('00126', 'Math-4')
+    print cohort.getMean('Math-4'), cohort.getPercentiles('Math-4')
+
+    print "--End of test--"
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import csv
+from itertools import islice
+
+class EventLog(object):
+    """
+    This is the class that streams a (possibly very large) log of students'
+    events in chunks, instead of loading it at once. The source is either
+    the path of a CSV file or any iterable of rows. Iterating over the log
+    again starts from the beginning (the file is opened again), so it can
+    be read in several passes.
+    """
+    CHUNK_SIZE = 10000
+
+    #Init
+    def __init__(self, source = None, chunkSize = None, parse = None):
+        if (source == None):
+            raise ValueError("Input event source is not available!")
+
+        if (chunkSize == None):
+            chunkSize = self.CHUNK_SIZE
+        if (chunkSize <= 0):
+            raise ValueError("Chunk size is invalid! (1, 2, ..., n)")
+
+        self._source = source
+        self._chunkSize = chunkSize
+
+        #Converts a raw row into an event (None --> rows are used as they are)
+        self._parse = parse
+
+    def _openRows(self):
+        if (isinstance(self._source, basestring)):
+            with open(self._source, 'rb') as f:
+                for row in csv.reader(f):
+                    if (row):
+                        yield row
+        else:
+            for row in self._source:
+                yield row
+
+    def __iter__(self):
+        rows = self._openRows()
+        parse = self._parse
+        while True:
+            chunk = list(islice(rows, self._chunkSize))
+            if (not chunk):
+                return
+            if (parse != None):
+                chunk = [parse(row) for row in chunk]
+            yield chunk
+
+    @staticmethod
+    def parseInteraction(row):
+        #(studentID, conceptID, correct), with correct as 1/0 or true/false
+        studentID, conceptID, correct = row[:3]
+        if (isinstance(correct, basestring)):
+            correct = correct.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+        return (studentID, conceptID, bool(correct))
+
+    @staticmethod
+    def parsePerformance(row):
+        #(studentID, conceptID, hints, prompts, summary, lcc), as 'KnowledgeManager.savePerformance'.
+        #Missing or empty fields are None, to be reported by its checks.
+        row = [None if field == '' else field for field in row[:6]]
+        row.extend([None] * (6 - len(row)))
+        studentID, conceptID, hints, prompts, summary, lcc = row
+        if (isinstance(summary, basestring)):
+            summary = summary.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+        return (studentID, conceptID,
+                None if hints == None else int(hints),
+                None if prompts == None else int(prompts),
+                None if summary == None else bool(summary),
+                None if lcc == None else float(lcc))
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from contextlib import contextmanager
+from itertools import chain
+
+from CompactGraph import CompactDependency
 from DummyDB import DummyDB
 from KnowledgeModel import BaseKnowledgeModel
 
@@ -15,12 +19,283 @@ class KnowledgeGraph(object):
         #Dependency: [Source Concept ID][Target Concept ID] = weight
         self._dependency = {}
 
+        #Reverse index of the knowledge dependency, kept in sync with '_dependency'
+        #Reverse dependency: [Target Concept ID][Source Concept ID] = weight
+        self._reverseDependency = {}
+
+        #Interned concept IDs, used as bit positions of the ancestor sets
+        #Concept index: [Concept ID] = bit position
+        self._conceptIndex = {}
+        self._conceptIDs = []
+
+        #Cache of transitive parents, built by 'updateConcept' and invalidated per edge
+        #Ancestors: [Concept ID] = bitset of the parents' bit positions
+        self._ancestors = {}
+
+        #Topological order of the concepts, maintained per edge (Pearce-Kelly).
+        #None if it has to be rebuilt, or if the graph has a cycle.
+        #Order: [Concept ID] = position
+        self._order = {}
+        self._firstOrder = 0
+        self._lastOrder = -1
+        self._sortedOrder = None
+        self._cyclic = False
+
+        #Compact, read-only storage of a frozen graph (None --> not frozen)
+        #It replaces all the structures above while the graph is frozen
+        self._compact = None
+
+        #Sparse adjacency, shared by the observers and built on first use (None --> to build):
+        #(concept IDs, [concept ID] = index, [source index] = [(target index, weight)])
+        self._adjacency = None
+
         #Observers (type of knowledge model)
         self._observers = []
 
+        #Nesting of 'batchUpdates', and whether 'updateConcept' was called in it
+        self._batchDepth = 0
+        self._batchUpdated = False
+
     def setDependency(self, dependency):
+        self._compact = None
+        self._adjacency = None
         self._dependency = dependency
 
+        #Rebuild the reverse index and the concept table for the new dependency
+        self._reverseDependency = {}
+        self._conceptIndex = {}
+        self._conceptIDs = []
+        self._ancestors = {}
+        self._order = None
+        self._cyclic = False
+        for sourceID, targets in self._dependency.iteritems():
+            self._internConcept(sourceID)
+            for targetID, weight in targets.iteritems():
+                self._internConcept(targetID)
+                self._addReverseDependency(sourceID, targetID, weight)
+
+    def _addReverseDependency(self, sourceID, targetID, weight):
+        if (self._reverseDependency.get(targetID) == None):
+            self._reverseDependency[targetID] = {}
+        self._reverseDependency[targetID][sourceID] = weight
+
+    def _delReverseDependency(self, sourceID, targetID):
+        del self._reverseDependency[targetID][sourceID]
+        if (not self._reverseDependency[targetID]):
+            del self._reverseDependency[targetID]
+
+    def _internConcept(self, conceptID, first = False):
+        index = self._conceptIndex.get(conceptID)
+        if (index == None):
+            index = len(self._conceptIDs)
+            self._conceptIndex[conceptID] = index
+            self._conceptIDs.append(conceptID)
+
+            #A new concept has no dependency yet, so it can be placed at either end
+            #of the order: sources go first and targets go last.
+            if (self._order != None):
+                if (first):
+                    self._firstOrder -= 1
+                    self._order[conceptID] = self._firstOrder
+                else:
+                    self._lastOrder += 1
+                    self._order[conceptID] = self._lastOrder
+                self._sortedOrder = None
+        return index
+
+    def _decodeConcepts(self, bitset):
+        #Convert a bitset of concept indexes back to concept IDs
+        rt = []
+        while (bitset):
+            lowest = bitset & -bitset
+            rt.append(self._conceptIDs[lowest.bit_length() - 1])
+            bitset ^= lowest
+        return rt
+
+    def _getAncestors(self, conceptID):
+        ancestors = self._ancestors.get(conceptID)
+        if (ancestors != None):
+            return ancestors
+
+        index = self._conceptIndex.get(conceptID)
+        if (index == None):
+            return 0
+
+        #Walk the incoming dependencies, stopping at parents whose ancestors are cached
+        ancestors = 0
+        childSet = [conceptID]
+        while (childSet):
+            currentChild = childSet.pop()
+            for key, weight in self._reverseDependency.get(currentChild, {}).iteritems():
+                bit = 1 << self._conceptIndex[key]
+                if (weight and not ancestors & bit):
+                    ancestors |= bit
+                    cached = self._ancestors.get(key)
+                    if (cached != None):
+                        ancestors |= cached
+                    else:
+                        childSet.append(key)
+
+        #A concept is not its own parent, even if the graph has a cycle
+        ancestors &= ~(1 << index)
+        self._ancestors[conceptID] = ancestors
+        return ancestors
+
+    def _invalidateAncestors(self, conceptID):
+        #Only the concept and its descendants can see a changed set of parents
+        childSet = [conceptID]
+        visited = set(childSet)
+        while (childSet):
+            currentChild = childSet.pop()
+            self._ancestors.pop(currentChild, None)
+            for key in self._dependency.get(currentChild, {}):
+                if (key not in visited):
+                    visited.add(key)
+                    childSet.append(key)
+
+    def _buildAncestors(self):
+        #Fill the cache in topological order, so that every concept is
+        #built from its parents' cached sets
+        order = self.getTopologicalOrder()
+        if (order == None):
+            order = self._conceptIDs
+        for key in order:
+            self._getAncestors(key)
+
+    def _sortConcepts(self, newDependency = None):
+        #Full topological sort (Kahn's algorithm) of the concepts, including the
+        #dependencies of 'newDependency' which are not added to the graph yet.
+        #Return the order, or None if the graph has a cycle
+        if (newDependency == None):
+            newDependency = {}
+
+        inDegree = dict((key, len(sources)) for key, sources in self._reverseDependency.iteritems())
+        concepts = list(self._conceptIDs)
+        newConcepts = set()
+        for sourceID, targets in newDependency.iteritems():
+            for key in [sourceID] + targets.keys():
+                if (key not in self._conceptIndex and key not in newConcepts):
+                    newConcepts.add(key)
+                    concepts.append(key)
+            for key in targets:
+                inDegree[key] = inDegree.get(key, 0) + 1
+
+        readySet = [key for key in concepts if not inDegree.get(key)]
+        order = {}
+        while (readySet):
+            currentParent = readySet.pop()
+            order[currentParent] = len(order)
+            for key in chain(self._dependency.get(currentParent, {}), newDependency.get(currentParent, {})):
+                inDegree[key] -= 1
+                if (inDegree[key] == 0):
+                    readySet.append(key)
+
+        if (len(order) < len(concepts)):
+            #Concepts on a cycle are never released by the sort
+            return None
+        return order
+
+    def _setOrder(self, order):
+        self._order = order
+        self._sortedOrder = None
+        if (order == None):
+            self._cyclic = True
+        else:
+            self._firstOrder = 0
+            self._lastOrder = len(order) - 1
+
+    def _rebuildOrder(self):
+        #Only needed after 'setDependency' or after a cycle has been removed again
+        self._setOrder(self._sortConcepts())
+
+    def _getOrder(self):
+        if (self._order == None and not self._cyclic):
+            self._rebuildOrder()
+        return self._order
+
+    def _searchAffected(self, sourceID, targetID):
+        # Find the concepts to reorder when adding the dependency sourceID -> targetID
+        # [] --> already in order; None --> the dependency closes a cycle
+        if (sourceID == targetID):
+            return None
+
+        order = self._getOrder()
+        if (order == None):
+            return None
+
+        lower = order.get(targetID)
+        upper = order.get(sourceID)
+        if (lower == None or upper == None or upper < lower):
+            return []
+
+        #Only the descendants of the target placed before the source may need to move.
+        #Reaching the source among them means that the new dependency closes a cycle.
+        affected = [targetID]
+        visited = set(affected)
+        childSet = [targetID]
+        while (childSet):
+            currentChild = childSet.pop()
+            for key in self._dependency.get(currentChild, {}):
+                if (key == sourceID):
+                    return None
+                if (key not in visited and order[key] < upper):
+                    visited.add(key)
+                    affected.append(key)
+                    childSet.append(key)
+        return affected
+
+    def _updateOrder(self, sourceID, targetID, affected):
+        #Keep the order valid after adding the dependency sourceID -> targetID
+        if (self._order == None):
+            return
+
+        if (affected == None):
+            #The dependency was added without the acyclic check and closed a cycle
+            self._order = None
+            self._cyclic = True
+            self._sortedOrder = None
+            return
+
+        if (not affected):
+            return
+
+        #Collect the ancestors of the source placed after the target
+        order = self._order
+        lower = order[targetID]
+        parents = [sourceID]
+        visited = set(parents)
+        childSet = [sourceID]
+        while (childSet):
+            currentChild = childSet.pop()
+            for key in self._reverseDependency.get(currentChild, {}):
+                if (key not in visited and order[key] > lower):
+                    visited.add(key)
+                    parents.append(key)
+                    childSet.append(key)
+
+        #Reuse the positions of both sets, moving the parents in front of the descendants
+        parents.sort(key = order.get)
+        affected.sort(key = order.get)
+        concepts = parents + affected
+        positions = sorted(order[key] for key in concepts)
+        for key, position in zip(concepts, positions):
+            order[key] = position
+        self._sortedOrder = None
+
+    def getTopologicalOrder(self):
+        # Return all concepts, each one placed after its parents
+        # None --> the graph has a cycle
+        if (self._compact != None):
+            return self._compact.getTopologicalOrder()
+
+        order = self._getOrder()
+        if (order == None):
+            return None
+
+        if (self._sortedOrder == None):
+            self._sortedOrder = sorted(order, key = order.get)
+        return list(self._sortedOrder)
+
     def getDependency(self):
         return self._dependency
 
@@ -29,6 +304,9 @@ class KnowledgeGraph(object):
         if (sourceID == None or targetID == None):
             raise ValueError("Input source concept id or target concept id is invalid!")
 
+        if (self._compact != None):
+            return self._compact.getWeight(sourceID, targetID)
+
         if (self._dependency.get(sourceID) == None):
             return None
         else:
@@ -40,7 +318,10 @@ class KnowledgeGraph(object):
             raise ValueError("Input source concept id is invalid!")
 
         rt = {}
-        rt[sourceID] = self._dependency.get(sourceID)
+        if (self._compact != None):
+            rt[sourceID] = self._compact.getTargets(self._compact.getIndex(sourceID))
+        else:
+            rt[sourceID] = self._dependency.get(sourceID)
         return rt
     
     def getDependencyByTarget(self, targetID = None):
@@ -49,41 +330,142 @@ class KnowledgeGraph(object):
             raise ValueError("Input target concept id is invalid!")
 
         rt = {}
-        keys = self._dependency.keys()
-        for key in keys:
-            if (self._dependency.get(key).get(targetID)):
+        if (self._compact != None):
+            sources = self._compact.getSources(self._compact.getIndex(targetID))
+        else:
+            sources = self._reverseDependency.get(targetID, {})
+        for key, weight in sources.iteritems():
+            if (weight):
                 rt[key] = {}
-                rt[key][targetID] = self._dependency.get(key).get(targetID)
+                rt[key][targetID] = weight
                 
         return rt
 
     def getAllDependencies(self):
+        if (self._compact != None):
+            return self._compact.toDependency()
+
         return self._dependency
 
     def getParents(self, currentID = None):
         if (currentID == None):
             raise ValueError("Input current concept id is invalid!")
 
-        rt = []
-        childSet = []
-        childSet.append(currentID)
-        keys = self._dependency.keys()
+        if (self._compact != None):
+            return self._compact.getParents(currentID)
 
-        while (childSet):
-            currentChild = childSet.pop()
-            rt.append(currentChild)
-            
-            for key in keys:
-                if (self._dependency.get(key).get(currentChild) and key not in rt):
-                    childSet.append(key)
+        return self._decodeConcepts(self._getAncestors(currentID))
 
-        rt.remove(currentID)
-        return rt
+    def isParent(self, parentID = None, currentID = None):
+        # Check whether parentID is a direct or transitive parent of currentID
+        if (parentID == None or currentID == None):
+            raise ValueError("Input parent concept id or current concept id is invalid!")
+
+        if (self._compact != None):
+            return self._compact.isParent(parentID, currentID)
+
+        index = self._conceptIndex.get(parentID)
+        if (index == None):
+            return False
+
+        return bool(self._getAncestors(currentID) >> index & 1)
+
+    def getCompactDependency(self):
+        return self._compact
+
+    def getAdjacency(self):
+        #The graph as a sparse adjacency matrix of concept indexes (without zero weights):
+        #(concept IDs, [concept ID] = index, [source index] = [(target index, weight)]).
+        #It is built once and shared by all the knowledge models on this graph.
+        adjacency = self._adjacency
+        if (adjacency == None):
+            if (self._compact != None):
+                #A frozen graph is already stored as index rows
+                forward = self._compact.getForwardRows()
+                conceptIDs = self._compact.getConceptIDs()
+                conceptIndex = dict((conceptID, i) for i, conceptID in enumerate(conceptIDs))
+                rows = [[(j, w) for j, w in forward.getItems(i) if w] for i in xrange(len(conceptIDs))]
+            else:
+                dependency = self._dependency
+                conceptIDs = list(set(dependency.keys()).union(*[targets.keys() for targets in dependency.itervalues()]))
+                conceptIndex = dict((conceptID, i) for i, conceptID in enumerate(conceptIDs))
+                rows = [[(conceptIndex[key], w) for key, w in dependency.get(conceptID, {}).iteritems() if w]
+                        for conceptID in conceptIDs]
+            adjacency = self._adjacency = (conceptIDs, conceptIndex, rows)
+        return adjacency
+
+    def isFrozen(self):
+        return self._compact != None
+
+    def _makeCompact(self):
+        self._buildAncestors()
+        order = self.getTopologicalOrder()
+        acyclic = order != None
+        if (not acyclic):
+            order = self._conceptIDs
+
+        ancestors = self._ancestors
+        return CompactDependency.fromDependency(order, self._dependency,
+                                                lambda conceptID: self._decodeConcepts(ancestors[conceptID]),
+                                                acyclic)
+
+    def freeze(self):
+        #Moving the graph into compact arrays (see 'CompactDependency'), including
+        #its transitive parents. The accessors keep working; modifiers need 'thaw'.
+        if (self._compact != None):
+            return
+
+        self._setCompact(self._makeCompact())
+
+    def _setCompact(self, compact):
+        self._compact = compact
+        self._adjacency = None
+
+        #Drop the dict based structures, which the compact storage replaces
+        self._dependency = {}
+        self._reverseDependency = {}
+        self._conceptIndex = {}
+        self._conceptIDs = []
+        self._ancestors = {}
+        self._order = {}
+        self._sortedOrder = None
+        self._cyclic = False
+
+    def saveSnapshot(self, path = None):
+        #Saving the graph (concept IDs, dependencies and transitive parents) as a binary snapshot
+        if (path == None):
+            raise ValueError("Input snapshot path is not available!")
+
+        compact = self._compact
+        if (compact == None):
+            compact = self._makeCompact()
+        compact.save(path)
+
+    def openSnapshot(self, path = None):
+        #Opening a snapshot with mmap. The graph is frozen on top of the mapped
+        #file, so processes opening the same snapshot share one read-only copy.
+        if (path == None):
+            raise ValueError("Input snapshot path is not available!")
+
+        self._setCompact(CompactDependency.open(path))
+
+    def thaw(self):
+        #Moving a frozen graph back into the modifiable nested dicts
+        if (self._compact == None):
+            return
+
+        self.setDependency(self._compact.toDependency())
+
+    def _checkNotFrozen(self):
+        if (self._compact != None):
+            raise ValueError("The knowledge graph is frozen. Using 'thaw' to modify it.")
 
     
     #Modifiers -- For admins
     def updateDependency(self, sourceID = None, targetID = None, weight = None):
         #Updating the existing dependency's weight
+        self._checkNotFrozen()
+
         if (sourceID == None or targetID == None):
             raise ValueError("Input source concept id or target concept id is invalid!")
 
@@ -92,7 +474,12 @@ class KnowledgeGraph(object):
 
         if (self._dependency.get(sourceID) != None and self._dependency.get(sourceID).get(targetID) != None):
             #Update the weight
+            if (bool(self._dependency[sourceID][targetID]) != bool(weight)):
+                #A zero weight hides the dependency from the parents
+                self._invalidateAncestors(targetID)
             self._dependency[sourceID][targetID] = weight
+            self._reverseDependency[targetID][sourceID] = weight
+            self._adjacency = None
             return True
         else:
             raise ValueError("The requested dependency is not available. Using 'addDependency' to create new one.")
@@ -100,6 +487,8 @@ class KnowledgeGraph(object):
     def addDependency(self, sourceID = None, targetID = None, weight = None, acyclicCKFlag = False):
         #Creating a new dependency. May or may not need to do an acyclic check
         
+        self._checkNotFrozen()
+
         if (sourceID == None or targetID == None):
             raise ValueError("Input source concept id or target concept id is invalid!")
 
@@ -109,57 +498,117 @@ class KnowledgeGraph(object):
         if (self._dependency.get(sourceID) != None and self._dependency.get(sourceID).get(targetID) != None):
             raise ValueError("The requested dependency is already available. Using 'updateDependency' to change its weight.")
         else:
-            if (acyclicCKFlag == True and acyclicCK(sourceID, targetID) == False):
+            #The search also tells which concepts to reorder, so it is run with or without the check.
+            #It is run before interning, so a rejected dependency leaves no new concept behind;
+            #a new concept is placed at the right end of the order when interned.
+            affected = self._searchAffected(sourceID, targetID)
+            if (acyclicCKFlag == True and affected == None):
                 raise ValueError("The requested dependency is invalid. It makes the acyclic graph cyclic.")
             else:
+                self._internConcept(sourceID, True)
+                self._internConcept(targetID)
+
                 #Create a new dependency
                 if (self._dependency.get(sourceID) == None):
                     self._dependency[sourceID] = {}
                 self._dependency[sourceID][targetID] = weight
+                self._addReverseDependency(sourceID, targetID, weight)
+                self._updateOrder(sourceID, targetID, affected)
+                self._invalidateAncestors(targetID)
+                self._adjacency = None
                 return True
                         
     def delDependency(self, sourceID = None, targetID = None):
         #Deleting the existing dependency
+        self._checkNotFrozen()
+
         if (sourceID == None or targetID == None):
             raise ValueError("Input source concept id or target concept id is invalid!")
 
         if (self._dependency.get(sourceID) != None and self._dependency.get(sourceID).get(targetID) != None):
             # Delete the dependency
             del self._dependency[sourceID][targetID]
-            if (self._dependency.get(sourceID) == None):
+            self._delReverseDependency(sourceID, targetID)
+            self._invalidateAncestors(targetID)
+            if (self._cyclic):
+                #The deleted dependency may have broken the cycle; sort again when needed
+                self._cyclic = False
+            if (not self._dependency.get(sourceID)):
                 del self._dependency[sourceID]
-                return True
+            self._adjacency = None
+            return True
         else:
             raise ValueError("The requested dependency is not available. No need to delete.")
 
+    def bulkLoad(self, edges = None, acyclicCKFlag = True):
+        #Creating many new dependencies at once from (source, target, weight) tuples.
+        #The batch is checked as a whole (one pass for repeated dependencies and
+        #one topological sort), so an invalid batch leaves the graph unchanged.
+        self._checkNotFrozen()
+
+        if (edges == None):
+            raise ValueError("Input dependencies are invalid!")
+
+        #Group the new dependencies by source
+        newDependency = {}
+        for sourceID, targetID, weight in edges:
+            if (sourceID == None or targetID == None):
+                raise ValueError("Input source concept id or target concept id is invalid!")
+
+            if (weight == None):
+                raise ValueError("Input weight is invalid!")
+
+            targets = newDependency.get(sourceID)
+            if (targets == None):
+                targets = newDependency[sourceID] = {}
+            if (targetID in targets or targetID in self._dependency.get(sourceID, {})):
+                raise ValueError("The requested dependency is already available. Using 'updateDependency' to change its weight.")
+            targets[targetID] = weight
+
+        order = None
+        if (not self._cyclic):
+            order = self._sortConcepts(newDependency)
+        if (acyclicCKFlag == True and order == None):
+            raise ValueError("The requested dependencies are invalid. They make the acyclic graph cyclic.")
+
+        #Build the forward and the reverse indexes in one go
+        self._order = None
+        for sourceID, targets in newDependency.iteritems():
+            self._internConcept(sourceID)
+            if (self._dependency.get(sourceID) == None):
+                self._dependency[sourceID] = {}
+            self._dependency[sourceID].update(targets)
+            for targetID, weight in targets.iteritems():
+                self._internConcept(targetID)
+                self._addReverseDependency(sourceID, targetID, weight)
+        self._setOrder(order)
+
+        #The cache of parents is rebuilt as a whole, and the observers are informed once
+        self._ancestors = {}
+        self._adjacency = None
+        self.updateConcept()
+        return True
+
     def acyclicCK(self, sourceID = None, targetID = None):
         # Check one graph's acyclic ability when adding a new dependency
         # True --> acyclic; False --> not acyclic
+        # The graph itself is not modified. Only the concepts between the target and
+        # the source in the topological order are searched, instead of sorting again.
+        if (sourceID == None or targetID == None):
+            raise ValueError("Input source concept id or target concept id is invalid!")
 
-        #Create a new dependency
-        newDependency = self._dependency
-        if (newDependency.get(sourceID) == None):
-            newDependency[sourceID] = {}
-        newDependency[sourceID][targetID] = 1.0
-
-        # Algorithm for checking: A topological sort
-        """
-        Pseudo code:
-        Q <-- Set of all nodes with no incoming edges
-        while Q is non-empty do
-            remove a node n from Q
-            for each node m with an edge e from n to m do
-                remove edge e from the graph
-                if m has no other incoming edges then
-                    insert m into Q
-        if graph has edges then
-            output error message (graph has a cycle)
-        else 
-            output correct message (graph doesn't has a cycle)
-        """
-        # TODO:Implement above algo
-        
-        return True
+        if (sourceID == targetID):
+            return False
+
+        if (self._compact != None):
+            #A frozen graph cannot change, but the question can still be answered
+            return self._compact.isAcyclic() and not self._compact.isReachable(targetID, sourceID)
+
+        if (sourceID not in self._conceptIndex or targetID not in self._conceptIndex):
+            #A new concept has no dependency yet, so it cannot be part of a cycle
+            return self._getOrder() != None
+
+        return self._searchAffected(sourceID, targetID) != None
 
 
     #Obsering pattern
@@ -183,7 +632,28 @@ class KnowledgeGraph(object):
         except ValueError:
             pass
                 
+    @contextmanager
+    def batchUpdates(self):
+        #Defer 'updateConcept' to the end of the block, so that the observers
+        #are informed once however many times the graph is updated in it
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if (self._batchDepth == 0 and self._batchUpdated):
+                self._batchUpdated = False
+                self.updateConcept()
+
     def updateConcept(self):
+        if (self._batchDepth > 0):
+            self._batchUpdated = True
+            return
+
+        #Build the cache of parents up front, so observers only read it
+        if (self._compact == None):
+            self._buildAncestors()
+
         #Inform the observers
         for observer in self._observers:
             observer.initGraph(self) # Pass KG itself to its observers, including its graph data and the methods
@@ -191,6 +661,9 @@ class KnowledgeGraph(object):
 
 #Test cases
 if __name__ == '__main__':
+    import os
+    import tempfile
+
     print "--Start Test--"
 
     TMP_DB = DummyDB()
@@ -201,7 +674,7 @@ if __name__ == '__main__':
     KG = KnowledgeGraph()
 
     #Get student's knowledge from DB
-    KG._dependency = TMP_DB._dependency
+    KG.setDependency(TMP_DB._dependency)
 
     #Usual cases
     graph = KG.getAllDependencies()
@@ -224,6 +697,9 @@ if __name__ == '__main__':
     print "The parents concepts of 'Math-4' are:"
     print parents
 
+    print "Is 'Math-1' a parent concept of 'Math-4':"
+    print KG.isParent('Math-1', 'Math-4')
+
     KG.updateDependency('Math-2', 'Math-3', 0.95)
     weight2 = KG.getDependency('Math-2', 'Math-3')
     print "The updated weight between 'Math-2' and 'Math-3' is:"
@@ -242,6 +718,34 @@ if __name__ == '__main__':
     print "The weight between 'Math-2' and 'Math-3' is (has been deleted):"
     print weight4
 
+    parents = KG.getParents('Math-3')
+    print "The parents concepts of 'Math-3' are (dependency has been deleted):"
+    print parents
+
+    print "Can the dependency between 'Math-4' and 'Math-1' be added without a cycle:"
+    print KG.acyclicCK('Math-4', 'Math-1')
+
+    print "The topological order of the concepts is:"
+    print KG.getTopologicalOrder()
+
+    KG.bulkLoad([('Math-4', 'Math-5', 0.7), ('Math-5', 'Math-6', 0.8), ('Math-3', 'Math-6', 0.5)])
+    print "The parents concepts of 'Math-6' are (loaded by a batch):"
+    print KG.getParents('Math-6')
+
+    KG.freeze()
+    print "The parents concepts of 'Math-6' are (frozen graph):"
+    print KG.getParents('Math-6')
+    print "The all source concepts which end by 'Math-6' are (frozen graph):"
+    print KG.getDependencyByTarget('Math-6')
+    KG.thaw()
+
+    snapshotPath = os.path.join(tempfile.mkdtemp(), 'graph.snapshot')
+    KG.saveSnapshot(snapshotPath)
+    snapshotKG = KnowledgeGraph()
+    snapshotKG.openSnapshot(snapshotPath)
+    print "The parents concepts of 'Math-6' are (opened from a snapshot):"
+    print snapshotKG.getParents('Math-6')
+
     TMP_DB._dependency = KG._dependency
     
     print "DB's new content is:"
@@ -254,6 +758,9 @@ if __name__ == '__main__':
     #Add a repeated dependency
     #KG.addDependency('Math-1', 'Math-2', 1.0)
 
+    #Add a dependency which makes the graph cyclic
+    #KG.addDependency('Math-4', 'Math-1', 1.0, True)
+
     #Delete an non-available dependency
     #KG.delDependency('Math-4', 'Math-2')
     
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from contextlib import contextmanager
+
 from DummyDB import DummyDB
 from KnowledgeModel import BaseKnowledgeModel
 
@@ -25,6 +27,11 @@ class BaseKnowledgeLevel(object):
 
         #ALEKS_LAMBDA
         self._aleks_lambda = self.ALEKS_LAMBDA
+
+        #Concepts updated in the current batch, in order (see 'batchUpdates')
+        self._batchDepth = 0
+        self._batchConcepts = []
+        self._batchConceptSet = set()
         
     def setKnowledge(self, knowledge = None):
 
@@ -43,7 +50,12 @@ class BaseKnowledgeLevel(object):
         if (self._knowledge.get(conceptID) != None):
             kl = self._knowledge.get(conceptID)
 
-        return kl * self._aleks_lambda + self._aleks * (1 - self._aleks_lambda)
+        return self.blendALEKS(kl, self._aleks, self._aleks_lambda)
+
+    @staticmethod
+    def blendALEKS(kl = None, aleks = None, aleks_lambda = None):
+        #Blend the estimated knowledge level with the ALEKS score
+        return kl * aleks_lambda + aleks * (1 - aleks_lambda)
     
     def setKnowledgeLevel(self, conceptID = None, level = None):
         if (conceptID == None):
@@ -99,9 +111,77 @@ class BaseKnowledgeLevel(object):
         if (obsEst == None):
             raise ValueError("Input estimated knowledge is not available!")
 
+        self._applyUpdate(conceptID, obsEst)
+
+    def _applyUpdate(self, conceptID, obsEst):
+        #A concept updated again in a batch has to see what the observers write
+        #back first (e.g. the KM's ALEKS blend), as if it was updated alone
+        if (conceptID in self._batchConceptSet):
+            self._flushNotifications()
+
         #Update the KL
+        self._estimateKnowledge(conceptID, obsEst)
+
+        #Inform the observers
+        self._notifyObservers(conceptID)
+
+    def updateKnowledgeMany(self, updates = None):
+        #Apply a batch of (conceptID, obsEst) updates in order. The observers are
+        #informed with 'updateMany' at the end, or earlier when a concept repeats,
+        #so the result is the same as updating one by one.
+        if (updates == None):
+            raise ValueError("Input updates are not available!")
+
+        updates = list(updates)
+        for conceptID, obsEst in updates:
+            if (conceptID == None):
+                raise ValueError("Input conceptID is not available!")
+
+            if (obsEst == None):
+                raise ValueError("Input estimated knowledge is not available!")
+
+        with self.batchUpdates():
+            for conceptID, obsEst in updates:
+                self._applyUpdate(conceptID, obsEst)
+
+    @contextmanager
+    def batchUpdates(self):
+        #Collect the notifications of the updates made in the block, and inform
+        #each observer once at the end with 'updateMany', with the final estimation
+        #of every updated concept. Nested blocks are delivered by the outermost one.
+        #A concept updated again delivers the collected notifications first.
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if (self._batchDepth == 0):
+                self._flushNotifications()
+
+    def _flushNotifications(self):
+        conceptIDs = self._batchConcepts
+        self._batchConcepts = []
+        self._batchConceptSet = set()
+        if (not conceptIDs):
+            return
+
+        #Need to use method 'getKnowledgeLevel' to reflect the impact of ALEKS
+        changes = [(conceptID, self.getKnowledgeLevel(conceptID)) for conceptID in conceptIDs]
+
+        #Inform the observers
+        for observer in self._observers:
+            observer.updateMany(changes)
+
+    def _estimateKnowledge(self, conceptID, obsEst):
         self.setKnowledgeLevel(conceptID, obsEst)
 
+    def _notifyObservers(self, conceptID):
+        if (self._batchDepth > 0):
+            if (conceptID not in self._batchConceptSet):
+                self._batchConceptSet.add(conceptID)
+                self._batchConcepts.append(conceptID)
+            return
+
         #Need to use method 'getKnowledgeLevel' to reflect the impact of ALEKS
         currentEst = self.getKnowledgeLevel(conceptID)
 
@@ -132,13 +212,8 @@ class DecayKnowledgeLevel(BaseKnowledgeLevel):
 
         self._decay_lambda = decay_lambda
 
-    def updateKnowledge(self, conceptID = None, obsEst = None):
-        if (conceptID == None):
-            raise ValueError("Input conceptID is not available!")
-
-        if (obsEst == None):
-            raise ValueError("Input estimated knowledge is not available!")
-
+    #Override
+    def _estimateKnowledge(self, conceptID, obsEst):
         #Update the KL
         #Don't use method 'self.getKnowledgeLevel()',
         #because the impact of ALEKS is not necessary here.
@@ -150,12 +225,6 @@ class DecayKnowledgeLevel(BaseKnowledgeLevel):
             decayedEst = self.linearEstimation(pastEst, obsEst)
             self.setKnowledgeLevel(conceptID, decayedEst)
 
-        #Need to use method 'getKnowledgeLevel' to reflect the impact of ALEKS
-        currentEst = self.getKnowledgeLevel(conceptID)
-        #Inform the observers
-        for observer in self._observers:
-            observer.update(conceptID, currentEst)
-
     def linearEstimation(self, pastE = None, obsE = None):
         return self._decay_lambda*pastE + (1 - self._decay_lambda)*obsE
    
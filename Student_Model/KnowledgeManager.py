@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import math
+import threading
+from array import array
+from contextlib import contextmanager
+from itertools import izip
 
+from CompactKnowledge import ConceptIndex, CompactKnowledge
 from DummyDB import DummyDB
 from KnowledgeLevel import BaseKnowledgeLevel, DecayKnowledgeLevel
 from KnowledgeModel import BaseKnowledgeModel, PointKnowledgeModel, DependentKnowledgeModel, MinDependentKnowledgeModel
 from KnowledgeGraph import KnowledgeGraph
+from KnowledgeStore import BaseKnowledgeStore, KnowledgeCache
 
 class KnowledgeEstimator(object):
     """
@@ -14,7 +20,35 @@ class KnowledgeEstimator(object):
     """
     #EXPONENT_VAL = math.e # Replace math.e by '1.5' because it is relatively big causing too heavy penalty
     EXPONENT_VAL = 1.5
-    
+
+    #Number of hints + prompts whose level is precomputed
+    TABLE_SIZE = 64
+
+    #Init
+    def __init__(self, exponentVal = None):
+        #None --> use EXPONENT_VAL, as it is at the time of the estimation
+        self._exponentVal = exponentVal
+
+        #Level by the count of hints + prompts: [hints + prompts] = level,
+        #built again when the exponent changes
+        self._levels = None
+        self._levelsExponentVal = None
+
+    def getExponentVal(self):
+        if (self._exponentVal == None):
+            return self.EXPONENT_VAL
+        return self._exponentVal
+
+    def setExponentVal(self, exponentVal = None):
+        self._exponentVal = exponentVal
+
+    def _getLevels(self):
+        exponentVal = self.getExponentVal()
+        if (exponentVal != self._levelsExponentVal):
+            self._levels = dict((x, self.calculateLevel(x)) for x in xrange(self.TABLE_SIZE))
+            self._levelsExponentVal = exponentVal
+        return self._levels
+
     def __call__(self, hints = None, prompts = None, summary = None, lcc = None):
        
         o = self.estimateByObserving(hints, prompts, summary)
@@ -23,30 +57,236 @@ class KnowledgeEstimator(object):
 
         return obsEst
 
-    def estimateByObserving(self, hints = None, prompts = None, summary = None):
+    def calculateLevel(self, x = None):
         #TODO: Figure out the formula to estimate knowledge level based on the performance
         #Using the sigmoid formula to calculate the penalty to estimate the knowledge level
         #based on the observed performance
         # Penalty: y = 1 / (1 + e^(-x))
-        x = hints + prompts
-        y = 1 / (1 + math.pow(self.EXPONENT_VAL, -x))
+        y = 1 / (1 + math.pow(self.getExponentVal(), -x))
         
         y = y*2 -1 # Change range 0.5~1 (0~0.5 is not avaliable) to 0~1.
         
-        level = 1 - y
+        return 1 - y
+
+    def estimateByObserving(self, hints = None, prompts = None, summary = None):
+        #Look up the level, unless the count is out of the table (or not an integer)
+        x = hints + prompts
+        level = self._getLevels().get(x)
+        if (level == None):
+            level = self.calculateLevel(x)
 
         if (summary == True): # If bottom out summary is true
             level = level/2   # Penalty is to lose half points when reach the 'bottom out summary'
 
         return level
 
+    def estimateMany(self, hints = None, prompts = None, summary = None, lcc = None):
+        #Observed estimations of many performances at once: each input is a sequence
+        #with one value per performance. Return an array of the estimations.
+        levels = self._getLevels()
+        estimateByAll = self.estimateByAll
+        estimations = array('d')
+        for h, p, s, l in izip(hints, prompts, summary, lcc):
+            x = h + p
+            level = levels.get(x)
+            if (level == None):
+                level = self.calculateLevel(x)
+            if (s == True):
+                level = level/2
+            estimations.append(estimateByAll(level, l))
+        return estimations
+
     def estimateByAll(self, observing = None, LCC = None):
         #TODO: Figure out the formula to integrate all scores together
         # Temporarily return the average value
         return (observing + LCC) /2;
 
 
-class KnowledgeManager(object):
+class BaseKnowledgeManager(object):
+    """
+    This is the class that holds what is shared by the knowledge managers:
+    the knowledge graph, the DB tables and the estimator
+    """
+
+    #Init
+    def __init__(self):
+        #Knowledge graph
+        self._KG = KnowledgeGraph()
+
+        #Knowledge level of DB
+        self._knowledgeLevel = {}
+
+        #Knowledge graph of DB
+        #This variable is for every student
+        self._knowledgeGraph = {}
+
+        #Temporary DB
+        self.tmpDB = DummyDB()
+
+        #Knowledge store which the changed rows are saved to (None --> the temporary DB is used)
+        self._store = None
+
+        #Concept index shared by the students' compact tables (None --> tables are dicts)
+        self._conceptIndex = None
+
+        #An estimator which is used for calculate estimated KL based on the performance
+        self._estimator = KnowledgeEstimator()
+
+    #Initialize the parameters about KG
+    def initKnowledgeGraph(self):
+        self._KG.setDependency(self._knowledgeGraph)
+        
+        self._KG.updateConcept() #Because KG involves constant values only, its content needs to be update once only
+        
+    @staticmethod
+    def checkPerformance(studentID = None, conceptID = None, hints = None, prompts = None, summary = None, lcc = None):
+        #Validate the input of 'savePerformance' (also used by 'KnowledgeReplay')
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+        
+        if (conceptID == None):
+            raise ValueError("Input concept Id is not available!")
+    
+        if (hints == None or hints < 0):
+            raise ValueError("Hints value is invalid! (0, 1, 2, ..., n)")
+
+        if (prompts == None or prompts < 0):
+            raise ValueError("Prompts value is invalid! (0, 1, 2, ..., n)")
+
+        if (summary != True and summary != False):
+            raise ValueError("Prompts value is invalid! (True or False)")
+
+        if (lcc == None or lcc < 0):
+            raise ValueError("LCC score value is invalid! (0~1)")
+
+    def _estimateBatch(self, events):
+        #Validate a batch of (studentID, conceptID, hints, prompts, summary, lcc) events
+        #before anything is updated, and caculate all observed estimations up front.
+        #Return the students in order of appearance and [studentID] = [(conceptID, obsEst)]
+        events = list(events)
+        for event in events:
+            self.checkPerformance(*event)
+
+        #Estimate all performances at once, column by column
+        columns = zip(*events) or [()]*6
+        obsEsts = self._estimator.estimateMany(*columns[2:])
+
+        #Group the updates by student, keeping the order of the events
+        studentIDs = []
+        updates = {}
+        for event, obsEst in zip(events, obsEsts):
+            studentID = event[0]
+            if (studentID not in updates):
+                studentIDs.append(studentID)
+                updates[studentID] = []
+            updates[studentID].append((event[1], obsEst))
+
+        return studentIDs, updates
+
+    def setKnowledgeStore(self, store = None, capacity = None, writeThrough = False):
+        #Load/save the knowledge levels and the graph through a store (see 'KnowledgeStore')
+        #instead of the temporary DB. The students' tables are then loaded on first use
+        #and kept in a cache of the given capacity (see 'KnowledgeCache'); changes are
+        #saved on eviction and by 'saveKnowledgeDB', or at once if writeThrough is True.
+        if (store != None and not isinstance(store, BaseKnowledgeStore)):
+            raise TypeError("Input is not an acceptable type of knowledge store!")
+
+        self._store = store
+        if (store != None):
+            self._knowledgeLevel = KnowledgeCache(store, capacity, writeThrough)
+            self._knowledgeLevel.setEvictHandler(self._releaseStudent)
+            self._knowledgeLevel.setFactory(self._newKnowledge)
+        else:
+            self._knowledgeLevel = {}
+
+    def getKnowledgeStore(self):
+        return self._store
+
+    def getKnowledgeCache(self):
+        if (self._store == None):
+            return None
+        return self._knowledgeLevel
+
+    def setConceptIndex(self, conceptIndex = None):
+        #Keep the students' tables loaded or created from now on as compact arrays
+        #over the given concept index (see 'CompactKnowledge'), instead of dicts
+        if (conceptIndex != None and not isinstance(conceptIndex, ConceptIndex)):
+            raise TypeError("Input is not an acceptable type of concept index!")
+
+        self._conceptIndex = conceptIndex
+
+    def getConceptIndex(self):
+        return self._conceptIndex
+
+    def _newKnowledge(self, knowledge = None):
+        #A student's table, compact if there is a concept index
+        if (self._conceptIndex != None):
+            return CompactKnowledge(self._conceptIndex, knowledge)
+
+        if (knowledge == None):
+            knowledge = {}
+        return knowledge
+
+    def _releaseStudent(self, studentID):
+        #Called before the cache evicts a student; return False if he/she is in use
+        return True
+
+    def _saveChanges(self, studentID, conceptIDs):
+        #Mark the changed rows of a student dirty (or save them at once, with write-through)
+        if (self._store != None):
+            self._knowledgeLevel.markDirty(studentID, conceptIDs)
+
+    def loadKnowledgeDB(self):
+        #The students' tables are loaded again on use
+        if (self._store != None):
+            self._knowledgeLevel.clear()
+            return
+
+        #TODO: Replace this temorary DB by real DB
+        self._knowledgeLevel = self.tmpDB._knowledge
+        if (self._conceptIndex != None):
+            for studentID, knowledge in self._knowledgeLevel.items():
+                self._knowledgeLevel[studentID] = self._newKnowledge(knowledge)
+
+    def saveKnowledgeDB(self):
+        #Only the changed rows are saved
+        if (self._store != None):
+            self._knowledgeLevel.flush()
+            self._store.flush()
+            return
+
+        #TODO: Replace this temorary DB by real DB
+        self.tmpDB._knowledge = self._knowledgeLevel
+
+    def loadGraphDB(self):
+        if (self._store != None):
+            self._knowledgeGraph = self._store.loadDependency()
+            return
+
+        #TODO: Replace this temorary DB by real DB
+        self._knowledgeGraph = self.tmpDB._dependency
+
+    def saveGraphDB(self):
+        if (self._store != None):
+            self._store.saveDependency([(sourceID, targetID, weight)
+                                        for sourceID, targets in self._knowledgeGraph.iteritems()
+                                        for targetID, weight in targets.iteritems()])
+            return
+
+        #TODO: Replace this temorary DB by real DB
+        self.tmpDB._dependency = self._knowledgeGraph
+
+    def loadGraphSnapshot(self, path = None):
+        #Open the knowledge graph from a snapshot (see 'KnowledgeGraph.saveSnapshot')
+        #instead of building it from the DB. It replaces 'loadGraphDB' and 'initKnowledgeGraph'.
+        if (path == None):
+            raise ValueError("Input snapshot path is not available!")
+
+        self._KG.openSnapshot(path)
+        self._KG.updateConcept()
+
+
+class KnowledgeManager(BaseKnowledgeManager):
     """
     This is the class that manages students' performance and update his/her
     estimated knowledge level
@@ -54,6 +294,7 @@ class KnowledgeManager(object):
 
     #Init
     def __init__(self, KL = None, KM = None):
+        super(KnowledgeManager, self).__init__()
 
         #student KL (knowledge level)
         if (KL == None):
@@ -67,21 +308,8 @@ class KnowledgeManager(object):
         else:
             self._KM = KM
 
-        #Knowledge graph
-        self._KG = KnowledgeGraph()
-
-        #Knowledge level of DB
-        self._knowledgeLevel = {}
-
-        #Knowledge graph of DB
-        #This variable is for every student
-        self._knowledgeGraph = {}
-
-        #Temporary DB
-        self.tmpDB = DummyDB()
-
-        #An estimator which is used for calculate estimated KL based on the performance
-        self._estimator = KnowledgeEstimator()
+        #The student whose knowledge level is in KL and KM
+        self._studentID = None
 
         #Bind a KM to the KL as its observer
         self._KL.addObserver(self._KM)
@@ -119,18 +347,18 @@ class KnowledgeManager(object):
             raise ValueError("Input student Id is not available!")
         
         #Create a knowledge level table for the student
+        self._studentID = studentID
         studentKL = self._knowledgeLevel.get(studentID)
         self._KL.setKnowledge(studentKL)
 
         #Initialize the estimation in KM
         self._KM.setKnowledge(studentKL)
 
-    #Initialize the parameters about KG
-    def initKnowledgeGraph(self):
-        self._KG.setDependency(self._knowledgeGraph)
-        
-        self._KG.updateConcept() #Because KG involves constant values only, its content needs to be update once only
-        
+    #Override
+    def _releaseStudent(self, studentID):
+        #KL and KM work on the current student's table
+        return studentID != self._studentID
+
     #Pass the ALEKS score
     def setALEKS(self, aleks = None):
         if (aleks == None):
@@ -140,23 +368,7 @@ class KnowledgeManager(object):
     
     #Save the student's performance and update his/her estimated knowledge level
     def savePerformance(self, studentID = None, conceptID = None, hints = None, prompts = None, summary = None, lcc = None):
-        if (studentID == None):
-            raise ValueError("Input student Id is not available!")
-        
-        if (conceptID == None):
-            raise ValueError("Input concept Id is not available!")
-    
-        if (hints == None or hints < 0):
-            raise ValueError("Hints value is invalid! (0, 1, 2, ..., n)")
-
-        if (prompts == None or prompts < 0):
-            raise ValueError("Prompts value is invalid! (0, 1, 2, ..., n)")
-
-        if (summary != True and summary != False):
-            raise ValueError("Prompts value is invalid! (True or False)")
-
-        if (lcc == None or lcc < 0):
-            raise ValueError("LCC score value is invalid! (0~1)")
+        self.checkPerformance(studentID, conceptID, hints, prompts, summary, lcc)
 
         #Caculate the observed estimation about knowledge level based on the student's performance
         obsEst = self._estimator(hints, prompts, summary, lcc)
@@ -167,6 +379,29 @@ class KnowledgeManager(object):
         #Save updated estimation back to the knowledge level table
         #(The table need to be saved back to the DB later)
         self._knowledgeLevel[studentID] = self._KL.getKnowledge()
+        self._saveChanges(studentID, [conceptID])
+
+    #Save a batch of performances: (studentID, conceptID, hints, prompts, summary, lcc) events
+    def savePerformanceBatch(self, events = None):
+        if (events == None):
+            raise ValueError("Input performance events are not available!")
+
+        studentIDs, updates = self._estimateBatch(events)
+
+        #Update each student's estimation in turn; the observers are informed
+        #once per updated concept of the student
+        currentStudentID = self._studentID
+        for studentID in studentIDs:
+            if (self._knowledgeLevel.get(studentID) == None):
+                self._knowledgeLevel[studentID] = self._newKnowledge()
+            self.initKnowledgeLevel(studentID)
+            self._KL.updateKnowledgeMany(updates[studentID])
+            self._knowledgeLevel[studentID] = self._KL.getKnowledge()
+            self._saveChanges(studentID, [conceptID for conceptID, obsEst in updates[studentID]])
+
+        #Give KL and KM back to the student they were initialized for
+        if (currentStudentID != None):
+            self.initKnowledgeLevel(currentStudentID)
 
     def getKnowledgeLevel(self, conceptID = None):
         if (conceptID == None):
@@ -174,21 +409,350 @@ class KnowledgeManager(object):
 
         return self._KM.getKnowledgeLevel(conceptID)
 
+    def getKnowledgeLevels(self, conceptIDs = None):
+        #Knowledge levels of many concepts at once: [conceptID] = knowledge level
+        return self._KM.getKnowledgeLevels(conceptIDs)
+
+
+
+class StudentKnowledgeState(object):
+    """
+    This is the class that holds one student's KL and KM, bound to the
+    student's knowledge level table the same way KnowledgeManager binds
+    its own ones in 'initKnowledgeLevel'
+    """
+
+    #Init
+    def __init__(self, studentID = None, KL = None, KM = None, knowledge = None):
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        if (not isinstance(KL, BaseKnowledgeLevel)):
+            raise TypeError("Input is not an acceptable type of KL(knowledge level) object!")
+
+        if (not isinstance(KM, BaseKnowledgeModel)):
+            raise TypeError("Input is not an acceptable type of KM(knowledge Model) object!")
+
+        if (knowledge == None):
+            knowledge = {}
+
+        self._studentID = studentID
+        self._KL = KL
+        self._KM = KM
+
+        self._KL.setKnowledge(knowledge)
+        self._KM.setKnowledge(knowledge)
+
+        #Bind the KM to the KL as its observer
+        self._KL.addObserver(self._KM)
+
+    def getStudentID(self):
+        return self._studentID
+
+    def getKL(self):
+        return self._KL
+
+    def getKM(self):
+        return self._KM
+
+    def getKnowledge(self):
+        return self._KL.getKnowledge()
+
+
+class MultiStudentKnowledgeManager(BaseKnowledgeManager):
+    """
+    This is the class that manages many students' performance at once.
+    Every student has his/her own KL and KM (see 'StudentKnowledgeState'),
+    created on first use and kept in a sharded table, so that any student
+    can be served without re-initializing a shared KL and KM.
+    """
+    SHARD_COUNT = 64
+
+    #Init
+    def __init__(self, KLClass = None, KMClass = None, shardCount = None):
+        super(MultiStudentKnowledgeManager, self).__init__()
+
+        #Classes of the students' KL and KM
+        if (KLClass == None):
+            KLClass = DecayKnowledgeLevel
+        if (KMClass == None):
+            KMClass = PointKnowledgeModel
+
+        if (not issubclass(KLClass, BaseKnowledgeLevel)):
+            raise TypeError("Input is not an acceptable type of KL(knowledge level) class!")
+
+        if (not issubclass(KMClass, BaseKnowledgeModel)):
+            raise TypeError("Input is not an acceptable type of KM(knowledge Model) class!")
+
+        self._KLClass = KLClass
+        self._KMClass = KMClass
+
+        if (shardCount == None):
+            shardCount = self.SHARD_COUNT
+        if (shardCount <= 0):
+            raise ValueError("Shard count is invalid! (1, 2, ..., n)")
+
+        #Students' states: [shard][studentID] = StudentKnowledgeState
+        self._shards = [{} for i in xrange(shardCount)]
+
+        #ALEKS settings of the released students which are not the default ones,
+        #restored when their states are created again: [studentID] = (ALEKS, ALEKS lambda)
+        self._releasedALEKS = {}
+
+    def _getShard(self, studentID):
+        return self._shards[hash(studentID) % len(self._shards)]
+
+    def _createState(self, studentID):
+        #The KL works on the student's table of the DB, so nothing has to be copied back
+        knowledge = self._knowledgeLevel.get(studentID)
+        if (knowledge == None):
+            knowledge = self._knowledgeLevel[studentID] = self._newKnowledge()
+
+        state = StudentKnowledgeState(studentID, self._KLClass(), self._KMClass(), knowledge)
+        state.getKM().initGraph(self._KG)
+
+        aleks = self._releasedALEKS.pop(studentID, None)
+        if (aleks != None):
+            state.getKL().setALEKS(aleks[0])
+            state.getKL().setALEKSLambda(aleks[1])
+        return state
+
+    def getState(self, studentID = None):
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        shard = self._getShard(studentID)
+        state = shard.get(studentID)
+        if (state == None):
+            state = shard[studentID] = self._createState(studentID)
+        elif (self._store != None):
+            self._knowledgeLevel.touch(studentID)
+        return state
+
+    def removeState(self, studentID = None):
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        self._getShard(studentID).pop(studentID, None)
+        self._releasedALEKS.pop(studentID, None)
+
+    def getStateCount(self):
+        return sum(len(shard) for shard in self._shards)
+
+    #Override
+    def _releaseStudent(self, studentID):
+        #The student's state works on the evicted table, so it is created again on use,
+        #with the same ALEKS settings
+        state = self._getShard(studentID).pop(studentID, None)
+        if (state != None):
+            self._keepALEKS(state)
+        return True
+
+    @staticmethod
+    def _getALEKSSetting(state):
+        #(ALEKS, ALEKS lambda) of the state, None if they are the default ones
+        KL = state.getKL()
+        if (KL.getALEKS() != KL.ALEKS_LEVEL or KL.getALEKSLambda() != KL.ALEKS_LAMBDA):
+            return (KL.getALEKS(), KL.getALEKSLambda())
+        return None
+
+    def _keepALEKS(self, state):
+        #The ALEKS settings are not in the knowledge table, so keep them for the next state
+        aleks = self._getALEKSSetting(state)
+        if (aleks != None):
+            self._releasedALEKS[state.getStudentID()] = aleks
+
+    def getALEKSSettings(self):
+        #ALEKS settings of the students which are not the default ones, e.g. for
+        #'KnowledgeReplay': [studentID] = (ALEKS, ALEKS lambda)
+        settings = dict(self._releasedALEKS)
+        for shard in self._shards:
+            for studentID, state in shard.iteritems():
+                aleks = self._getALEKSSetting(state)
+                if (aleks != None):
+                    settings[studentID] = aleks
+        return settings
+
+    def _clearStates(self):
+        for shard in self._shards:
+            for state in shard.itervalues():
+                self._keepALEKS(state)
+            shard.clear()
+
+    def _initStatesGraph(self):
+        for shard in self._shards:
+            for state in shard.itervalues():
+                state.getKM().initGraph(self._KG)
+
+    #Pass the ALEKS score
+    def setALEKS(self, studentID = None, aleks = None):
+        if (aleks == None):
+            raise ValueError("Input ALEKS score is not available!")
+
+        self.getState(studentID).getKL().setALEKS(aleks)
+
+    #Save the student's performance and update his/her estimated knowledge level
+    def savePerformance(self, studentID = None, conceptID = None, hints = None, prompts = None, summary = None, lcc = None):
+        self.checkPerformance(studentID, conceptID, hints, prompts, summary, lcc)
+
+        #Caculate the observed estimation about knowledge level based on the student's performance
+        obsEst = self._estimator(hints, prompts, summary, lcc)
+
+        #Update the estimation
+        self.getState(studentID).getKL().updateKnowledge(conceptID, obsEst)
+        self._saveChanges(studentID, [conceptID])
+
+    #Save a batch of performances: (studentID, conceptID, hints, prompts, summary, lcc) events
+    def savePerformanceBatch(self, events = None):
+        if (events == None):
+            raise ValueError("Input performance events are not available!")
+
+        studentIDs, updates = self._estimateBatch(events)
+
+        for studentID in studentIDs:
+            self._updateState(studentID, updates[studentID])
+
+    def _updateState(self, studentID, updates):
+        self.getState(studentID).getKL().updateKnowledgeMany(updates)
+        self._saveChanges(studentID, [conceptID for conceptID, obsEst in updates])
+
+    def getKnowledgeLevel(self, studentID = None, conceptID = None):
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        return self.getState(studentID).getKM().getKnowledgeLevel(conceptID)
+
+    def getKnowledgeLevels(self, studentID = None, conceptIDs = None):
+        #Knowledge levels of many concepts at once: [conceptID] = knowledge level
+        return self.getState(studentID).getKM().getKnowledgeLevels(conceptIDs)
+
+    #Override
+    def initKnowledgeGraph(self):
+        super(MultiStudentKnowledgeManager, self).initKnowledgeGraph()
+        self._initStatesGraph()
+
+    #Override
+    def loadGraphSnapshot(self, path = None):
+        super(MultiStudentKnowledgeManager, self).loadGraphSnapshot(path)
+        self._initStatesGraph()
+
+    #Override
     def loadKnowledgeDB(self):
-        #TODO: Replace this temorary DB by real DB
-        self._knowledgeLevel = self.tmpDB._knowledge
+        #The states work on the old tables, so they are created again on use
+        super(MultiStudentKnowledgeManager, self).loadKnowledgeDB()
+        self._clearStates()
 
-    def saveKnowledgeDB(self):
-        #TODO: Replace this temorary DB by real DB
-        self.tmpDB._knowledge = self._knowledgeLevel
 
-    def loadGraphDB(self):
-        #TODO: Replace this temorary DB by real DB
-        self._knowledgeGraph = self.tmpDB._dependency
+class ConcurrentKnowledgeManager(MultiStudentKnowledgeManager):
+    """
+    This is a sub class of MultiStudentKnowledgeManager that can be used from
+    many threads at once. Students are striped over locks, one per shard of
+    the students' table: a student's whole update (KL, then its observers) or
+    read runs under the student's lock, so different students proceed in
+    parallel unless they share a stripe. Loading the DB or the graph takes
+    all the locks, in order. With a knowledge store, the cache loads and
+    saves each student outside of its own lock (see 'KnowledgeCache'), so
+    the students of different stripes do not wait for each other's I/O.
+    """
 
-    def saveGraphDB(self):
-        #TODO: Replace this temorary DB by real DB
-        self.tmpDB._dependency = self._knowledgeGraph
+    #Init
+    def __init__(self, KLClass = None, KMClass = None, shardCount = None):
+        super(ConcurrentKnowledgeManager, self).__init__(KLClass, KMClass, shardCount)
+
+        #One lock per shard: [shard] = lock
+        self._locks = [threading.RLock() for shard in self._shards]
+
+    def _getLock(self, studentID):
+        return self._locks[hash(studentID) % len(self._locks)]
+
+    @contextmanager
+    def _lockAll(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+    #Override
+    def _releaseStudent(self, studentID):
+        #A student being used by another thread is kept
+        lock = self._getLock(studentID)
+        if (not lock.acquire(False)):
+            return False
+        try:
+            return super(ConcurrentKnowledgeManager, self)._releaseStudent(studentID)
+        finally:
+            lock.release()
+
+    #Override
+    def getState(self, studentID = None):
+        #The state is only safe to use while holding the student's lock
+        with self._getLock(studentID):
+            return super(ConcurrentKnowledgeManager, self).getState(studentID)
+
+    #Override
+    def removeState(self, studentID = None):
+        with self._getLock(studentID):
+            super(ConcurrentKnowledgeManager, self).removeState(studentID)
+
+    #Override
+    def setALEKS(self, studentID = None, aleks = None):
+        with self._getLock(studentID):
+            super(ConcurrentKnowledgeManager, self).setALEKS(studentID, aleks)
+
+    #Override
+    def getALEKSSettings(self):
+        with self._lockAll():
+            return super(ConcurrentKnowledgeManager, self).getALEKSSettings()
+
+    #Override
+    def savePerformance(self, studentID = None, conceptID = None, hints = None, prompts = None, summary = None, lcc = None):
+        with self._getLock(studentID):
+            super(ConcurrentKnowledgeManager, self).savePerformance(studentID, conceptID, hints, prompts, summary, lcc)
+
+    #Override
+    def savePerformanceBatch(self, events = None):
+        if (events == None):
+            raise ValueError("Input performance events are not available!")
+
+        #Validation and estimation need no lock; each student is updated under his/her own lock
+        studentIDs, updates = self._estimateBatch(events)
+
+        for studentID in studentIDs:
+            with self._getLock(studentID):
+                self._updateState(studentID, updates[studentID])
+
+    #Override
+    def getKnowledgeLevel(self, studentID = None, conceptID = None):
+        with self._getLock(studentID):
+            return super(ConcurrentKnowledgeManager, self).getKnowledgeLevel(studentID, conceptID)
+
+    #Override
+    def getKnowledgeLevels(self, studentID = None, conceptIDs = None):
+        with self._getLock(studentID):
+            return super(ConcurrentKnowledgeManager, self).getKnowledgeLevels(studentID, conceptIDs)
+
+    #Override
+    def initKnowledgeGraph(self):
+        with self._lockAll():
+            super(ConcurrentKnowledgeManager, self).initKnowledgeGraph()
+
+    #Override
+    def loadGraphSnapshot(self, path = None):
+        with self._lockAll():
+            super(ConcurrentKnowledgeManager, self).loadGraphSnapshot(path)
+
+    #Override
+    def loadKnowledgeDB(self):
+        with self._lockAll():
+            super(ConcurrentKnowledgeManager, self).loadKnowledgeDB()
+
+    #Override
+    def saveKnowledgeDB(self):
+        with self._lockAll():
+            super(ConcurrentKnowledgeManager, self).saveKnowledgeDB()
     
     
 #Test cases
@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import math
+from array import array
+
+logger = logging.getLogger(__name__)
+
 class BaseKnowledgeModel(object):
     """
     This is a kind of abstract class, which is used to represent knowledge
@@ -32,13 +38,26 @@ class BaseKnowledgeModel(object):
     def setKnowledgeLevel(self, conceptID, level):
         self._knowledge[conceptID] = level
 
+    def getKnowledgeLevels(self, conceptIDs = None):
+        #Return [conceptID] = knowledge level for all requested concepts
+        #(all concepts with a knowledge level if none are requested)
+        if (conceptIDs == None):
+            conceptIDs = self._knowledge.keys()
+
+        return dict((conceptID, self.getKnowledgeLevel(conceptID)) for conceptID in conceptIDs)
+
     #Update 
     def update(self, conceptID, level):
-        print "[BaseKnowledgeModel] Update."
+        logger.debug("[BaseKnowledgeModel] Update.")
         self.setKnowledgeLevel(conceptID, level)
 
+    def updateMany(self, changes = None):
+        #Update with a batch of (conceptID, level) changes (see 'BaseKnowledgeLevel.batchUpdates')
+        for conceptID, level in changes:
+            self.update(conceptID, level)
+
     def initGraph(self, KG = None):
-        print "[BaseKnowledgeModel] InitGraph."
+        logger.debug("[BaseKnowledgeModel] InitGraph.")
         self._KG = KG
 
 
@@ -99,32 +118,528 @@ class MinDependentKnowledgeModel(DependentKnowledgeModel):
                 minLevel = kl
 
         return minLevel
+
+    #Override
+    def getKnowledgeLevels(self, conceptIDs = None):
+        #Same result as 'getKnowledgeLevel' for every requested concept, but computed in
+        #one pass over the graph in topological order: the minimal level among the parents
+        #of a concept is built from the results of its direct parents.
+        order = self._KG.getTopologicalOrder()
+        if (order == None):
+            #No topological order in a graph with a cycle
+            return super(MinDependentKnowledgeModel, self).getKnowledgeLevels(conceptIDs)
+
+        if (conceptIDs == None):
+            requested = set(order)
+            requested.update(self._knowledge.keys())
+        else:
+            requested = set(conceptIDs)
+
+        #Only the requested concepts and their parents take part in the pass
+        needed = set(requested)
+        if (conceptIDs != None):
+            for conceptID in requested:
+                needed.update(self._KG.getParents(conceptID))
+
+        #Minimal knowledge level of the parents: [conceptID] = level (None if no parent has a level)
+        parentsMin = {}
+        for conceptID in order:
+            if (conceptID not in needed):
+                continue
+
+            minLevel = None
+            for parentID in self._KG.getDependencyByTarget(conceptID):
+                for kl in (self._knowledge.get(parentID), parentsMin.get(parentID)):
+                    if (kl and (minLevel == None or kl < minLevel)):
+                        minLevel = kl
+            parentsMin[conceptID] = minLevel
+
+        rt = {}
+        for conceptID in requested:
+            level = self._knowledge.get(conceptID)
+            minLevel = parentsMin.get(conceptID)
+            if (level != None and minLevel != None and minLevel < level):
+                level = minLevel
+            rt[conceptID] = level
+
+        return rt
         
 class SpreadingActivationKnowledgeModel(BaseKnowledgeModel):
     """
     This is a sub class of BaseKnowledgeModel. This class calculate the
-    estimated knowledge level by using the idea of Spreading Activation
-    TODO: Implement this class in details
+    estimated knowledge level by using the idea of Spreading Activation:
+    every concept whose activation reaches the firing threshold fires once,
+    passing its activation times the dependency weight times the decay on to
+    its target concepts, for up to a maximal number of hops.
+    The graph is handled as a sparse adjacency matrix of concept indexes and
+    the activations as sparse vectors, so many students can be evaluated
+    against the same matrix at once.
     """
+    DECAY = 0.5
+    FIRING_THRESHOLD = 0.5
+    MAX_HOPS = 3
+    MAX_LEVEL = 1.0
 
     def __init__(self):
         #Inherit super class's attributes
         super(SpreadingActivationKnowledgeModel, self).__init__()
 
-    #TODO: Implementation
+        self._decay = self.DECAY
+        self._firingThreshold = self.FIRING_THRESHOLD
+        self._maxHops = self.MAX_HOPS
+
+        #Activation of the current knowledge, cached until the knowledge changes
+        #Activation: [conceptID] = activated knowledge level
+        self._activation = None
+
+    def getDecay(self):
+        return self._decay
+
+    def setDecay(self, decay = None):
+        if (decay == None):
+            raise ValueError("Input decay is not available!")
+
+        self._decay = decay
+        self._activation = None
+
+    def getFiringThreshold(self):
+        return self._firingThreshold
+
+    def setFiringThreshold(self, firingThreshold = None):
+        if (firingThreshold == None):
+            raise ValueError("Input firing threshold is not available!")
+
+        self._firingThreshold = firingThreshold
+        self._activation = None
+
+    def getMaxHops(self):
+        return self._maxHops
+
+    def setMaxHops(self, maxHops = None):
+        if (maxHops == None or maxHops < 0):
+            raise ValueError("Input max hops is invalid! (0, 1, 2, ..., n)")
+
+        self._maxHops = maxHops
+        self._activation = None
+
+    #Override
+    def setKnowledge(self, knowledge = None):
+        super(SpreadingActivationKnowledgeModel, self).setKnowledge(knowledge)
+        self._activation = None
+
+    #Override
+    def setKnowledgeLevel(self, conceptID, level):
+        super(SpreadingActivationKnowledgeModel, self).setKnowledgeLevel(conceptID, level)
+        self._activation = None
+
+    #Override
+    def initGraph(self, KG = None):
+        super(SpreadingActivationKnowledgeModel, self).initGraph(KG)
+        self._activation = None
+
+    def _getAdjacency(self):
+        #Shared by all the models on the graph (see 'KnowledgeGraph.getAdjacency')
+        return self._KG.getAdjacency()
+
+    def _spread(self, vectors):
+        #Spread each sparse activation vector ([index] = activation) over the
+        #adjacency, hop by hop; a vector stops as soon as no new concept fires
+        conceptIDs, conceptIndex, rows = self._getAdjacency()
+        decay = self._decay
+        threshold = self._firingThreshold
+        maxLevel = self.MAX_LEVEL
+
+        for activation in vectors:
+            frontier = [i for i, a in activation.iteritems() if a >= threshold]
+            fired = set(frontier)
+            for hop in xrange(self._maxHops):
+                if (not frontier):
+                    break
+
+                #One sparse matrix-vector product, restricted to the firing concepts
+                delta = {}
+                for i in frontier:
+                    a = activation[i] * decay
+                    for j, w in rows[i]:
+                        delta[j] = delta.get(j, 0.0) + a * w
+
+                frontier = []
+                for j, d in delta.iteritems():
+                    a = min(maxLevel, activation.get(j, 0.0) + d)
+                    activation[j] = a
+                    if (a >= threshold and j not in fired):
+                        fired.add(j)
+                        frontier.append(j)
+
+        return vectors
+
+    def _toVector(self, knowledge):
+        conceptIDs, conceptIndex, rows = self._getAdjacency()
+        vector = {}
+        extra = {}
+        for conceptID, level in knowledge.iteritems():
+            if (level == None):
+                continue
+            i = conceptIndex.get(conceptID)
+            if (i == None):
+                #Not in the graph, so it does not spread
+                extra[conceptID] = level
+            else:
+                vector[i] = level
+        return vector, extra
+
+    def activate(self, knowledge = None):
+        #Return the activated knowledge levels: [conceptID] = level
+        if (knowledge == None):
+            raise ValueError("Input knowledge is not available!")
+
+        return self.activateMany([knowledge])[0]
+
+    def activateMany(self, knowledges = None):
+        #Batched evaluation: one [conceptID] = level dict per student,
+        #all spread against the same adjacency
+        if (knowledges == None):
+            raise ValueError("Input knowledges are not available!")
+
+        conceptIDs = self._getAdjacency()[0]
+        converted = [self._toVector(knowledge) for knowledge in knowledges]
+        vectors = self._spread([vector for vector, extra in converted])
+
+        rt = []
+        for vector, (ignored, extra) in zip(vectors, converted):
+            activation = dict((conceptIDs[i], a) for i, a in vector.iteritems())
+            activation.update(extra)
+            rt.append(activation)
+        return rt
+
+    def activateMatrix(self, knowledges = None, conceptIDs = None):
+        #Batched evaluation as a (students x concepts) matrix: one row per student,
+        #one column per requested concept (all concepts of the graph by default).
+        #Concepts without any activation are 0.
+        if (conceptIDs == None):
+            conceptIDs = self._getAdjacency()[0]
+
+        return [[activation.get(conceptID, 0.0) for conceptID in conceptIDs]
+                for activation in self.activateMany(knowledges)]
+
+    def _getActivation(self):
+        if (self._activation == None):
+            self._activation = self.activate(self._knowledge)
+        return self._activation
+
+    #Override
+    def getKnowledgeLevel(self, conceptID = None):
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        return self._getActivation().get(conceptID)
+
+    #Override
+    def getKnowledgeLevels(self, conceptIDs = None):
+        activation = self._getActivation()
+        if (conceptIDs == None):
+            return dict(activation)
+
+        return dict((conceptID, activation.get(conceptID)) for conceptID in conceptIDs)
 
 class BayesianKnowledgeModel(BaseKnowledgeModel):
     """
     This is a sub class of BaseKnowledgeModel. This class calculate the
-    estimated knowledge level by using the idea of Bayesian
-    TODO: Implement this class in details
+    estimated knowledge level by using the idea of Bayesian Knowledge Tracing:
+    the knowledge level is the probability that a concept is learned, updated
+    by Bayes' rule after each observed answer and by the chance to learn it
+    afterwards. Every concept has its own parameters (prior, learn, guess, slip),
+    stored in arrays indexed by concept.
+    The knowledge table is shared with KL, which writes its own estimation into
+    it before informing the model; so the model keeps the posteriors of the
+    bound table and proceeds from them, and writes them back into the table.
     """
+    PRIOR = 0.3
+    LEARN = 0.1
+    GUESS = 0.2
+    SLIP = 0.1
+
+    #Parameters are kept away from 0 and 1, where the posterior is undefined
+    MIN_PARAMETER = 1e-4
 
     def __init__(self):
         #Inherit super class's attributes
         super(BayesianKnowledgeModel, self).__init__()
 
-    #TODO: Implementation
+        #Concept table: [conceptID] = index of its parameters
+        self._conceptIndex = {}
+
+        #Parameters: [index] = value
+        self._prior = array('d')
+        self._learn = array('d')
+        self._guess = array('d')
+        self._slip = array('d')
+
+        #Posteriors of the bound knowledge table: [conceptID] = knowledge level
+        self._posteriors = {}
+
+    def _getIndex(self, conceptID):
+        index = self._conceptIndex.get(conceptID)
+        if (index == None):
+            index = len(self._prior)
+            self._conceptIndex[conceptID] = index
+            self._prior.append(self.PRIOR)
+            self._learn.append(self.LEARN)
+            self._guess.append(self.GUESS)
+            self._slip.append(self.SLIP)
+        return index
+
+    def _clamp(self, value):
+        return min(max(value, self.MIN_PARAMETER), 1 - self.MIN_PARAMETER)
+
+    def getParameters(self, conceptID = None):
+        #Return (prior, learn, guess, slip) of the concept
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        index = self._conceptIndex.get(conceptID)
+        if (index == None):
+            return (self.PRIOR, self.LEARN, self.GUESS, self.SLIP)
+        return (self._prior[index], self._learn[index], self._guess[index], self._slip[index])
+
+    def setParameters(self, conceptID = None, prior = None, learn = None, guess = None, slip = None):
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        if (prior == None or learn == None or guess == None or slip == None):
+            raise ValueError("Input BKT parameters are not available!")
+
+        index = self._getIndex(conceptID)
+        self._prior[index] = self._clamp(prior)
+        self._learn[index] = self._clamp(learn)
+        self._guess[index] = self._clamp(guess)
+        self._slip[index] = self._clamp(slip)
+
+    def _posterior(self, index, level, correct):
+        #Bayes' rule on the answer, then the chance to learn the concept
+        guess = self._guess[index]
+        slip = self._slip[index]
+        if (correct):
+            known = level * (1 - slip)
+            posterior = known / (known + (1 - level) * guess)
+        else:
+            known = level * slip
+            posterior = known / (known + (1 - level) * (1 - guess))
+        return posterior + (1 - posterior) * self._learn[index]
+
+    #Override
+    def setKnowledge(self, knowledge = None):
+        super(BayesianKnowledgeModel, self).setKnowledge(knowledge)
+
+        #The levels in the table are the posteriors written back by the model
+        self._posteriors = {}
+        if (knowledge != None):
+            self._posteriors.update(knowledge)
+
+    #Override
+    def setKnowledgeLevel(self, conceptID, level):
+        self._posteriors[conceptID] = level
+        super(BayesianKnowledgeModel, self).setKnowledgeLevel(conceptID, level)
+
+    #Override
+    def getKnowledgeLevel(self, conceptID = None):
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        level = self._knowledge.get(conceptID)
+        if (level == None and conceptID in self._conceptIndex):
+            level = self._prior[self._conceptIndex[conceptID]]
+        return level
+
+    def observe(self, conceptID = None, correct = None):
+        #Update the current knowledge with one observed answer
+        if (conceptID == None):
+            raise ValueError("Input concept id is not available!")
+
+        if (correct != True and correct != False):
+            raise ValueError("Input answer is invalid! (True or False)")
+
+        index = self._getIndex(conceptID)
+        level = self._posteriors.get(conceptID)
+        if (level == None):
+            level = self._prior[index]
+        self.setKnowledgeLevel(conceptID, self._posterior(index, level, correct))
+
+    #Override
+    def update(self, conceptID, level):
+        #The estimated level from KL is used as soft evidence:
+        #the probability that the observed answer was correct.
+        #The table already holds KL's estimation, so start from the last posterior.
+        index = self._getIndex(conceptID)
+        past = self._posteriors.get(conceptID)
+        if (past == None):
+            past = self._prior[index]
+        posterior = level * self._posterior(index, past, True) + (1 - level) * self._posterior(index, past, False)
+        self.setKnowledgeLevel(conceptID, posterior)
+
+    def observeMany(self, observations = None, knowledge = None):
+        #Apply a batch of (studentID, conceptID, correct) observations in order.
+        #knowledge: [studentID][conceptID] = knowledge level, updated in place
+        #(a new table is created if not given). Return the table.
+        if (observations == None):
+            raise ValueError("Input observations are not available!")
+
+        if (knowledge == None):
+            knowledge = {}
+
+        #Bind the arrays once; the loop body is the hot path
+        conceptIndex = self._conceptIndex
+        getIndex = self._getIndex
+        prior = self._prior
+        learn = self._learn
+        guess = self._guess
+        slip = self._slip
+        for studentID, conceptID, correct in observations:
+            index = conceptIndex.get(conceptID)
+            if (index == None):
+                index = getIndex(conceptID)
+
+            studentKnowledge = knowledge.get(studentID)
+            if (studentKnowledge == None):
+                studentKnowledge = knowledge[studentID] = {}
+
+            level = studentKnowledge.get(conceptID)
+            if (level == None):
+                level = prior[index]
+
+            if (correct):
+                known = level * (1 - slip[index])
+                posterior = known / (known + (1 - level) * guess[index])
+            else:
+                known = level * slip[index]
+                posterior = known / (known + (1 - level) * (1 - guess[index]))
+            studentKnowledge[conceptID] = posterior + (1 - posterior) * learn[index]
+
+        return knowledge
+
+    def _accumulate(self, stats, index, answers):
+        #E-step for one sequence of answers of one student on one concept:
+        #forward-backward over the two states (learned, unlearned), scaled per step.
+        #Return the log-likelihood of the sequence.
+        p0 = self._prior[index]
+        learn = self._learn[index]
+        guess = self._guess[index]
+        slip = self._slip[index]
+        n = len(answers)
+
+        eL = [(1 - slip) if answer else slip for answer in answers]
+        eU = [guess if answer else (1 - guess) for answer in answers]
+
+        aL = [0.0]*n
+        aU = [0.0]*n
+        l = p0 * eL[0]
+        u = (1 - p0) * eU[0]
+        z = l + u
+        aL[0] = l / z
+        aU[0] = u / z
+        logLikelihood = math.log(z)
+        for t in xrange(1, n):
+            l = (aL[t - 1] + aU[t - 1] * learn) * eL[t]
+            u = aU[t - 1] * (1 - learn) * eU[t]
+            z = l + u
+            aL[t] = l / z
+            aU[t] = u / z
+            logLikelihood += math.log(z)
+
+        bL = [1.0]*n
+        bU = [1.0]*n
+        for t in xrange(n - 2, -1, -1):
+            l = eL[t + 1] * bL[t + 1]
+            u = learn * eL[t + 1] * bL[t + 1] + (1 - learn) * eU[t + 1] * bU[t + 1]
+            z = l + u
+            bL[t] = l / z
+            bU[t] = u / z
+
+        #stats: [index] = [sequences, first learned, learn numerator, learn denominator,
+        #                  guess numerator, unlearned total, slip numerator, learned total]
+        row = stats.get(index)
+        if (row == None):
+            row = stats[index] = [0.0]*8
+        row[0] += 1
+        for t in xrange(n):
+            gL = aL[t] * bL[t]
+            gU = aU[t] * bU[t]
+            z = gL + gU
+            gL /= z
+            gU /= z
+            if (t == 0):
+                row[1] += gL
+            if (answers[t]):
+                row[4] += gU
+            else:
+                row[6] += gL
+            row[5] += gU
+            row[7] += gL
+
+            if (t < n - 1):
+                ll = aL[t] * eL[t + 1] * bL[t + 1]
+                ul = aU[t] * learn * eL[t + 1] * bL[t + 1]
+                uu = aU[t] * (1 - learn) * eU[t + 1] * bU[t + 1]
+                z = ll + ul + uu
+                row[2] += ul / z
+                row[3] += (ul + uu) / z
+
+        return logLikelihood
+
+    def fit(self, log = None, iterations = 10, tolerance = 1e-4):
+        #Fit the parameters of every concept by EM (Baum-Welch).
+        #log: a re-iterable of chunks of (studentID, conceptID, correct) rows, such
+        #as an 'EventLog', ordered by student and by time within a student. Each
+        #iteration streams over the log once, keeping only the current student's
+        #answers in memory. Return the log-likelihood of the last iteration.
+        if (log == None):
+            raise ValueError("Input interaction log is not available!")
+
+        logLikelihood = None
+        for iteration in xrange(iterations):
+            stats = {}
+            logLikelihood = 0.0
+            finished = set()
+            currentStudent = None
+            sequences = {}
+            for chunk in log:
+                for studentID, conceptID, correct in chunk:
+                    if (studentID != currentStudent):
+                        for index, answers in sequences.iteritems():
+                            logLikelihood += self._accumulate(stats, index, answers)
+                        if (studentID in finished):
+                            raise ValueError("Interaction log is not ordered by student!")
+                        finished.add(currentStudent)
+                        currentStudent = studentID
+                        sequences = {}
+
+                    index = self._getIndex(conceptID)
+                    if (index not in sequences):
+                        sequences[index] = []
+                    sequences[index].append(bool(correct))
+            for index, answers in sequences.iteritems():
+                logLikelihood += self._accumulate(stats, index, answers)
+
+            #M-step
+            change = 0.0
+            for index, row in stats.iteritems():
+                sequenceCount, firstLearned, learnNum, learnDen, guessNum, unlearned, slipNum, learned = row
+                updated = [(self._prior, firstLearned / sequenceCount)]
+                if (learnDen > 0):
+                    updated.append((self._learn, learnNum / learnDen))
+                if (unlearned > 0):
+                    updated.append((self._guess, guessNum / unlearned))
+                if (learned > 0):
+                    updated.append((self._slip, slipNum / learned))
+                for parameters, value in updated:
+                    value = self._clamp(value)
+                    change = max(change, abs(parameters[index] - value))
+                    parameters[index] = value
+
+            if (change < tolerance):
+                break
+
+        return logLikelihood
 
 #Test cases
 if __name__ == '__main__':
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import cPickle
+import os
+import shutil
+import tempfile
+import zlib
+from itertools import izip
+from multiprocessing import Pool
+
+from EventLog import EventLog
+from KnowledgeLevel import DecayKnowledgeLevel
+from KnowledgeManager import BaseKnowledgeManager, KnowledgeEstimator
+from KnowledgeStore import BaseKnowledgeStore
+
+def getShard(studentID, shardCount):
+    #Stable over processes and runs, unlike 'hash'
+    return zlib.crc32(str(studentID)) % shardCount
+
+def _readShard(path):
+    #The chunks of parsed events of one shard (see 'KnowledgeReplay._spool')
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield cPickle.load(f)
+            except EOFError:
+                return
+
+def _replayShard(args):
+    #Run by the workers of the pool: replay the events of one shard of the students
+    path, estimator, KL, blend, aleksSettings = args
+    return KnowledgeReplay(estimator, KL, None, None, blend)._replay(_readShard(path), aleksSettings)
+
+
+class KnowledgeReplay(object):
+    """
+    This is the class that rebuilds every student's knowledge level from a
+    log of performance events, e.g. after the estimator or the decay lambda
+    has changed, without going through 'KnowledgeManager.savePerformance'
+    event by event. The log is read in chunks (see 'EventLog'); each chunk
+    is estimated at once (see 'KnowledgeEstimator.estimateMany') and grouped
+    by (student, concept), and every group is folded into its running level
+    with 'DecayKnowledgeLevel.linearEstimation', in the order of the log.
+    As the knowledge model keeps the level blended with ALEKS in the
+    student's table after every update (see 'BaseKnowledgeModel.update'),
+    every step is blended with the student's ALEKS settings, unless 'blend'
+    is False. They are given per student to 'replay' (e.g. from
+    'MultiStudentKnowledgeManager.getALEKSSettings'); the other students
+    use the KL's ones.
+    The events are checked as 'savePerformance' checks its input. The
+    students can be sharded over a pool of processes: the log is read once,
+    its events are spooled to one temporary file per shard, and each process
+    replays the students of its own file.
+    """
+    WRITE_BATCH_SIZE = 10000
+
+    #Init
+    def __init__(self, estimator = None, KL = None, processes = None, chunkSize = None, blend = True):
+        if (estimator == None):
+            estimator = KnowledgeEstimator()
+        if (not isinstance(estimator, KnowledgeEstimator)):
+            raise TypeError("Input is not an acceptable type of knowledge estimator!")
+
+        #The KL whose decay lambda and 'linearEstimation' are used for the updates
+        if (KL == None):
+            KL = DecayKnowledgeLevel()
+        if (not isinstance(KL, DecayKnowledgeLevel)):
+            raise TypeError("Input is not an acceptable type of KL(knowledge level) object!")
+
+        #Number of worker processes (None or 1 --> replay in this process)
+        if (processes != None and processes <= 0):
+            raise ValueError("Process count is invalid! (1, 2, ..., n)")
+
+        self._estimator = estimator
+        self._KL = KL
+        self._processes = processes
+        self._chunkSize = chunkSize
+        self._blend = blend
+
+    def _readChunks(self, source):
+        #Parse the log in chunks, checking every event before it is replayed
+        checkPerformance = BaseKnowledgeManager.checkPerformance
+        for chunk in EventLog(source, self._chunkSize, EventLog.parsePerformance):
+            for event in chunk:
+                checkPerformance(*event)
+            yield chunk
+
+    def _spool(self, source, directory, shardCount):
+        #Partition the log by shard, into one file of pickled chunks per shard. Return the paths.
+        paths = [os.path.join(directory, 'shard%d' % shard) for shard in xrange(shardCount)]
+        files = [open(path, 'wb') for path in paths]
+        try:
+            for chunk in self._readChunks(source):
+                shards = [[] for shard in xrange(shardCount)]
+                for event in chunk:
+                    shards[getShard(event[0], shardCount)].append(event)
+                for f, events in izip(files, shards):
+                    if (events):
+                        cPickle.dump(events, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            for f in files:
+                f.close()
+        return paths
+
+    def _replay(self, chunks, aleksSettings):
+        #Return [studentID][conceptID] = knowledge level of the students of the chunks of events
+        estimateMany = self._estimator.estimateMany
+        linearEstimation = self._KL.linearEstimation
+        blendALEKS = self._KL.blendALEKS
+        blend = self._blend
+        defaultSetting = (self._KL.getALEKS(), self._KL.getALEKSLambda())
+
+        knowledge = {}
+        for chunk in chunks:
+            studentIDs, conceptIDs, hints, prompts, summary, lcc = zip(*chunk)
+            obsEsts = estimateMany(hints, prompts, summary, lcc)
+
+            #Group the chunk by (student, concept), keeping the order of the events
+            groups = {}
+            for studentID, conceptID, obsEst in izip(studentIDs, conceptIDs, obsEsts):
+                key = (studentID, conceptID)
+                group = groups.get(key)
+                if (group == None):
+                    groups[key] = [obsEst]
+                else:
+                    group.append(obsEst)
+
+            #Fold every group into the level carried over from the previous chunks
+            for (studentID, conceptID), group in groups.iteritems():
+                studentKnowledge = knowledge.get(studentID)
+                if (studentKnowledge == None):
+                    studentKnowledge = knowledge[studentID] = {}
+
+                aleks, aleksLambda = aleksSettings.get(studentID, defaultSetting)
+                level = studentKnowledge.get(conceptID)
+                for obsEst in group:
+                    if (level != None):
+                        obsEst = linearEstimation(level, obsEst)
+                    level = blendALEKS(obsEst, aleks, aleksLambda) if blend else obsEst
+                studentKnowledge[conceptID] = level
+
+        return knowledge
+
+    def replay(self, source = None, aleksSettings = None):
+        #Return [studentID][conceptID] = knowledge level.
+        #aleksSettings: [studentID] = (ALEKS, ALEKS lambda) of the students not using the KL's ones
+        if (source == None):
+            raise ValueError("Input event source is not available!")
+
+        if (aleksSettings == None):
+            aleksSettings = {}
+
+        if (self._processes == None or self._processes == 1):
+            return self._replay(self._readChunks(source), aleksSettings)
+
+        shardCount = self._processes
+        directory = tempfile.mkdtemp()
+        try:
+            #An invalid event is raised here, before any shard is replayed
+            paths = self._spool(source, directory, shardCount)
+
+            #Every worker only gets the settings of its own students
+            shardSettings = [{} for shard in xrange(shardCount)]
+            for studentID, aleks in aleksSettings.iteritems():
+                shardSettings[getShard(studentID, shardCount)][studentID] = aleks
+
+            pool = Pool(self._processes)
+            try:
+                shards = pool.map(_replayShard, [(path, self._estimator, self._KL, self._blend, settings)
+                                                 for path, settings in izip(paths, shardSettings)])
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shutil.rmtree(directory, True)
+
+        #The shards have no student in common
+        knowledge = {}
+        for shardKnowledge in shards:
+            knowledge.update(shardKnowledge)
+        return knowledge
+
+    def replayToStore(self, source = None, store = None, aleksSettings = None):
+        #Replay the log and save the new knowledge levels to a knowledge store, in batches
+        if (not isinstance(store, BaseKnowledgeStore)):
+            raise TypeError("Input is not an acceptable type of knowledge store!")
+
+        knowledge = self.replay(source, aleksSettings)
+
+        rows = []
+        for studentID, studentKnowledge in knowledge.iteritems():
+            for conceptID, level in studentKnowledge.iteritems():
+                rows.append((studentID, conceptID, level))
+                if (len(rows) >= self.WRITE_BATCH_SIZE):
+                    store.saveKnowledge(rows)
+                    rows = []
+        if (rows):
+            store.saveKnowledge(rows)
+        store.flush()
+
+        return knowledge
+
+
+#Test cases
+if __name__ == '__main__':
+    print "--Start Test--"
+
+    events = [('00126', 'Math-4', 2, 1, False, 0.8),
+              ('00126', 'Math-4', 0, 0, False, 0.9),
+              ('00125', 'Math-1', 1, 0, True, 0.5)]
+
+    print KnowledgeReplay().replay(events)
+
+    print "--End of test--"
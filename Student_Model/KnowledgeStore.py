@@ -0,0 +1,1014 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+from DummyDB import DummyDB
+
+logger = logging.getLogger(__name__)
+
+class BaseKnowledgeStore(object):
+    """
+    This is a kind of abstract class, which is used to represent the
+    persistent storage of students' knowledge levels, row by row:
+    (studentID, conceptID) --> knowledge level
+    This class must be inherited
+    """
+
+    def loadKnowledge(self, studentID = None):
+        #Return [conceptID] = knowledge level, or None if the student has no records
+        raise NotImplementedError
+
+    def loadAllKnowledge(self):
+        #Return [studentID][conceptID] = knowledge level
+        raise NotImplementedError
+
+    def saveKnowledge(self, rows = None):
+        #Save (studentID, conceptID, knowledge level) rows, in one transaction
+        raise NotImplementedError
+
+    def loadDependency(self):
+        #Return [source concept ID][target concept ID] = weight
+        raise NotImplementedError
+
+    def saveDependency(self, rows = None):
+        #Replace the whole dependency with (source concept ID, target concept ID, weight) rows, in one transaction
+        raise NotImplementedError
+
+    def flush(self):
+        #Make sure that all saved rows are persisted
+        pass
+
+    def close(self):
+        pass
+
+
+class DummyKnowledgeStore(BaseKnowledgeStore):
+    """
+    This is a sub class of BaseKnowledgeStore on top of the knowledge
+    table of the temporary DB (see 'DummyDB')
+    """
+
+    #Init
+    def __init__(self, db = None):
+        if (db == None):
+            db = DummyDB()
+        self._db = db
+
+    def loadKnowledge(self, studentID = None):
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        knowledge = self._db._knowledge.get(studentID)
+        if (knowledge == None):
+            return None
+        return dict(knowledge)
+
+    def loadAllKnowledge(self):
+        return dict((studentID, dict(knowledge)) for studentID, knowledge in self._db._knowledge.iteritems())
+
+    def saveKnowledge(self, rows = None):
+        if (rows == None):
+            raise ValueError("Input knowledge rows are not available!")
+
+        table = self._db._knowledge
+        for studentID, conceptID, level in rows:
+            if (table.get(studentID) == None):
+                table[studentID] = {}
+            table[studentID][conceptID] = level
+
+    def loadDependency(self):
+        return dict((sourceID, dict(targets)) for sourceID, targets in self._db._dependency.iteritems())
+
+    def saveDependency(self, rows = None):
+        if (rows == None):
+            raise ValueError("Input dependency rows are not available!")
+
+        #Dependencies removed from the graph are not kept (rows may come from the table itself)
+        rows = list(rows)
+        table = self._db._dependency
+        table.clear()
+        for sourceID, targetID, weight in rows:
+            if (table.get(sourceID) == None):
+                table[sourceID] = {}
+            table[sourceID][targetID] = weight
+
+
+class SQLiteKnowledgeStore(BaseKnowledgeStore):
+    """
+    This is a sub class of BaseKnowledgeStore on top of a local SQLite
+    file, so that no outside DB service is needed. The DB runs in WAL mode,
+    so the readers do not block the writer. Every thread gets its own
+    connection; the statements are constant, so the connection caches them
+    prepared. Rows are saved in bulk ('executemany') as upserts, and a
+    student's knowledge is read on its own through the primary key.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS knowledge ("
+        " student_id TEXT NOT NULL, concept_id TEXT NOT NULL, level REAL,"
+        " PRIMARY KEY (student_id, concept_id)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS knowledge_concept ON knowledge (concept_id)",
+        "CREATE TABLE IF NOT EXISTS dependency ("
+        " source_id TEXT NOT NULL, target_id TEXT NOT NULL, weight REAL,"
+        " PRIMARY KEY (source_id, target_id)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS dependency_target ON dependency (target_id)",
+        )
+
+    SELECT_KNOWLEDGE = "SELECT concept_id, level FROM knowledge WHERE student_id = ?"
+    SELECT_ALL_KNOWLEDGE = "SELECT student_id, concept_id, level FROM knowledge"
+    UPSERT_KNOWLEDGE = "INSERT OR REPLACE INTO knowledge (student_id, concept_id, level) VALUES (?, ?, ?)"
+    SELECT_DEPENDENCY = "SELECT source_id, target_id, weight FROM dependency"
+    DELETE_DEPENDENCY = "DELETE FROM dependency"
+    UPSERT_DEPENDENCY = "INSERT OR REPLACE INTO dependency (source_id, target_id, weight) VALUES (?, ?, ?)"
+
+    #Init
+    def __init__(self, path = None, timeout = 30.0):
+        if (path == None or path == ':memory:'):
+            #Every thread has its own connection, so they must share a file
+            raise ValueError("Input DB file path is not available!")
+
+        self._path = path
+        self._timeout = timeout
+
+        #Connection of each thread, and all of them to be closed at the end
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        connection = self._getConnection()
+        connection.execute("PRAGMA journal_mode = WAL")
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def _getConnection(self):
+        connection = getattr(self._local, 'connection', None)
+        if (connection == None):
+            connection = sqlite3.connect(self._path, timeout = self._timeout, check_same_thread = False)
+            connection.text_factory = str
+            #WAL keeps the DB consistent after a crash without syncing on every commit
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def loadKnowledge(self, studentID = None):
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        knowledge = dict(self._getConnection().execute(self.SELECT_KNOWLEDGE, (studentID,)))
+        if (not knowledge):
+            return None
+        return knowledge
+
+    def loadAllKnowledge(self):
+        table = {}
+        for studentID, conceptID, level in self._getConnection().execute(self.SELECT_ALL_KNOWLEDGE):
+            knowledge = table.get(studentID)
+            if (knowledge == None):
+                knowledge = table[studentID] = {}
+            knowledge[conceptID] = level
+        return table
+
+    def saveKnowledge(self, rows = None):
+        if (rows == None):
+            raise ValueError("Input knowledge rows are not available!")
+
+        connection = self._getConnection()
+        with connection:
+            connection.executemany(self.UPSERT_KNOWLEDGE, rows)
+
+    def loadDependency(self):
+        dependency = {}
+        for sourceID, targetID, weight in self._getConnection().execute(self.SELECT_DEPENDENCY):
+            targets = dependency.get(sourceID)
+            if (targets == None):
+                targets = dependency[sourceID] = {}
+            targets[targetID] = weight
+        return dependency
+
+    def saveDependency(self, rows = None):
+        if (rows == None):
+            raise ValueError("Input dependency rows are not available!")
+
+        connection = self._getConnection()
+        #Dependencies removed from the graph are not kept
+        with connection:
+            connection.execute(self.DELETE_DEPENDENCY)
+            connection.executemany(self.UPSERT_DEPENDENCY, rows)
+
+    def close(self):
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+class WriteBehindKnowledgeStore(BaseKnowledgeStore):
+    """
+    This is a sub class of BaseKnowledgeStore which puts a write-behind
+    buffer in front of another store. Saved rows are only marked dirty per
+    (studentID, conceptID) -- so repeated updates of a row are written once --
+    and appended to a log. A background flusher writes the changed rows to
+    the underlying store in one batch every flush interval, or as soon as
+    the number of dirty rows reaches the flush size. After a crash, the rows
+    which were not flushed yet are recovered from the log.
+    """
+    FLUSH_INTERVAL = 5.0
+    FLUSH_SIZE = 1000
+
+    #Init
+    def __init__(self, store = None, logPath = None, flushInterval = None, flushSize = None, background = True, sync = False):
+        if (not isinstance(store, BaseKnowledgeStore)):
+            raise TypeError("Input is not an acceptable type of knowledge store!")
+
+        if (flushInterval == None):
+            flushInterval = self.FLUSH_INTERVAL
+        if (flushSize == None):
+            flushSize = self.FLUSH_SIZE
+
+        self._store = store
+        self._flushInterval = flushInterval
+        self._flushSize = flushSize
+
+        #Append-only log of the dirty rows (None --> no crash recovery)
+        self._logPath = logPath
+        self._log = None
+
+        #fsync the log on every save, not only flush it to the OS
+        self._sync = sync
+
+        #Dirty rows: [studentID][conceptID] = knowledge level
+        self._dirty = {}
+        self._dirtyCount = 0
+
+        #Rows being written by the current flush, still visible to the loads
+        self._flushing = {}
+
+        #Number of started flushes, to detect a flush which started during a load
+        self._flushCount = 0
+
+        #'_lock' guards the dirty rows and the log; '_flushLock' lets one flush run at a time
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+
+        if (self._logPath != None):
+            self._recover()
+            self._log = open(self._logPath, 'ab')
+
+        self._thread = None
+        if (background):
+            self._thread = threading.Thread(target = self._run, name = 'WriteBehindKnowledgeStore')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _getFlushingPath(self):
+        return self._logPath + '.flushing'
+
+    def _recover(self):
+        #Replay the logs of an interrupted run (the older one first), then flush them
+        for path in (self._getFlushingPath(), self._logPath):
+            if (not os.path.exists(path)):
+                continue
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        studentID, conceptID, level = json.loads(line)
+                    except ValueError:
+                        #The last line may have been cut off by the crash
+                        continue
+                    self._markDirty(studentID, conceptID, level)
+
+        if (self._dirtyCount > 0):
+            self._store.saveKnowledge(self._getRows(self._dirty))
+            self._store.flush()
+        self._dirty = {}
+        self._dirtyCount = 0
+
+        for path in (self._getFlushingPath(), self._logPath):
+            if (os.path.exists(path)):
+                os.remove(path)
+
+    def _markDirty(self, studentID, conceptID, level):
+        knowledge = self._dirty.get(studentID)
+        if (knowledge == None):
+            knowledge = self._dirty[studentID] = {}
+        if (conceptID not in knowledge):
+            self._dirtyCount += 1
+        knowledge[conceptID] = level
+
+    def _writeLog(self, rows):
+        if (self._log != None):
+            self._log.write(''.join(json.dumps(row) + '\n' for row in rows))
+            self._log.flush()
+            if (self._sync):
+                os.fsync(self._log.fileno())
+
+    @staticmethod
+    def _getRows(table):
+        return [(studentID, conceptID, level)
+                for studentID, knowledge in table.iteritems()
+                for conceptID, level in knowledge.iteritems()]
+
+    def getDirtyCount(self):
+        return self._dirtyCount
+
+    def saveKnowledge(self, rows = None):
+        if (rows == None):
+            raise ValueError("Input knowledge rows are not available!")
+
+        rows = list(rows)
+        with self._lock:
+            if (self._closed):
+                raise ValueError("The knowledge store is closed!")
+
+            self._writeLog(rows)
+            for studentID, conceptID, level in rows:
+                self._markDirty(studentID, conceptID, level)
+
+            if (self._dirtyCount >= self._flushSize):
+                self._wakeup.notify()
+
+        if (self._thread == None and self._dirtyCount >= self._flushSize):
+            self.flush()
+
+    def _getPending(self, studentID):
+        #Under the lock: a copy of the student's rows not written to the underlying store yet
+        rows = {}
+        for pending in (self._flushing, self._dirty):
+            rows.update(pending.get(studentID, {}))
+        return rows
+
+    def _getAllPending(self):
+        #Under the lock: a copy of all the rows not written to the underlying store yet
+        table = {}
+        for pending in (self._flushing, self._dirty):
+            for studentID, rows in pending.iteritems():
+                knowledge = table.get(studentID)
+                if (knowledge == None):
+                    knowledge = table[studentID] = {}
+                knowledge.update(rows)
+        return table
+
+    def _load(self, getPending, load):
+        #Copy the pending rows, then read the underlying store. If a flush started in
+        #between, the store may be newer than the copied rows; copy and read again.
+        #Return (pending rows, loaded rows); the pending rows take precedence.
+        while True:
+            with self._lock:
+                flushCount = self._flushCount
+                pending = getPending()
+            loaded = load()
+            with self._lock:
+                if (flushCount == self._flushCount):
+                    return pending, loaded
+
+    def loadKnowledge(self, studentID = None):
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        pending, knowledge = self._load(lambda: self._getPending(studentID),
+                                        lambda: self._store.loadKnowledge(studentID))
+        if (pending):
+            if (knowledge == None):
+                knowledge = {}
+            knowledge.update(pending)
+        return knowledge
+
+    def loadAllKnowledge(self):
+        pending, table = self._load(self._getAllPending, self._store.loadAllKnowledge)
+        for studentID, rows in pending.iteritems():
+            knowledge = table.get(studentID)
+            if (knowledge == None):
+                knowledge = table[studentID] = {}
+            knowledge.update(rows)
+        return table
+
+    def loadDependency(self):
+        #The graph is written rarely, so it goes to the underlying store directly
+        return self._store.loadDependency()
+
+    def saveDependency(self, rows = None):
+        self._store.saveDependency(rows)
+
+    def flush(self):
+        with self._flushLock:
+            with self._lock:
+                if (self._dirtyCount == 0):
+                    return
+                batch = self._flushing = self._dirty
+                self._dirty = {}
+                self._dirtyCount = 0
+                self._flushCount += 1
+
+                #Start a new log; the old one covers the batch until it is written
+                if (self._log != None):
+                    self._log.close()
+                    os.rename(self._logPath, self._getFlushingPath())
+                    self._log = open(self._logPath, 'ab')
+
+            try:
+                self._store.saveKnowledge(self._getRows(batch))
+                self._store.flush()
+            except Exception:
+                #Keep the rows dirty (unless updated since) and in the current log
+                with self._lock:
+                    rows = [(studentID, conceptID, level) for studentID, conceptID, level in self._getRows(batch)
+                            if conceptID not in self._dirty.get(studentID, {})]
+                    self._writeLog(rows)
+                    for studentID, conceptID, level in rows:
+                        self._markDirty(studentID, conceptID, level)
+                    self._flushing = {}
+                    if (self._log != None):
+                        os.remove(self._getFlushingPath())
+                raise
+
+            with self._lock:
+                self._flushing = {}
+                if (self._log != None):
+                    os.remove(self._getFlushingPath())
+
+    def _run(self):
+        #Background flusher
+        while True:
+            with self._lock:
+                if (not self._closed and self._dirtyCount < self._flushSize):
+                    self._wakeup.wait(self._flushInterval)
+                if (self._closed):
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing the knowledge store failed; the rows stay dirty.")
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if (self._thread != None):
+            self._thread.join()
+
+        self.flush()
+        if (self._log != None):
+            self._log.close()
+            self._log = None
+            os.remove(self._logPath)
+        self._store.close()
+
+
+class KnowledgeCache(object):
+    """
+    This is the class that holds the knowledge level tables of the recently
+    used students, in place of the whole table of all students. It works like
+    a dict of [studentID] = [conceptID] = knowledge level: a student's table
+    is loaded from the knowledge store on first access, and the least
+    recently used student is evicted when there are more students than the
+    capacity. The rows changed in memory are marked dirty and saved to the
+    store on 'flush' or before their student is evicted, or, with
+    write-through, saved to the store as soon as they are marked.
+    The cache's lock only guards its tables: the store is read and written
+    outside of it, so one student's load or save does not hold up the
+    others. A student being loaded (or evicted with dirty rows) is guarded on
+    his/her own, and the writes go to the store one at a time, in order.
+    """
+    CAPACITY = 10000
+
+    #Init
+    def __init__(self, store = None, capacity = None, writeThrough = False):
+        if (not isinstance(store, BaseKnowledgeStore)):
+            raise TypeError("Input is not an acceptable type of knowledge store!")
+
+        if (capacity == None):
+            capacity = self.CAPACITY
+        if (capacity <= 0):
+            raise ValueError("Cache capacity is invalid! (1, 2, ..., n)")
+
+        self._store = store
+        self._capacity = capacity
+        self._writeThrough = writeThrough
+
+        #Students' tables, the least recently used first: [studentID] = [conceptID] = knowledge level
+        self._entries = OrderedDict()
+
+        #Dirty rows: [studentID] = set of conceptIDs
+        self._dirty = {}
+
+        #Students being loaded, or saved on eviction: [studentID] = event set when done
+        self._busy = {}
+
+        #Asked before a student is evicted: handler(studentID) --> False to keep the student
+        self._evictHandler = None
+
+        #Converts a table loaded from the store (None --> loaded tables are used as they are)
+        self._factory = None
+
+        self._hitCount = 0
+        self._missCount = 0
+        self._evictionCount = 0
+
+        #Guards the tables above (never held during the store's I/O)
+        self._lock = threading.RLock()
+
+        #Writes to the store one at a time, so an older row never overwrites a newer one
+        self._writeLock = threading.Lock()
+
+    def setEvictHandler(self, handler = None):
+        self._evictHandler = handler
+
+    def setFactory(self, factory = None):
+        self._factory = factory
+
+    def getStore(self):
+        return self._store
+
+    def getCapacity(self):
+        return self._capacity
+
+    def isWriteThrough(self):
+        return self._writeThrough
+
+    def getHitCount(self):
+        return self._hitCount
+
+    def getMissCount(self):
+        return self._missCount
+
+    def getEvictionCount(self):
+        return self._evictionCount
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, studentID):
+        return studentID in self._entries
+
+    def get(self, studentID, default = None):
+        while True:
+            with self._lock:
+                knowledge = self._entries.pop(studentID, None)
+                if (knowledge != None):
+                    self._hitCount += 1
+                    self._entries[studentID] = knowledge
+                    return knowledge
+
+                busy = self._busy.get(studentID)
+                if (busy == None):
+                    self._missCount += 1
+                    busy = self._busy[studentID] = threading.Event()
+                    break
+            #Loaded or saved by another thread: look again when it is done
+            busy.wait()
+
+        victims = None
+        try:
+            knowledge = self._store.loadKnowledge(studentID)
+            if (knowledge != None and self._factory != None):
+                knowledge = self._factory(knowledge)
+        finally:
+            with self._lock:
+                del self._busy[studentID]
+                if (knowledge != None):
+                    #Set meanwhile (see '__setitem__') --> that table wins
+                    knowledge = self._entries.setdefault(studentID, knowledge)
+                    victims = self._takeVictims()
+            busy.set()
+
+        self._saveVictims(victims)
+        if (knowledge == None):
+            return default
+        return knowledge
+
+    def __getitem__(self, studentID):
+        knowledge = self.get(studentID)
+        if (knowledge == None):
+            raise KeyError(studentID)
+        return knowledge
+
+    def __setitem__(self, studentID, knowledge):
+        with self._lock:
+            self._entries.pop(studentID, None)
+            self._entries[studentID] = knowledge
+            victims = self._takeVictims()
+        self._saveVictims(victims)
+
+    def touch(self, studentID):
+        #Mark the student as used, when his/her table is held elsewhere (a hit)
+        with self._lock:
+            knowledge = self._entries.pop(studentID, None)
+            if (knowledge != None):
+                self._hitCount += 1
+                self._entries[studentID] = knowledge
+
+    def markDirty(self, studentID, conceptIDs):
+        if (self._writeThrough):
+            with self._writeLock:
+                with self._lock:
+                    if (studentID not in self._entries):
+                        raise ValueError("The student is not in the cache!")
+
+                    knowledge = self._entries[studentID]
+                    rows = [(studentID, conceptID, knowledge.get(conceptID)) for conceptID in set(conceptIDs)]
+                self._store.saveKnowledge(rows)
+            return
+
+        with self._lock:
+            if (studentID not in self._entries):
+                raise ValueError("The student is not in the cache!")
+
+            dirty = self._dirty.get(studentID)
+            if (dirty == None):
+                dirty = self._dirty[studentID] = set()
+            dirty.update(conceptIDs)
+
+    def getDirtyCount(self):
+        return self._dirtyCount
+
+    def saveKnowledge(self, rows = None):
+        if (rows == None):
+            raise ValueError("Input knowledge rows are not available!")
+
+        rows = list(rows)
+        with self._lock:
+            if (self._closed):
+                raise ValueError("The knowledge store is closed!")
+
+            self._writeLog(rows)
+            for studentID, conceptID, level in rows:
+                self._markDirty(studentID, conceptID, level)
+
+            if (self._dirtyCount >= self._flushSize):
+                self._wakeup.notify()
+
+        if (self._thread == None and self._dirtyCount >= self._flushSize):
+            self.flush()
+
+    def _overlay(self, studentID, knowledge):
+        #Rows not written to the underlying store yet take precedence
+        for pending in (self._flushing, self._dirty):
+            rows = pending.get(studentID)
+            if (rows):
+                if (knowledge == None):
+                    knowledge = {}
+                knowledge.update(rows)
+        return knowledge
+
+    def _load(self, load):
+        #Read the underlying store, then add the pending rows. If a flush finished
+        #in between, the store may be newer than the rows kept in memory; read again.
+        while True:
+            with self._lock:
+                flushCount = self._flushCount
+            loaded = load()
+            with self._lock:
+                if (flushCount == self._flushCount):
+                    return loaded
+
+    def loadKnowledge(self, studentID = None):
+        if (studentID == None):
+            raise ValueError("Input student Id is not available!")
+
+        return self._load(lambda: self._overlay(studentID, self._store.loadKnowledge(studentID)))
+
+    def _overlayAll(self, table):
+        for pending in (self._flushing, self._dirty):
+            for studentID in pending:
+                table[studentID] = self._overlay(studentID, table.get(studentID))
+        return table
+
+    def loadAllKnowledge(self):
+        return self._load(lambda: self._overlayAll(self._store.loadAllKnowledge()))
+
+    def loadDependency(self):
+        #The graph is written rarely, so it goes to the underlying store directly
+        return self._store.loadDependency()
+
+    def saveDependency(self, rows = None):
+        self._store.saveDependency(rows)
+
+    def flush(self):
+        with self._flushLock:
+            with self._lock:
+                if (self._dirtyCount == 0):
+                    return
+                batch = self._flushing = self._dirty
+                self._dirty = {}
+                self._dirtyCount = 0
+
+                #Start a new log; the old one covers the batch until it is written
+                if (self._log != None):
+                    self._log.close()
+                    os.rename(self._logPath, self._getFlushingPath())
+                    self._log = open(self._logPath, 'ab')
+
+            try:
+                self._store.saveKnowledge(self._getRows(batch))
+                self._store.flush()
+            except Exception:
+                #Keep the rows dirty (unless updated since) and in the current log
+                with self._lock:
+                    rows = [(studentID, conceptID, level) for studentID, conceptID, level in self._getRows(batch)
+                            if conceptID not in self._dirty.get(studentID, {})]
+                    self._writeLog(rows)
+                    for studentID, conceptID, level in rows:
+                        self._markDirty(studentID, conceptID, level)
+                    self._flushing = {}
+                    if (self._log != None):
+                        os.remove(self._getFlushingPath())
+                raise
+
+            with self._lock:
+                self._flushing = {}
+                self._flushCount += 1
+                if (self._log != None):
+                    os.remove(self._getFlushingPath())
+
+    def _run(self):
+        #Background flusher
+        while True:
+            with self._lock:
+                if (not self._closed and self._dirtyCount < self._flushSize):
+                    self._wakeup.wait(self._flushInterval)
+                if (self._closed):
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing the knowledge store failed; the rows stay dirty.")
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if (self._thread != None):
+            self._thread.join()
+
+        self.flush()
+        if (self._log != None):
+            self._log.close()
+            self._log = None
+            os.remove(self._logPath)
+        self._store.close()
+
+
+class KnowledgeCache(object):
+    """
+    This is the class that holds the knowledge level tables of the recently
+    used students, in place of the whole table of all students. It works like
+    a dict of [studentID] = [conceptID] = knowledge level: a student's table
+    is loaded from the knowledge store on first access, and the least
+    recently used student is evicted when there are more students than the
+    capacity. The rows changed in memory are marked dirty and saved to the
+    store on 'flush' or before their student is evicted, or, with
+    write-through, saved to the store as soon as they are marked.
+    The cache's lock only guards its tables: the store is read and written
+    outside of it, so one student's load or save does not hold up the
+    others. A student being loaded (or evicted with dirty rows) is guarded on
+    his/her own, and the writes go to the store one at a time, in order.
+    """
+    CAPACITY = 10000
+
+    #Init
+    def __init__(self, store = None, capacity = None, writeThrough = False):
+        if (not isinstance(store, BaseKnowledgeStore)):
+            raise TypeError("Input is not an acceptable type of knowledge store!")
+
+        if (capacity == None):
+            capacity = self.CAPACITY
+        if (capacity <= 0):
+            raise ValueError("Cache capacity is invalid! (1, 2, ..., n)")
+
+        self._store = store
+        self._capacity = capacity
+        self._writeThrough = writeThrough
+
+        #Students' tables, the least recently used first: [studentID] = [conceptID] = knowledge level
+        self._entries = OrderedDict()
+
+        #Dirty rows: [studentID] = set of conceptIDs
+        self._dirty = {}
+
+        #Students being loaded, or saved on eviction: [studentID] = event set when done
+        self._busy = {}
+
+        #Asked before a student is evicted: handler(studentID) --> False to keep the student
+        self._evictHandler = None
+
+        #Converts a table loaded from the store (None --> loaded tables are used as they are)
+        self._factory = None
+
+        self._hitCount = 0
+        self._missCount = 0
+        self._evictionCount = 0
+
+        #Guards the tables above (never held during the store's I/O)
+        self._lock = threading.RLock()
+
+        #Writes to the store one at a time, so an older row never overwrites a newer one
+        self._writeLock = threading.Lock()
+
+    def setEvictHandler(self, handler = None):
+        self._evictHandler = handler
+
+    def setFactory(self, factory = None):
+        self._factory = factory
+
+    def getStore(self):
+        return self._store
+
+    def getCapacity(self):
+        return self._capacity
+
+    def isWriteThrough(self):
+        return self._writeThrough
+
+    def getHitCount(self):
+        return self._hitCount
+
+    def getMissCount(self):
+        return self._missCount
+
+    def getEvictionCount(self):
+        return self._evictionCount
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, studentID):
+        return studentID in self._entries
+
+    def get(self, studentID, default = None):
+        while True:
+            with self._lock:
+                knowledge = self._entries.pop(studentID, None)
+                if (knowledge != None):
+                    self._hitCount += 1
+                    self._entries[studentID] = knowledge
+                    return knowledge
+
+                busy = self._busy.get(studentID)
+                if (busy == None):
+                    self._missCount += 1
+                    busy = self._busy[studentID] = threading.Event()
+                    break
+            #Loaded or saved by another thread: look again when it is done
+            busy.wait()
+
+        victims = None
+        try:
+            knowledge = self._store.loadKnowledge(studentID)
+            if (knowledge != None and self._factory != None):
+                knowledge = self._factory(knowledge)
+        finally:
+            with self._lock:
+                del self._busy[studentID]
+                if (knowledge != None):
+                    #Set meanwhile (see '__setitem__') --> that table wins
+                    knowledge = self._entries.setdefault(studentID, knowledge)
+                    victims = self._takeVictims()
+            busy.set()
+
+        self._saveVictims(victims)
+        if (knowledge == None):
+            return default
+        return knowledge
+
+    def __getitem__(self, studentID):
+        knowledge = self.get(studentID)
+        if (knowledge == None):
+            raise KeyError(studentID)
+        return knowledge
+
+    def __setitem__(self, studentID, knowledge):
+        with self._lock:
+            self._entries.pop(studentID, None)
+            self._entries[studentID] = knowledge
+            victims = self._takeVictims()
+        self._saveVictims(victims)
+
+    def touch(self, studentID):
+        #Mark the student as used, when his/her table is held elsewhere (a hit)
+        with self._lock:
+            knowledge = self._entries.pop(studentID, None)
+            if (knowledge != None):
+                self._hitCount += 1
+                self._entries[studentID] = knowledge
+
+    def markDirty(self, studentID, conceptIDs):
+        with self._lock:
+            if (studentID not in self._entries):
+                raise ValueError("The student is not in the cache!")
+
+            if (self._writeThrough):
+                knowledge = self._entries[studentID]
+                self._store.saveKnowledge([(studentID, conceptID, knowledge.get(conceptID)) for conceptID in set(conceptIDs)])
+                return
+
+            dirty = self._dirty.get(studentID)
+            if (dirty == None):
+                dirty = self._dirty[studentID] = set()
+            dirty.update(conceptIDs)
+
+    def getDirtyCount(self):
+        return sum(len(dirty) for dirty in self._dirty.itervalues())
+
+    def _getDirtyRows(self, studentID, conceptIDs):
+        knowledge = self._entries[studentID]
+        return [(studentID, conceptID, knowledge.get(conceptID)) for conceptID in conceptIDs]
+
+    def _takeVictims(self):
+        #Under the lock: remove the least recently used students which may be released,
+        #but never the latest one. Return (their dirty rows, their events) to save, or None.
+        if (len(self._entries) <= self._capacity):
+            return None
+
+        victims = []
+        excess = len(self._entries) - self._capacity
+        for studentID in islice(self._entries, len(self._entries) - 1):
+            if (self._evictHandler == None or self._evictHandler(studentID) != False):
+                victims.append(studentID)
+                if (len(victims) == excess):
+                    break
+
+        rows = []
+        events = {}
+        for studentID in victims:
+            if (studentID in self._dirty):
+                rows.extend(self._getDirtyRows(studentID, self._dirty.pop(studentID)))
+                #Not loaded again before his/her rows are saved
+                events[studentID] = self._busy[studentID] = threading.Event()
+            del self._entries[studentID]
+        self._evictionCount += len(victims)
+        return rows, events
+
+    def _saveVictims(self, victims):
+        #Out of the lock: save the dirty rows of the evicted students
+        if (victims == None):
+            return
+
+        rows, events = victims
+        try:
+            if (rows):
+                with self._writeLock:
+                    self._store.saveKnowledge(rows)
+        finally:
+            with self._lock:
+                for studentID in events:
+                    del self._busy[studentID]
+            for event in events.itervalues():
+                event.set()
+
+    def flush(self):
+        #Save all dirty rows to the store
+        with self._writeLock:
+            with self._lock:
+                rows = []
+                for studentID, conceptIDs in self._dirty.iteritems():
+                    rows.extend(self._getDirtyRows(studentID, conceptIDs))
+                self._dirty = {}
+            if (rows):
+                self._store.saveKnowledge(rows)
+
+    def clear(self):
+        #Drop all students, after saving their dirty rows
+        self.flush()
+        with self._lock:
+            self._entries.clear()
+
+
+#Test cases
+if __name__ == '__main__':
+    print "--Start Test--"
+
+    store = WriteBehindKnowledgeStore(DummyKnowledgeStore(), flushInterval = 0.1)
+
+    store.saveKnowledge([('00126', 'Math-4', 0.7), ('00126', 'Math-4', 0.75), ('00127', 'Math-1', 0.3)])
+
+    print "Dirty rows before to flush:"
+    print store.getDirtyCount()
+    print store.loadKnowledge('00126')
+
+    store.flush()
+
+    print "Dirty rows after to flush:"
+    print store.getDirtyCount()
+    print store.loadKnowledge('00127')
+
+    store.saveDependency([('Math-1', 'Math-2', 0.5), ('Math-2', 'Math-3', 0.4)])
+    store.saveDependency([('Math-1', 'Math-2', 0.5)])
+
+    print "Dependency after to remove Math-2 --> Math-3:"
+    print store.loadDependency()
+
+    store.close()
+
+    print "--End of test--"
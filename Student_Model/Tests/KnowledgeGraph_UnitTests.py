@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest.case
+from Student_Model.KnowledgeGraph import KnowledgeGraph
+from Student_Model.KnowledgeModel import PointKnowledgeModel
+
+def makeEdges(seed, conceptCount, edgeCount, acyclic = True):
+    """ Random (source, target, weight) dependencies, some of them with a zero weight """
+    r = random.Random(seed)
+    concepts = ['C%d' % i for i in xrange(conceptCount)]
+    r.shuffle(concepts)
+    edges = {}
+    while (len(edges) < edgeCount):
+        i, j = r.sample(xrange(conceptCount), 2)
+        if (acyclic and i > j):
+            i, j = j, i
+        edges[(concepts[i], concepts[j])] = r.choice([0, 0.2, 0.5, 0.9])
+    return [(sourceID, targetID, weight) for (sourceID, targetID), weight in sorted(edges.iteritems())]
+
+def makeGraph(edges):
+    KG = KnowledgeGraph()
+    for sourceID, targetID, weight in edges:
+        KG.addDependency(sourceID, targetID, weight)
+    return KG
+
+def getSources(dependency, targetID):
+    """ Sources of a target, found by scanning every source """
+    return dict((sourceID, targets[targetID]) for sourceID, targets in dependency.iteritems()
+                if targetID in targets)
+
+def getParents(dependency, conceptID):
+    """ Transitive parents through the dependencies with a weight, found by a plain search """
+    parents = set()
+    childSet = [conceptID]
+    while (childSet):
+        currentChild = childSet.pop()
+        for sourceID, weight in getSources(dependency, currentChild).iteritems():
+            if (weight and sourceID not in parents):
+                parents.add(sourceID)
+                childSet.append(sourceID)
+    parents.discard(conceptID)
+    return parents
+
+def getConcepts(dependency):
+    concepts = set(dependency)
+    for targets in dependency.itervalues():
+        concepts.update(targets)
+    return concepts
+
+def isReachable(dependency, startID, endID):
+    """ Whether endID can be reached from startID, whatever the weights """
+    visited = set([startID])
+    childSet = [startID]
+    while (childSet):
+        currentChild = childSet.pop()
+        if (currentChild == endID):
+            return True
+        for key in dependency.get(currentChild, {}):
+            if (key not in visited):
+                visited.add(key)
+                childSet.append(key)
+    return False
+
+def isValidOrder(KG):
+    """ Whether the topological order has every concept once, each one after its sources """
+    dependency = KG.getAllDependencies()
+    order = KG.getTopologicalOrder()
+    if (sorted(order) != sorted(getConcepts(dependency))):
+        return False
+    position = dict((conceptID, i) for i, conceptID in enumerate(order))
+    return all(position[sourceID] < position[targetID]
+               for sourceID, targets in dependency.iteritems() for targetID in targets)
+
+def getAnswers(KG, concepts):
+    """ Everything the accessors say about the graph, but its (not unique) order """
+    answers = {'all': KG.getAllDependencies()}
+    for conceptID in concepts:
+        answers[('parents', conceptID)] = sorted(KG.getParents(conceptID))
+        answers[('source', conceptID)] = KG.getDependencyBySource(conceptID)
+        answers[('target', conceptID)] = KG.getDependencyByTarget(conceptID)
+        for otherID in concepts:
+            answers[(conceptID, otherID)] = (KG.getDependency(conceptID, otherID),
+                                             KG.isParent(conceptID, otherID),
+                                             KG.acyclicCK(conceptID, otherID))
+    return answers
+
+
+class ReverseIndexTest(unittest.case.TestCase):
+    """ Unit test for the reverse dependency index of KnowledgeGraph """
+
+    def assertIndexMatches(self, KG):
+        dependency = KG.getAllDependencies()
+        for targetID in getConcepts(dependency):
+            expected = dict((sourceID, {targetID: weight})
+                            for sourceID, weight in getSources(dependency, targetID).iteritems() if weight)
+            self.assertEqual(KG.getDependencyByTarget(targetID), expected)
+
+    def testAddDependency(self):
+        """ Test that the sources of every target match a scan of the dependencies """
+        self.assertIndexMatches(makeGraph(makeEdges(1, 30, 80)))
+
+    def testSetDependency(self):
+        """ Test that the index is rebuilt for a new dependency table """
+        KG = makeGraph(makeEdges(2, 10, 20))
+        KG.setDependency(makeGraph(makeEdges(3, 30, 80)).getAllDependencies())
+        self.assertIndexMatches(KG)
+        self.assertEqual(KG.getDependencyByTarget('Unknown'), {})
+
+    def testUpdateAndDelete(self):
+        """ Test that the index follows updated and deleted dependencies """
+        edges = makeEdges(4, 30, 80)
+        KG = makeGraph(edges)
+        r = random.Random(4)
+        for sourceID, targetID, weight in r.sample(edges, 30):
+            KG.updateDependency(sourceID, targetID, r.choice([0, 0.7]))
+        for sourceID, targetID, weight in r.sample(edges, 30):
+            KG.delDependency(sourceID, targetID)
+        self.assertIndexMatches(KG)
+
+
+class AncestorCacheTest(unittest.case.TestCase):
+    """ Unit test for the cached transitive parents of KnowledgeGraph """
+
+    def assertParentsMatch(self, KG):
+        dependency = KG.getAllDependencies()
+        concepts = getConcepts(dependency)
+        for conceptID in concepts:
+            parents = getParents(dependency, conceptID)
+            self.assertEqual(sorted(KG.getParents(conceptID)), sorted(parents))
+            for parentID in concepts:
+                self.assertEqual(KG.isParent(parentID, conceptID), parentID in parents)
+
+    def testParents(self):
+        """ Test that the parents match a plain search, zero weights excluded """
+        KG = makeGraph(makeEdges(5, 40, 100))
+        KG.updateConcept()
+        self.assertParentsMatch(KG)
+
+    def testInvalidatedPerEdge(self):
+        """ Test that the cached parents follow every added, updated and deleted dependency """
+        edges = makeEdges(6, 25, 70)
+        KG = makeGraph(edges[:40])
+        r = random.Random(6)
+        for sourceID, targetID, weight in edges[40:]:
+            self.assertParentsMatch(KG)
+            KG.addDependency(sourceID, targetID, weight)
+            sourceID, targetID, weight = r.choice(edges[:40])
+            KG.updateDependency(sourceID, targetID, r.choice([0, 0.4]))
+        for sourceID, targetID, weight in r.sample(edges, 20):
+            KG.delDependency(sourceID, targetID)
+            self.assertParentsMatch(KG)
+
+    def testCycle(self):
+        """ Test that a concept on a cycle is not its own parent """
+        KG = makeGraph([('A', 'B', 1), ('B', 'C', 1), ('C', 'A', 1)])
+        self.assertEqual(sorted(KG.getParents('A')), ['B', 'C'])
+        self.assertFalse(KG.isParent('A', 'A'))
+
+
+class TopologicalOrderTest(unittest.case.TestCase):
+    """ Unit test for the incremental cycle check and topological order of KnowledgeGraph """
+
+    def testOrderAfterEveryDependency(self):
+        """ Test that exactly the cyclic dependencies are rejected, and the order stays valid """
+        KG = KnowledgeGraph()
+        for sourceID, targetID, weight in makeEdges(7, 30, 150, False):
+            #Every dependency counts for a cycle, whatever its weight
+            closesCycle = isReachable(KG.getAllDependencies(), targetID, sourceID)
+            self.assertEqual(KG.acyclicCK(sourceID, targetID), not closesCycle)
+            if (closesCycle):
+                self.assertRaises(ValueError, KG.addDependency, sourceID, targetID, weight, True)
+            else:
+                KG.addDependency(sourceID, targetID, weight, True)
+            self.assertTrue(isValidOrder(KG))
+
+    def testRejectedSelfLoop(self):
+        """ Test that a rejected dependency on a new concept leaves no concept behind """
+        KG = makeGraph([('A', 'B', 1)])
+        self.assertRaises(ValueError, KG.addDependency, 'X', 'X', 1, True)
+        self.assertEqual(sorted(KG.getTopologicalOrder()), ['A', 'B'])
+        self.assertFalse(KG.isParent('X', 'B'))
+
+    def testCycleWithoutCheck(self):
+        """ Test that a cycle added without the check has no order until it is removed """
+        KG = makeGraph(makeEdges(8, 20, 40))
+        sourceID, targetID, weight = makeEdges(8, 20, 40)[0]
+        KG.addDependency(targetID, sourceID, 1)
+        self.assertEqual(KG.getTopologicalOrder(), None)
+        KG.delDependency(targetID, sourceID)
+        self.assertTrue(isValidOrder(KG))
+
+
+class BulkLoadTest(unittest.case.TestCase):
+    """ Unit test for KnowledgeGraph.bulkLoad """
+
+    def testMatchesAddDependency(self):
+        """ Test that loading a batch gives the graph of adding its dependencies one by one """
+        edges = makeEdges(9, 40, 120)
+        KG = makeGraph(edges[:30])
+        KG.bulkLoad(edges[30:])
+        expected = makeGraph(edges)
+        self.assertEqual(KG.getAllDependencies(), expected.getAllDependencies())
+        for conceptID in getConcepts(expected.getAllDependencies()):
+            self.assertEqual(sorted(KG.getParents(conceptID)), sorted(expected.getParents(conceptID)))
+            self.assertEqual(KG.getDependencyByTarget(conceptID), expected.getDependencyByTarget(conceptID))
+        self.assertTrue(isValidOrder(KG))
+
+    def testInvalidBatchLeavesGraph(self):
+        """ Test that a cyclic batch or a repeated dependency leaves the graph unchanged """
+        edges = makeEdges(10, 20, 40)
+        KG = makeGraph(edges)
+        dependency = dict((key, dict(targets)) for key, targets in KG.getAllDependencies().iteritems())
+        order = KG.getTopologicalOrder()
+        self.assertRaises(ValueError, KG.bulkLoad, [('N1', 'N2', 1), (edges[0][1], edges[0][0], 1)])
+        self.assertRaises(ValueError, KG.bulkLoad, [('N1', 'N2', 1), edges[0]])
+        self.assertRaises(ValueError, KG.bulkLoad, [('N1', 'N2', 1), ('N1', 'N2', 0.5)])
+        self.assertEqual(KG.getAllDependencies(), dependency)
+        self.assertEqual(KG.getTopologicalOrder(), order)
+
+    def testObserversInformedOnce(self):
+        """ Test that the observers are informed once for the whole batch """
+        calls = []
+        class CountingModel(PointKnowledgeModel):
+            def initGraph(self, KG = None):
+                calls.append(KG)
+        KG = KnowledgeGraph()
+        KG.addObserver(CountingModel())
+        KG.bulkLoad(makeEdges(11, 20, 40))
+        self.assertEqual(calls, [KG])
+
+
+class FrozenGraphTest(unittest.case.TestCase):
+    """ Unit test for the frozen, array-backed KnowledgeGraph """
+
+    def makeGraph(self):
+        KG = makeGraph(makeEdges(12, 25, 60))
+        self.concepts = sorted(getConcepts(KG.getAllDependencies())) + ['Unknown']
+        return KG
+
+    def testFrozenMatchesDicts(self):
+        """ Test that a frozen graph answers as the dict based one """
+        KG = self.makeGraph()
+        expected = getAnswers(KG, self.concepts)
+        KG.freeze()
+        self.assertTrue(KG.isFrozen())
+        self.assertEqual(getAnswers(KG, self.concepts), expected)
+        self.assertTrue(isValidOrder(KG))
+
+    def testFrozenRejectsModifiers(self):
+        """ Test that a frozen graph cannot be modified until it is thawed """
+        KG = self.makeGraph()
+        sourceID, targets = sorted(KG.getAllDependencies().iteritems())[0]
+        targetID = sorted(targets)[0]
+        KG.freeze()
+        self.assertRaises(ValueError, KG.addDependency, 'N1', 'N2', 1)
+        self.assertRaises(ValueError, KG.updateDependency, sourceID, targetID, 1)
+        self.assertRaises(ValueError, KG.delDependency, sourceID, targetID)
+        self.assertRaises(ValueError, KG.bulkLoad, [('N1', 'N2', 1)])
+
+    def testThaw(self):
+        """ Test that a thawed graph is the same graph, and can be modified again """
+        KG = self.makeGraph()
+        expected = getAnswers(KG, self.concepts)
+        KG.freeze()
+        KG.thaw()
+        self.assertFalse(KG.isFrozen())
+        self.assertEqual(getAnswers(KG, self.concepts), expected)
+        KG.addDependency('N1', 'N2', 1, True)
+        self.assertEqual(KG.getParents('N2'), ['N1'])
+
+
+class SnapshotTest(unittest.case.TestCase):
+    """ Unit test for the memory-mapped snapshots of KnowledgeGraph """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'graph.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def testOpenedMatchesSaved(self):
+        """ Test that an opened snapshot answers as the graph it was saved from """
+        KG = makeGraph(makeEdges(13, 25, 60) + [(u'Math-\xe9', 'C0', 0.5), (7, u'Math-\xe9', 0.25)])
+        concepts = list(getConcepts(KG.getAllDependencies())) + ['Unknown']
+        expected = getAnswers(KG, concepts)
+        KG.saveSnapshot(self.path)
+
+        opened = KnowledgeGraph()
+        opened.openSnapshot(self.path)
+        self.assertTrue(opened.isFrozen())
+        self.assertEqual(getAnswers(opened, concepts), expected)
+        self.assertTrue(isValidOrder(opened))
+
+        opened.thaw()
+        self.assertEqual(opened.getAllDependencies(), KG.getAllDependencies())
+
+    def testCyclicGraph(self):
+        """ Test that a cyclic graph is saved and opened without an order """
+        KG = makeGraph([('A', 'B', 1), ('B', 'C', 1), ('C', 'A', 1), ('C', 'D', 0.5)])
+        KG.saveSnapshot(self.path)
+        opened = KnowledgeGraph()
+        opened.openSnapshot(self.path)
+        self.assertEqual(opened.getTopologicalOrder(), None)
+        self.assertEqual(sorted(opened.getParents('D')), ['A', 'B', 'C'])
+        self.assertFalse(opened.acyclicCK('D', 'E'))
+
+    def testNotASnapshot(self):
+        """ Test that opening another kind of file is rejected """
+        with open(self.path, 'wb') as f:
+            f.write('\0'*256)
+        self.assertRaises(ValueError, KnowledgeGraph().openSnapshot, self.path)
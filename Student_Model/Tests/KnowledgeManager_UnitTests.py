@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import copy
+import random
+import threading
+import unittest.case
+from Student_Model.DummyDB import DummyDB
+from Student_Model.KnowledgeManager import (KnowledgeManager, MultiStudentKnowledgeManager,
+                                            ConcurrentKnowledgeManager)
+from Student_Model.KnowledgeStore import DummyKnowledgeStore
+
+class SavePerformanceBatchTest(unittest.case.TestCase):
+    """ Unit test for savePerformanceBatch, which must match savePerformance """
+    EVENTS = [('00125', 'Math-1', 0, 0, True, 0.9),
+              ('00126', 'Math-2', 2, 1, False, 0.4),
+              ('00125', 'Math-1', 1, 0, True, 0.7),
+              ('00125', 'Math-3', 0, 2, False, 0.5),
+              ('00125', 'Math-1', 3, 1, False, 0.2),
+              ('00126', 'Math-2', 0, 0, True, 0.8)]
+
+    def makeManager(self, cls):
+        """ Create a manager on its own copy of the temporary DB """
+        km = cls()
+        km.loadKnowledgeDB()
+        km._knowledgeLevel = copy.deepcopy(km._knowledgeLevel)
+        return km
+
+    def getSequentialLevels(self):
+        km = self.makeManager(KnowledgeManager)
+        for event in self.EVENTS:
+            km.initKnowledgeLevel(event[0])
+            km.savePerformance(*event)
+        return km._knowledgeLevel
+
+    def testBatchMatchesSequential(self):
+        """ Test that a batch with repeated concepts gives the sequential levels """
+        km = self.makeManager(KnowledgeManager)
+        km.savePerformanceBatch(self.EVENTS)
+        self.assertEqual(km._knowledgeLevel, self.getSequentialLevels())
+
+    def testMultiStudentBatchMatchesSequential(self):
+        """ Test that the multi-student manager's batch gives the sequential levels """
+        km = self.makeManager(MultiStudentKnowledgeManager)
+        km.savePerformanceBatch(self.EVENTS)
+        self.assertEqual(km._knowledgeLevel, self.getSequentialLevels())
+
+
+class ConcurrentKnowledgeManagerTest(unittest.case.TestCase):
+    """ Unit test for ConcurrentKnowledgeManager, used from many threads at once """
+    THREAD_COUNT = 4
+
+    def setUp(self):
+        """ Create events of many students, in a fixed order per student """
+        r = random.Random(12)
+        self.events = [('s%d' % r.randint(0, 40), 'Math-%d' % r.randint(1, 4), r.randint(0, 3),
+                        r.randint(0, 3), r.random() < 0.3, r.random()) for i in xrange(3000)]
+
+    def getSequentialLevels(self):
+        km = MultiStudentKnowledgeManager()
+        km.loadGraphDB()
+        km.initKnowledgeGraph()
+        km._knowledgeLevel = {}
+        for event in self.events:
+            km.savePerformance(*event)
+        return km._knowledgeLevel
+
+    def runThreads(self, km):
+        """ Every thread saves the events of its own students, in order """
+        def work(index):
+            for event in self.events:
+                if (int(event[0][1:]) % self.THREAD_COUNT == index):
+                    km.savePerformance(*event)
+                    km.getKnowledgeLevel(event[0], event[1])
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in xrange(self.THREAD_COUNT)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def testThreadsMatchSequential(self):
+        """ Test that the threads give the levels of a sequential run """
+        km = ConcurrentKnowledgeManager(shardCount=8)
+        km.loadGraphDB()
+        km.initKnowledgeGraph()
+        km._knowledgeLevel = {}
+        self.runThreads(km)
+        self.assertEqual(km._knowledgeLevel, self.getSequentialLevels())
+
+    def testThreadsWithStoreMatchSequential(self):
+        """ Test that the threads give the levels of a sequential run, with students evicted """
+        db = DummyDB()
+        db._knowledge = {}
+        km = ConcurrentKnowledgeManager(shardCount=8)
+        km.setKnowledgeStore(DummyKnowledgeStore(db), capacity=6)
+        km.loadGraphDB()
+        km.initKnowledgeGraph()
+        self.runThreads(km)
+        km.saveKnowledgeDB()
+        self.assertTrue(km.getKnowledgeCache().getEvictionCount() > 0)
+        self.assertEqual(db._knowledge, self.getSequentialLevels())
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest.case
+from Student_Model.KnowledgeLevel import DecayKnowledgeLevel
+from Student_Model.KnowledgeModel import BayesianKnowledgeModel
+
+class BayesianKnowledgeModelTest(unittest.case.TestCase):
+    """ Unit test for BayesianKnowledgeModel """
+    OBSERVATIONS = [('00125', 'Math-1', True),
+                    ('00126', 'Math-2', False),
+                    ('00125', 'Math-1', False),
+                    ('00125', 'Math-3', True),
+                    ('00126', 'Math-2', True),
+                    ('00125', 'Math-1', True)]
+
+    #Parameters of the synthetic answers: (prior, learn, guess, slip)
+    PARAMETERS = {'Math-1': (0.4, 0.2, 0.25, 0.1),
+                  'Math-2': (0.2, 0.1, 0.15, 0.05)}
+
+    def makeAnswers(self, students, length, seed):
+        """ Draw answer sequences of many students from the BKT process """
+        r = random.Random(seed)
+        rows = []
+        for s in xrange(students):
+            for conceptID, (prior, learn, guess, slip) in sorted(self.PARAMETERS.iteritems()):
+                known = r.random() < prior
+                for t in xrange(length):
+                    rows.append(('s%d' % s, conceptID, r.random() < ((1 - slip) if known else guess)))
+                    if (not known):
+                        known = r.random() < learn
+        return rows
+
+    def testObserveManyMatchesObserve(self):
+        """ Test that a batch of observations gives the levels of observing one by one """
+        model = BayesianKnowledgeModel()
+        model.setParameters('Math-2', 0.5, 0.3, 0.1, 0.2)
+        knowledge = model.observeMany(self.OBSERVATIONS, {'00126': {'Math-2': 0.6}})
+
+        expected = {'00125': {}, '00126': {'Math-2': 0.6}}
+        for studentID, conceptID, correct in self.OBSERVATIONS:
+            model.setKnowledge(expected[studentID])
+            model.observe(conceptID, correct)
+
+        self.assertEqual(sorted(knowledge), sorted(expected))
+        for studentID in expected:
+            for conceptID, level in expected[studentID].iteritems():
+                self.assertAlmostEqual(knowledge[studentID][conceptID], level)
+
+    def testUpdateStartsFromPosterior(self):
+        """ Test that updates from KL proceed from the last posterior, not from KL's estimation """
+        model = BayesianKnowledgeModel()
+        KL = DecayKnowledgeLevel()
+        KL.setALEKS(0.5)
+        KL.setALEKSLambda(0.8)
+        knowledge = {}
+        KL.setKnowledge(knowledge)
+        model.setKnowledge(knowledge)
+        KL.addObserver(model)
+
+        posterior = model.getParameters('Math-1')[0]
+        past = None
+        for obsEst in (0.9, 0.2, 0.7):
+            KL.updateKnowledge('Math-1', obsEst)
+
+            #KL decays its estimation from the level in the table, the last posterior
+            if (past != None):
+                obsEst = KL.linearEstimation(past, obsEst)
+            level = KL.blendALEKS(obsEst, 0.5, 0.8)
+            posterior = level * model._posterior(0, posterior, True) + (1 - level) * model._posterior(0, posterior, False)
+            self.assertAlmostEqual(knowledge['Math-1'], posterior)
+            past = posterior
+
+    def testFitRecoversParameters(self):
+        """ Test that EM recovers the parameters the answers were drawn with """
+        model = BayesianKnowledgeModel()
+        rows = self.makeAnswers(1500, 10, 7)
+        model.fit([rows[:len(rows) // 2], rows[len(rows) // 2:]], iterations = 200, tolerance = 1e-6)
+        for conceptID, parameters in self.PARAMETERS.iteritems():
+            for fitted, expected in zip(model.getParameters(conceptID), parameters):
+                self.assertAlmostEqual(fitted, expected, delta = 0.05)
+
+    def testFitIncreasesLikelihood(self):
+        """ Test that every EM iteration does not decrease the log-likelihood """
+        model = BayesianKnowledgeModel()
+        rows = self.makeAnswers(200, 8, 3)
+        likelihoods = [model.fit([rows], iterations = 1, tolerance = 0) for i in xrange(10)]
+        for before, after in zip(likelihoods, likelihoods[1:]):
+            self.assertGreaterEqual(after, before - 1e-9)
+
+    def testFitRejectsUnorderedLog(self):
+        """ Test that a log not ordered by student is rejected """
+        model = BayesianKnowledgeModel()
+        self.assertRaises(ValueError, model.fit, [self.OBSERVATIONS])
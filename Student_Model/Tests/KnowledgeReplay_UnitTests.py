@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest.case
+from Student_Model.KnowledgeManager import MultiStudentKnowledgeManager
+from Student_Model.KnowledgeReplay import KnowledgeReplay
+
+class KnowledgeReplayTest(unittest.case.TestCase):
+    """ Unit test for KnowledgeReplay, which must match a sequential run of the manager """
+
+    def setUp(self):
+        """ Create events of many students, some with their own ALEKS score """
+        r = random.Random(19)
+        self.events = [('s%d' % r.randint(0, 30), 'Math-%d' % r.randint(1, 4), r.randint(0, 3),
+                        r.randint(0, 3), r.random() < 0.3, r.random()) for i in xrange(2000)]
+        self.aleks = dict(('s%d' % i, r.random()) for i in xrange(0, 30, 3))
+
+    def getSequentialManager(self):
+        km = MultiStudentKnowledgeManager()
+        km.loadGraphDB()
+        km.initKnowledgeGraph()
+        km._knowledgeLevel = {}
+        for studentID, aleks in self.aleks.iteritems():
+            km.setALEKS(studentID, aleks)
+        for event in self.events:
+            km.savePerformance(*event)
+        return km
+
+    def assertLevelsEqual(self, knowledge, expected):
+        self.assertEqual(sorted(knowledge), sorted(expected))
+        for studentID in expected:
+            self.assertEqual(sorted(knowledge[studentID]), sorted(expected[studentID]))
+            for conceptID, level in expected[studentID].iteritems():
+                self.assertAlmostEqual(knowledge[studentID][conceptID], level)
+
+    def testReplayMatchesSequential(self):
+        """ Test that the replay in this process gives the levels of a sequential run """
+        km = self.getSequentialManager()
+        knowledge = KnowledgeReplay(chunkSize=128).replay(self.events, km.getALEKSSettings())
+        self.assertLevelsEqual(knowledge, km._knowledgeLevel)
+
+    def testProcessesMatchSequential(self):
+        """ Test that the replay sharded over processes gives the levels of a sequential run """
+        km = self.getSequentialManager()
+        knowledge = KnowledgeReplay(processes=3, chunkSize=128).replay(self.events, km.getALEKSSettings())
+        self.assertLevelsEqual(knowledge, km._knowledgeLevel)
+
+    def testReplayUsesStudentALEKS(self):
+        """ Test that a student's own ALEKS score changes his/her replayed levels only """
+        events = [('s1', 'Math-1', 1, 0, True, 0.5), ('s2', 'Math-1', 1, 0, True, 0.5)]
+        knowledge = KnowledgeReplay().replay(events, {'s1': (0.9, 0.5)})
+        self.assertNotEqual(knowledge['s1']['Math-1'], knowledge['s2']['Math-1'])
+        self.assertEqual(knowledge['s2'], KnowledgeReplay().replay(events[1:])['s2'])
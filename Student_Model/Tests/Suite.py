@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 import unittest
 import Student_Model.Tests.Concept_UnitTests as Concept_UnitTests
+import Student_Model.Tests.KnowledgeGraph_UnitTests as KnowledgeGraph_UnitTests
+import Student_Model.Tests.KnowledgeManager_UnitTests as KnowledgeManager_UnitTests
+import Student_Model.Tests.KnowledgeModel_UnitTests as KnowledgeModel_UnitTests
+import Student_Model.Tests.KnowledgeReplay_UnitTests as KnowledgeReplay_UnitTests
 
 def TestSuite():
     """
@@ -8,7 +12,8 @@ def TestSuite():
     """
     suite = unittest.TestSuite()
     loader = unittest.TestLoader()
-    modules = [Concept_UnitTests]
+    modules = [Concept_UnitTests, KnowledgeGraph_UnitTests, KnowledgeManager_UnitTests,
+               KnowledgeModel_UnitTests, KnowledgeReplay_UnitTests]
     for m in modules:
         suite.addTests(loader.loadTestsFromModule(m))
     return suite